@@ -10,15 +10,18 @@ from sortedcontainers import SortedSet
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
 
-from extractor.data_extractor import step_1_conflict_distance_extract
+from extractor.data_extractor import step_1_conflict_distance_extract, step_1_conflict_distance_estimate_extract
 from netconfeval.common.model_configs import model_configurations
 
 
-def _plot(results_path: str, figures_path: str, requirements: SortedSet, model: str) -> None:
+def _plot(results_path: str, figures_path: str, requirements: SortedSet, model: str, estimate: bool) -> None:
     requirements_str = "_".join(requirements)
 
     corr = np.corrcoef([[0] * 34 for _ in range(34)])
-    results = step_1_conflict_distance_extract(results_path, requirements, model)
+    if estimate:
+        results = step_1_conflict_distance_estimate_extract(results_path, requirements, model)['estimate']
+    else:
+        results = step_1_conflict_distance_extract(results_path, requirements, model)
     mask = np.tril(np.full_like(corr, 0))
 
     ax = sns.heatmap(
@@ -46,6 +49,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument('--policy_types', choices=["reachability", "waypoint", "loadbalancing"],
                         required=True, nargs='+')
     parser.add_argument('--model', choices=list(model_configurations.keys()), required=True)
+    parser.add_argument('--estimate', action="store_true")
 
     return parser.parse_args()
 
@@ -59,7 +63,7 @@ def main(args: argparse.Namespace) -> None:
 
     os.makedirs(args.figures_path, exist_ok=True)
 
-    _plot(args.results_path, args.figures_path, args.policy_types, args.model)
+    _plot(args.results_path, args.figures_path, args.policy_types, args.model, args.estimate)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,58 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from netconfeval.cli import COMMANDS
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, required=False, default=0.5)
+    parser.add_argument('--n_repeats', type=int, required=False, default=3)
+    parser.add_argument('--commands', choices=list(COMMANDS.keys()), required=False, nargs='+',
+                        default=list(COMMANDS.keys()))
+
+    return parser.parse_args()
+
+
+def _best_time(argv: list[str], n_repeats: int) -> float:
+    best = float('inf')
+    for _ in range(n_repeats):
+        start_time = time.perf_counter()
+        subprocess.run(argv, cwd=REPO_ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start_time)
+
+    return best
+
+
+def main(args: argparse.Namespace) -> None:
+    baseline = _best_time([sys.executable, "-c", "pass"], args.n_repeats)
+    print(f"Interpreter start-up: {baseline:.3f}s")
+
+    over_budget = []
+    for command in args.commands:
+        import_time = _best_time(
+            [sys.executable, "-c", f"import {COMMANDS[command]}"], args.n_repeats
+        ) - baseline
+        help_time = _best_time(
+            [sys.executable, "-m", "netconfeval", command, "--help"], args.n_repeats
+        ) - baseline
+        print(f"{command}: import {import_time:.3f}s, --help {help_time:.3f}s")
+
+        if help_time > args.budget:
+            over_budget.append(command)
+
+    if over_budget:
+        print(f"Commands over the budget of {args.budget:.3f}s: {', '.join(over_budget)}")
+        print("Run `python3 -X importtime -m netconfeval <command> --help` to find the slow imports.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,95 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from netconfeval.common.trace_logging import Lazy, experiment_logging, trace_work_items
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_chunks', type=int, required=False, default=2000)
+    parser.add_argument('--batch_size', type=int, required=False, default=50)
+
+    return parser.parse_args()
+
+
+def _chunk(batch_size: int) -> dict:
+    # A chunk of the largest Step 1 batches, with each requirement type
+    expected_spec = {"reachability": {}, "waypoint": {}, "loadbalancing": {}}
+    human_language = []
+    for i in range(batch_size):
+        expected_spec["reachability"][f"router{i}"] = [f"100.0.{i}.0/24"]
+        expected_spec["waypoint"][f"(router{i},100.0.{i}.0/24)"] = [f"switch{i}"]
+        expected_spec["loadbalancing"][f"(router{i},100.0.{i}.0/24)"] = 2
+        human_language.append(f"Traffic from router{i} to 100.0.{i}.0/24 goes via switch{i} on 2 paths.")
+
+    return {'iteration': 0, 'chunk': 0, 'expected_spec': expected_spec, 'human_language': human_language}
+
+
+def _log_eager(work_item: dict) -> None:
+    # How the drivers logged each chunk before the trace sink
+    logging.warning(f"==== RUN #{work_item['iteration'] + 1} (CHUNK #{work_item['chunk'] + 1}) ====")
+    logging.warning("Expected Result: " + json.dumps(work_item['expected_spec'], indent=4))
+    logging.warning("Human Translation: " + " ".join(work_item['human_language']))
+    logging.warning("LLM Result: " + str(work_item['expected_spec']))
+
+
+def _log_lazy(work_item: dict) -> None:
+    logging.warning(f"==== RUN #{work_item['iteration'] + 1} (CHUNK #{work_item['chunk'] + 1}) ====")
+    logging.warning("Expected Result: %s", Lazy(json.dumps, work_item['expected_spec'], indent=4))
+    logging.warning("Human Translation: %s", Lazy(" ".join, work_item['human_language']))
+    logging.warning("LLM Result: %s", work_item['expected_spec'])
+
+
+def _run(log_chunk: callable, work_item: dict, n_chunks: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(n_chunks):
+        log_chunk(work_item)
+
+    return (time.perf_counter() - start_time) / n_chunks
+
+
+def main(args: argparse.Namespace) -> None:
+    work_item = _chunk(args.batch_size)
+
+    with tempfile.TemporaryDirectory() as log_path, open(os.devnull, 'w') as devnull:
+        logging.basicConfig(
+            format='[%(levelname)s] %(message)s', level=logging.INFO, handlers=[logging.StreamHandler(devnull)]
+        )
+
+        # Synchronous handlers, as the drivers added them before the trace sink
+        file_handler = logging.FileHandler(os.path.join(log_path, "log-sync.log"))
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        file_handler.setLevel(logging.WARNING)
+        logging.root.addHandler(file_handler)
+        sync_time = _run(_log_eager, work_item, args.n_chunks)
+        logging.root.removeHandler(file_handler)
+        file_handler.close()
+
+        results = {'sync handlers, eager messages': (sync_time, sync_time)}
+        for log_format in ['text', 'jsonl']:
+            start_time = time.perf_counter()
+            with experiment_logging(log_path, log_format, log_format):
+                caller_time = _run(trace_work_items(_log_lazy, ['iteration', 'chunk']), work_item, args.n_chunks)
+            # Including the time to drain the queue when the experiment ends
+            total_time = (time.perf_counter() - start_time) / args.n_chunks
+            results[f"queue, lazy messages, {log_format} file"] = (caller_time, total_time)
+
+        logging.root.setLevel(logging.ERROR)
+        for name, log_chunk in [('disabled level, eager messages', _log_eager),
+                                ('disabled level, lazy messages', _log_lazy)]:
+            disabled_time = _run(log_chunk, work_item, args.n_chunks)
+            results[name] = (disabled_time, disabled_time)
+
+    for name, (caller_time, total_time) in results.items():
+        print(f"{name}: {caller_time * 1e6:.0f}us per chunk in the work item, {total_time * 1e6:.0f}us in total")
+
+
+if __name__ == "__main__":
+    main(parse_args())
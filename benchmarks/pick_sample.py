@@ -0,0 +1,105 @@
+import argparse
+import copy
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sortedcontainers import SortedSet
+
+from netconfeval.common.utils import PolicyIndex, load_csv, pick_sample
+
+POLICY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets", "step_1_policies.csv")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--policy_file', type=str, required=False, default=POLICY_FILE)
+    parser.add_argument('--scales', type=int, nargs='+', required=False, default=[1, 4, 16])
+    parser.add_argument('--n_runs', type=int, required=False, default=10)
+    parser.add_argument('--batch_size', type=int, required=False, default=100)
+
+    return parser.parse_args()
+
+
+def _pick_sample_scan(n: int, requirements: list, it: int, policy_types: SortedSet[str]) -> list:
+    # What `pick_sample` did before the policy index, scanning the dataset for each waypoint sample
+    random.seed(5000 + it)
+    shuffled_list = sorted(requirements, key=lambda k: random.random())
+    if len(policy_types) == 1 and "reachability" in policy_types:
+        return [x for x in shuffled_list if x["type"] == "reachability"][:n]
+
+    n_per_requirement = math.ceil(n / len(policy_types))
+    waypoint_samples = [x for x in shuffled_list if x["type"] == "waypoint"][:n_per_requirement]
+
+    final_list = []
+    for sample in waypoint_samples:
+        reachability_samples = [
+            x for x in requirements if x["type"] == "reachability" and x["source"] == sample["source"]
+                                       and x["subnet"] == sample["subnet"]
+        ]
+        final_list.append(None if not reachability_samples else reachability_samples.pop())
+        final_list.append(sample)
+
+        if "loadbalancing" in policy_types:
+            loadbalancing_samples = [
+                x for x in requirements
+                if x["type"] == "loadbalancing" and x["source"] == sample["source"] and x["subnet"] == sample["subnet"]
+            ]
+            if loadbalancing_samples:
+                filtered_sample = loadbalancing_samples.pop()
+            else:
+                loadbalancing_samples = [
+                    x for x in requirements if x["type"] == "loadbalancing" and x["source"] == sample["source"]
+                ]
+                filtered_sample = None if not loadbalancing_samples else loadbalancing_samples.pop()
+                filtered_sample["subnet"] = sample["subnet"]
+            final_list.append(filtered_sample)
+
+    return final_list[:n]
+
+
+def _scaled_dataset(dataset: list, scale: int) -> list:
+    # Copies of the dataset with renamed sources, as a larger export of the same network would have
+    scaled = []
+    for copy_index in range(scale):
+        for requirement in dataset:
+            scaled.append({**requirement, "source": f"{requirement['source']}-{copy_index}"})
+
+    return scaled
+
+
+def _run(pick: callable, requirements: list | PolicyIndex, policy_types: SortedSet[str], n_runs: int,
+         n: int) -> (list, float):
+    samples = []
+    start_time = time.perf_counter()
+    for it in range(n_runs):
+        samples.append(copy.deepcopy(pick(n, requirements, it, policy_types)))
+        # The state of the global random generator is used by the drivers after sampling
+        samples.append(random.random())
+
+    return samples, (time.perf_counter() - start_time) / n_runs
+
+
+def main(args: argparse.Namespace) -> None:
+    policy_types = SortedSet(["reachability", "waypoint", "loadbalancing"])
+    dataset = load_csv(args.policy_file, policy_types)
+    n = args.batch_size * len(policy_types)
+
+    for scale in args.scales:
+        scan_dataset = _scaled_dataset(dataset, scale)
+        index_dataset = copy.deepcopy(scan_dataset)
+
+        scan_samples, scan_time = _run(_pick_sample_scan, scan_dataset, policy_types, args.n_runs, n)
+        index_samples, index_time = _run(pick_sample, PolicyIndex(index_dataset), policy_types, args.n_runs, n)
+        identical = scan_samples == index_samples and scan_dataset == index_dataset
+
+        print(f"{len(scan_dataset)} requirements: scan {scan_time * 1e3:.1f}ms, index {index_time * 1e3:.1f}ms "
+              f"per iteration, identical samples: {identical}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
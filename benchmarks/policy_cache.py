@@ -0,0 +1,66 @@
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sortedcontainers import SortedSet
+
+from netconfeval.common.policy_cache import compile_policies, load_policies
+from netconfeval.common.utils import load_csv
+
+POLICY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets", "step_1_policies.csv")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--policy_file', type=str, required=False, default=POLICY_FILE)
+    parser.add_argument('--scales', type=int, nargs='+', required=False, default=[1, 10, 100])
+
+    return parser.parse_args()
+
+
+def _write_scaled_csv(policy_file: str, scale: int, path: str) -> None:
+    # Copies of the policies with renamed sources, as a larger export of the same network would have
+    with open(policy_file, 'r') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+
+    with open(path, 'w') as f:
+        w = csv.DictWriter(f, fieldnames)
+        w.writeheader()
+        for copy_index in range(scale):
+            for row in rows:
+                w.writerow({**row, 'Sources': f"{row['Sources']}-{copy_index}"})
+
+
+def _timed(load: callable) -> (list, float):
+    start_time = time.perf_counter()
+    requirements = load()
+
+    return requirements, time.perf_counter() - start_time
+
+
+def main(args: argparse.Namespace) -> None:
+    policy_types = SortedSet(["reachability", "waypoint", "loadbalancing"])
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        for scale in args.scales:
+            policy_file = os.path.join(tmp_path, f"policies-{scale}.csv")
+            _write_scaled_csv(args.policy_file, scale, policy_file)
+            cache_path = os.path.join(tmp_path, "cache")
+
+            parsed, parse_time = _timed(lambda: load_csv(policy_file, policy_types))
+            _, compile_time = _timed(lambda: compile_policies(policy_file, cache_path))
+            mapped, map_time = _timed(lambda: load_policies(policy_file, policy_types, cache_path))
+
+            print(f"{len(parsed)} requirements: load_csv {parse_time * 1e3:.1f}ms, compile {compile_time * 1e3:.1f}ms, "
+                  f"load_policies {map_time * 1e3:.1f}ms, identical: {parsed == mapped}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
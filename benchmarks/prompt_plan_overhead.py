@@ -0,0 +1,92 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from langchain.chains import LLMChain
+from langchain.memory import ConversationBufferMemory
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from netconfeval.formatters.formatters import step_1_input_formatter, step_1_output_formatter
+from netconfeval.foundation.step.chain_step import ChainStep
+from netconfeval.foundation.step.prompt_plan import PromptPlan
+from netconfeval.prompts.step_1_reachability_waypoint_load import SETUP_PROMPT, FUNCTION_PROMPT, \
+    ASK_FOR_RESULT_PROMPT
+
+RESPONSE = json.dumps({"status": "OK", "result": {"reachability": {"madrid": ["100.0.32.0/24"]}}})
+REQUIREMENTS = "Traffic originating from madrid can reach the subnet 100.0.32.0/24. " * 33
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_calls', type=int, required=False, default=2000)
+
+    return parser.parse_args()
+
+
+def _chain_step(llm: FakeListChatModel, messages: list) -> ChainStep:
+    # What the drivers built for every chunk
+    chain = LLMChain(
+        llm=llm,
+        prompt=ChatPromptTemplate.from_messages(messages),
+        verbose=False,
+        memory=ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    )
+    return ChainStep(llm_chain=chain, input_formatter=step_1_input_formatter, output_formatter=step_1_output_formatter)
+
+
+def _best_time(run: callable, n_calls: int) -> float:
+    best = float('inf')
+    for _ in range(3):
+        start_time = time.perf_counter()
+        for _ in range(n_calls):
+            run()
+        best = min(best, (time.perf_counter() - start_time) / n_calls)
+
+    return best
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.disable(logging.WARNING)
+
+    # The fake model answers immediately, so the measured time is only the overhead of the harness
+    llm = FakeListChatModel(responses=[RESPONSE])
+    for model_type, messages in [
+        ('HF/Ollama', [
+            ("system", f"{SETUP_PROMPT}\n{FUNCTION_PROMPT}\n{ASK_FOR_RESULT_PROMPT}"),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("user", "{input}"),
+        ]),
+        ('openai', [
+            ("system", SETUP_PROMPT),
+            ("system", FUNCTION_PROMPT),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}"),
+            ("system", ASK_FOR_RESULT_PROMPT),
+        ]),
+    ]:
+        prompt_plan = PromptPlan(llm, messages)
+        rendered = prompt_plan.format_messages(**step_1_input_formatter(REQUIREMENTS))
+        model_time = _best_time(lambda: llm.invoke(rendered), args.n_calls)
+
+        chain_time = _best_time(lambda: _chain_step(llm, messages).process(REQUIREMENTS), args.n_calls)
+
+        plan_time = _best_time(
+            lambda: ChainStep(
+                llm_chain=prompt_plan, input_formatter=step_1_input_formatter, output_formatter=step_1_output_formatter
+            ).process(REQUIREMENTS),
+            args.n_calls
+        )
+
+        print(f"{model_type}: model call {model_time * 1e6:.0f}us, harness overhead per call: "
+              f"LLMChain {(chain_time - model_time) * 1e6:.0f}us, PromptPlan {(plan_time - model_time) * 1e6:.0f}us "
+              f"({(chain_time - model_time) / max(plan_time - model_time, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    main(parse_args())
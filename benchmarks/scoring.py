@@ -0,0 +1,114 @@
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from netconfeval.common.scoring import score_spec
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_policies', type=int, nargs='+', required=False, default=[100, 1000, 10000])
+    parser.add_argument('--n_routers', type=int, required=False, default=30)
+    parser.add_argument('--n_calls', type=int, required=False, default=5)
+
+    return parser.parse_args()
+
+
+def _compare_result_scan(expected: dict, result: dict, result_row: dict) -> None:
+    # What `compare_result` did before the set-based scoring (without the logging), waypoint switches were not checked
+    def _reachability(router: str, subnet: str, spec: dict) -> bool:
+        return "reachability" in spec and router in spec["reachability"].keys() and \
+            subnet in spec["reachability"][router]
+
+    def _waypoint(waypoint: str, spec: dict) -> bool:
+        return "waypoint" in spec and waypoint in spec["waypoint"]
+
+    def _loadbalancing(loadbalancing: str, num: int, spec: dict) -> bool:
+        return "loadbalancing" in spec and loadbalancing in spec["loadbalancing"] and \
+            int(spec["loadbalancing"][loadbalancing]) == num
+
+    count_expected = count_res = count_fail = count_wrong = 0
+    for router, subnets in expected.get("reachability", {}).items():
+        for subnet in subnets:
+            count_expected += 1
+            count_fail += not _reachability(router, subnet, result)
+    for waypoint in expected.get("waypoint", {}).keys():
+        count_expected += 1
+        count_fail += not _waypoint(waypoint, result)
+    for loadbalancing, num in expected.get("loadbalancing", {}).items():
+        count_expected += 1
+        count_fail += not _loadbalancing(loadbalancing, num, result)
+
+    for router, subnets in result.get("reachability", {}).items():
+        for subnet in subnets:
+            count_res += 1
+            if not _reachability(router, subnet, expected):
+                count_wrong += "waypoint" not in expected or f"({router},{subnet})" not in expected["waypoint"]
+    for waypoint in result.get("waypoint", {}).keys():
+        count_res += 1
+        count_wrong += not _waypoint(waypoint, expected)
+    for loadbalancing, num in result.get("loadbalancing", {}).items():
+        count_res += 1
+        count_wrong += not _loadbalancing(loadbalancing, num, expected)
+
+    result_row['total'] = count_res
+    result_row['fail'] = count_fail
+    result_row['wrong'] = count_wrong
+    result_row['success'] = count_expected - count_fail
+    result_row['accuracy'] = result_row['success'] / count_expected
+
+
+def _specs(n_policies: int, n_routers: int) -> (dict, dict):
+    # Expected specification with the same number of policies of each type, and a result missing or changing 5% of them
+    rng = random.Random(n_policies)
+    expected = {"reachability": {}, "waypoint": {}, "loadbalancing": {}}
+    result = {"reachability": {}, "waypoint": {}, "loadbalancing": {}}
+    for i in range(n_policies // 3):
+        router = f"router{i % n_routers}"
+        subnet = f"100.{i // 256}.{i % 256}.0/24"
+        expected["reachability"].setdefault(router, []).append(subnet)
+        expected["waypoint"][f"({router},{subnet})"] = [f"switch{i % 7}"]
+        expected["loadbalancing"][f"({router},{subnet})"] = 2
+
+        if rng.random() >= 0.05:
+            result["reachability"].setdefault(router, []).append(subnet)
+        if rng.random() >= 0.05:
+            result["waypoint"][f"({router},{subnet})"] = [f"switch{i % 7}"]
+        result["loadbalancing"][f"({router},{subnet})"] = 2 if rng.random() >= 0.05 else 3
+
+    return expected, result
+
+
+def _best_time(compare: callable, expected: dict, result: dict, n_calls: int) -> (dict, float):
+    best = float('inf')
+    scores = {}
+    for _ in range(n_calls):
+        start_time = time.perf_counter()
+        compare(expected, result, scores)
+        best = min(best, time.perf_counter() - start_time)
+
+    return scores, best
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.disable(logging.WARNING)
+
+    for n_policies in args.n_policies:
+        expected, result = _specs(n_policies, args.n_routers)
+        scan_scores, scan_time = _best_time(_compare_result_scan, expected, result, args.n_calls)
+        set_scores, set_time = _best_time(
+            lambda e, r, row: row.update(score_spec(e, r)), expected, result, args.n_calls
+        )
+        identical = all(scan_scores[column] == set_scores[column] for column in scan_scores)
+
+        print(f"{n_policies} policies: list scan {scan_time * 1e3:.1f}ms, sets {set_time * 1e3:.1f}ms, "
+              f"identical scores: {identical}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
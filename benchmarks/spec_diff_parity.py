@@ -0,0 +1,107 @@
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from deepdiff import DeepDiff
+from sortedcontainers import SortedSet
+
+from netconfeval.common.spec_diff import deepdiff_keys, diff_keys, spec_diff
+from netconfeval.common.utils import PolicyIndex, chunk_list, load_csv, pick_sample, transform_sample_to_expected
+
+POLICY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets", "step_1_policies.csv")
+POLICY_TYPES = [["reachability"], ["reachability", "waypoint"], ["reachability", "waypoint", "loadbalancing"]]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--policy_file', type=str, required=False, default=POLICY_FILE)
+    parser.add_argument('--n_runs', type=int, required=False, default=5)
+    parser.add_argument('--batch_size', type=int, nargs='+', required=False, default=[1, 2, 5, 10, 20, 25, 50, 100])
+    parser.add_argument('--n_results', type=int, required=False, default=3)
+
+    return parser.parse_args()
+
+
+def _expected_specs(args: argparse.Namespace) -> list[dict]:
+    # The expected specifications of the Step 1 dataset, as generated by `dataset/generate_step_1_dataset.py`
+    specs = []
+    for policy_types in POLICY_TYPES:
+        policy_types = SortedSet(policy_types)
+        dataset = PolicyIndex(load_csv(args.policy_file, policy_types))
+        max_n_requirements = max(args.batch_size) * len(policy_types)
+        for it in range(args.n_runs):
+            samples = pick_sample(max_n_requirements, dataset, it, policy_types)
+            for batch_size in args.batch_size:
+                for chunk in chunk_list(samples, batch_size * len(policy_types)):
+                    specs.append(transform_sample_to_expected(chunk))
+
+    return specs
+
+
+def _model_result(expected: dict, rng: random.Random) -> dict:
+    # A result with the mistakes of the models: missing, additional and changed policies, and wrong value types
+    result = copy.deepcopy(expected)
+    for policy_type, policies in list(result.items()):
+        for key in list(policies.keys()):
+            draw = rng.random()
+            if draw < 0.05:
+                del policies[key]
+            elif draw < 0.1 and isinstance(policies[key], list):
+                policies[key] = policies[key] + [f"100.0.{rng.randint(0, 255)}.0/24"]
+            elif draw < 0.15 and isinstance(policies[key], list):
+                policies[key] = policies[key][1:]
+            elif draw < 0.2:
+                policies[key] = policies[key] + 1 if isinstance(policies[key], int) else ["switch"]
+            elif draw < 0.22:
+                policies[key] = str(policies[key])
+        if rng.random() < 0.1:
+            policies["(router,100.0.0.0/24)"] = 2 if policy_type == "loadbalancing" else ["router"]
+        if rng.random() < 0.02:
+            del result[policy_type]
+    if rng.random() < 0.02:
+        result["status"] = "OK"
+
+    return result
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(0)
+    pairs = []
+    for expected in _expected_specs(args):
+        pairs.append((expected, copy.deepcopy(expected)))
+        pairs.extend((expected, _model_result(expected, rng)) for _ in range(args.n_results))
+
+    mismatches = 0
+    deepdiff_time = spec_diff_time = 0
+    for expected, result in pairs:
+        start_time = time.perf_counter()
+        deep = DeepDiff(expected, result, ignore_order=True)
+        deepdiff_time += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        diff = spec_diff(expected, result)
+        spec_diff_time += time.perf_counter() - start_time
+
+        # The diff must be stored as JSON
+        json.dumps(diff)
+        if deepdiff_keys(expected, result, deep) != diff_keys(diff):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"Mismatch:\n  expected: {expected}\n  result: {result}\n  DeepDiff: {deep}\n  spec_diff: {diff}")
+
+    print(f"{len(pairs) - mismatches}/{len(pairs)} diffs with the same policies, "
+          f"DeepDiff {deepdiff_time / len(pairs) * 1e3:.2f}ms, spec_diff {spec_diff_time / len(pairs) * 1e3:.3f}ms "
+          f"per diff")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
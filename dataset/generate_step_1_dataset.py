@@ -5,6 +5,7 @@ import sys
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
+from netconfeval.common.policy_cache import DEFAULT_CACHE_PATH, load_policies
 from netconfeval.common.utils import *
 from netconfeval.prompts.step_1_conflict_detection import FUNCTION_PROMPT
 
@@ -20,6 +21,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument('--n_runs', type=int, required=False, default=5)
     parser.add_argument("--policy_file", type=str, required=False,
                         default=os.path.join("..", "assets", "step_1_policies.csv"))
+    parser.add_argument('--policy_cache', type=str, required=False, default=DEFAULT_CACHE_PATH)
     parser.add_argument(
         '--results_path', type=str, default=os.path.join("..", "datasets")
     )
@@ -41,7 +43,7 @@ def main(args: argparse.Namespace) -> None:
     with open(os.path.join(args.results_path, "step_1_spec_translation.jsonl"), "w") as f:
         for policy_types, batch_sizes in policies_to_batch_sizes.items():
             policy_types = SortedSet(policy_types.split(','))
-            dataset = load_csv(args.policy_file, policy_types)
+            dataset = PolicyIndex(load_policies(args.policy_file, policy_types, args.policy_cache))
 
             n_policy_types = len(policy_types)
             max_n_requirements = max(batch_sizes) * n_policy_types
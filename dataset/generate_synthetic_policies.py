@@ -0,0 +1,122 @@
+import argparse
+import csv
+import logging
+import os
+import random
+import sys
+from collections import deque
+
+import networkx as nx
+
+FIELDNAMES = ["type", "subnet", "specifics", "source", "Destinations", "Environments", "Sources", "Status"]
+MAX_SUBNETS = 256 * 256
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_routers', type=int, required=False, default=1000)
+    parser.add_argument('--degree', type=int, required=False, default=2)
+    parser.add_argument('--n_subnets', type=int, required=False, default=100)
+    parser.add_argument('--reachability_density', type=float, required=False, default=0.05)
+    parser.add_argument('--waypoint_density', type=float, required=False, default=0.5)
+    parser.add_argument('--loadbalancing_density', type=float, required=False, default=0.5)
+    parser.add_argument('--seed', type=int, required=False, default=0)
+    parser.add_argument(
+        '--results_path', type=str, default=os.path.join("..", "datasets")
+    )
+
+    return parser.parse_args()
+
+
+def _shortest_paths(graph: nx.Graph, destination: int) -> (dict[int, list[int]], dict[int, int]):
+    # Next hops towards `destination` and number of shortest paths of each router, as routed with ECMP
+    distance = {destination: 0}
+    next_hops = {destination: []}
+    n_paths = {destination: 1}
+    queue = deque([destination])
+    while queue:
+        router = queue.popleft()
+        for neighbor in graph.adj[router]:
+            if neighbor not in distance:
+                distance[neighbor] = distance[router] + 1
+                next_hops[neighbor] = []
+                n_paths[neighbor] = 0
+                queue.append(neighbor)
+            if distance[neighbor] == distance[router] + 1:
+                next_hops[neighbor].append(router)
+                n_paths[neighbor] += n_paths[router]
+
+    return next_hops, n_paths
+
+
+def _waypoints(source: int, next_hops: dict[int, list[int]]) -> list[int]:
+    # Routers crossed by all the shortest paths from `source`, where they converge (including the destination)
+    waypoints = []
+    frontier = {source}
+    while frontier:
+        frontier = {next_hop for router in frontier for next_hop in next_hops[router]}
+        if len(frontier) == 1:
+            waypoints.extend(frontier)
+
+    return waypoints
+
+
+def _policy_row(policy_type: str, subnet: str, specifics: any, source: str) -> list:
+    return [f"PolicyType.{policy_type}", subnet, specifics, source, f"{{{subnet}}}", "{0}", source, "PolicyStatus.HOLDS"]
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    if args.n_subnets > MAX_SUBNETS:
+        raise Exception(f"At most {MAX_SUBNETS} subnets are supported, got {args.n_subnets}.")
+
+    rng = random.Random(args.seed)
+    graph = nx.barabasi_albert_graph(args.n_routers, args.degree, seed=args.seed)
+    routers = [f"router{i}" for i in range(args.n_routers)]
+
+    os.makedirs(args.results_path, exist_ok=True)
+    policy_file = os.path.join(args.results_path, "step_1_synthetic_policies.csv")
+
+    counts = {"reachability": 0, "waypoint": 0, "loadbalancing": 0}
+    with open(policy_file, "w", newline='') as f:
+        w = csv.writer(f)
+        w.writerow(FIELDNAMES)
+
+        # Rows are written for a subnet at a time, so the policies are never all in memory
+        for i in range(args.n_subnets):
+            subnet = f"100.{i // 256}.{i % 256}.0/24"
+            destination = rng.randrange(args.n_routers)
+            logging.info(f"Generating policies of subnet {subnet} on {routers[destination]} "
+                         f"({i + 1}/{args.n_subnets})...")
+
+            next_hops, n_paths = _shortest_paths(graph, destination)
+            for source in range(args.n_routers):
+                if source == destination or rng.random() >= args.reachability_density:
+                    continue
+
+                w.writerow(_policy_row("Reachability", subnet, 0, routers[source]))
+                counts["reachability"] += 1
+
+                # A waypoint always has a load balancing policy on the same subnet, as expected by `pick_sample`
+                has_waypoint = rng.random() < args.waypoint_density
+                if has_waypoint:
+                    waypoint = rng.choice(_waypoints(source, next_hops))
+                    w.writerow(_policy_row("Waypoint", subnet, routers[waypoint], routers[source]))
+                    counts["waypoint"] += 1
+                if has_waypoint or rng.random() < args.loadbalancing_density:
+                    w.writerow(_policy_row("LoadBalancingSimple", subnet, n_paths[source], routers[source]))
+                    counts["loadbalancing"] += 1
+
+    logging.info(f"Generated {counts['reachability']} reachability, {counts['waypoint']} waypoint and "
+                 f"{counts['loadbalancing']} load balancing policies in `{policy_file}`.")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -3,9 +3,12 @@ import glob
 import json
 import os
 from collections import OrderedDict
+from typing import Iterable
 
 from sortedcontainers import SortedSet
 
+from netconfeval.common.results_store import find_results
+
 
 def step_1_translation_extract(results_path: str, requirements: set | SortedSet, model_name: str, metric: str) -> dict:
     if metric not in ['accuracy', 'cost']:
@@ -13,14 +16,11 @@ def step_1_translation_extract(results_path: str, requirements: set | SortedSet,
 
     requirements_str = "_".join(SortedSet(requirements))
 
-    results_files_list = glob.glob(
-        os.path.join(results_path, f"result-{model_name}-{requirements_str}-*.csv")
-    )
-    if len(results_files_list) == 0:
+    rows = find_results(results_path, "translation", f"{model_name}-{requirements_str}-*")
+    if rows is None:
         return {}
 
-    results_file = results_files_list.pop()
-    return _step_1_translation_extract_by_metric(results_file, metric)
+    return _step_1_translation_extract_by_metric(rows, metric)
 
 
 def step_1_function_call_extract(
@@ -31,14 +31,13 @@ def step_1_function_call_extract(
 
     requirements_str = "_".join(SortedSet(requirements))
 
-    results_files_list = glob.glob(
-        os.path.join(results_path, f"result-{model_name}-{function_call_type}-{requirements_str}-function-*.csv")
+    rows = find_results(
+        results_path, "function-call", f"{model_name}-{function_call_type}-{requirements_str}-function-*"
     )
-    if len(results_files_list) == 0:
+    if rows is None:
         return {}
 
-    results_file = results_files_list.pop()
-    return _step_1_translation_extract_by_metric(results_file, metric)
+    return _step_1_translation_extract_by_metric(rows, metric)
 
 
 def step_1_conflict_detection_extract(
@@ -49,63 +48,76 @@ def step_1_conflict_detection_extract(
 
     requirements_str = "_".join(SortedSet(requirements))
 
-    results_files_list = glob.glob(
-        os.path.join(results_path, f"result-{model_name}-{requirements_str}-conflict-*.csv")
-    )
-
-    if len(results_files_list) == 0:
+    rows = find_results(results_path, "conflict-detection", f"{model_name}-{requirements_str}-conflict-*")
+    if rows is None:
         return {}
 
-    results_file = results_files_list.pop()
-    return _step_1_conflict_detection_extract_by_metric(results_file, metric)
+    return _step_1_conflict_detection_extract_by_metric(rows, metric)
 
 
 def step_1_conflict_distance_extract(results_path: str, requirements: set | SortedSet, model_name: str) -> list:
     requirements_str = "_".join(SortedSet(requirements))
 
-    results_files_list = glob.glob(
-        os.path.join(results_path, f"result-{model_name}-{requirements_str}-conflict_distance-*.csv")
+    rows = find_results(
+        results_path, "conflict-distance", f"{model_name}-{requirements_str}-conflict_distance-*",
+        ["index_start", "index_end"],
+        {"conflict_detect": True}
     )
 
     data = [[0] * 34 for _ in range(34)]
-    if len(results_files_list) == 0:
+    if rows is None:
+        return data
+
+    for res in rows:
+        data[int(res["index_start"])][int(res["index_end"]) - int(res["index_start"])] += 1
+
+    return data
+
+
+def step_1_conflict_distance_estimate_extract(
+        results_path: str, requirements: set | SortedSet, model_name: str
+) -> dict:
+    requirements_str = "_".join(SortedSet(requirements))
+
+    estimate_files_list = glob.glob(
+        os.path.join(results_path, f"estimate-{model_name}-{requirements_str}-conflict_distance-*.csv")
+    )
+
+    # Same scale of `step_1_conflict_distance_extract`, the number of detections over all the work items of a cell
+    data = {key: [[0] * 34 for _ in range(34)] for key in ['estimate', 'ci_low', 'ci_high']}
+    if len(estimate_files_list) == 0:
         return data
 
-    results_file = results_files_list.pop()
+    estimate_file = estimate_files_list.pop()
 
-    with open(results_file, "r") as file:
+    with open(estimate_file, "r") as file:
         reader = csv.DictReader(file)
         for res in reader:
-            if res["conflict_detect"] == "True":
-                data[int(res["index_start"])][int(res["index_end"]) - int(res["index_start"])] += 1
+            for key in data.keys():
+                data[key][int(res["index_start"])][int(res["distance"])] = \
+                    float(res[key]) * int(res["n_population"])
 
     return data
 
 
 def step_2_code_gen_extract(results_path: str, prompt: str, feedback: str, model_name: str) -> OrderedDict:
-    results_files_list = glob.glob(
-        os.path.join(results_path, f"result-{model_name}-*-{prompt}-{feedback}-*.csv")
-    )
-    if len(results_files_list) == 0:
+    rows = find_results(results_path, "code-gen", f"{model_name}-*-{prompt}-{feedback}-*")
+    if rows is None:
         return OrderedDict()
 
-    results_file = results_files_list.pop()
-
     data = OrderedDict()
-    with open(results_file, 'r') as file:
-        reader = csv.DictReader(file)
-        for res in reader:
-            if res["policy"]:
-                policy = res["policy"]
-                if policy not in data:
-                    data[policy] = {}
-                    data[policy]["time"] = []
-                    data[policy]["feedback_num"] = []
-                    data[policy]["total_cost"] = []
-
-                data[policy]["time"].append(float(res["time"]))
-                data[policy]["feedback_num"].append(float(res["feedback_num"]))
-                data[policy]["total_cost"].append(float(res["total_cost"]) if "total_cost" in res else 0)
+    for res in rows:
+        if res["policy"]:
+            policy = res["policy"]
+            if policy not in data:
+                data[policy] = {}
+                data[policy]["time"] = []
+                data[policy]["feedback_num"] = []
+                data[policy]["total_cost"] = []
+
+            data[policy]["time"].append(float(res["time"]))
+            data[policy]["feedback_num"].append(float(res["feedback_num"]))
+            data[policy]["total_cost"].append(float(res["total_cost"]) if "total_cost" in res else 0)
 
     return data
 
@@ -117,98 +129,90 @@ def step_3_low_level_extract(results_path: str, model_name: str, mode: str, rag_
     elif rag_size is not None:
         raise Exception("You must specify `rag_size` only when mode is `rag`!")
 
-    results_files_list = glob.glob(
-        os.path.join(results_path, f"result-{model_name}-{mode}{rag_lbl}*.csv")
+    rows = find_results(
+        results_path, "low-level", f"{model_name}-{mode}{rag_lbl}*", ["scenario_name", "iteration", "result"]
     )
-    if len(results_files_list) == 0:
+    if rows is None:
         return {}
 
-    results_file = results_files_list.pop()
-
     data = {}
-    with open(results_file, 'r') as file:
-        reader = csv.DictReader(file)
-        for res in reader:
-            scenario_name = res["scenario_name"]
-            if scenario_name not in data:
-                data[scenario_name] = {}
+    for res in rows:
+        scenario_name = res["scenario_name"]
+        if scenario_name not in data:
+            data[scenario_name] = {}
 
-            it = int(res["iteration"])
-            data[scenario_name][it] = json.loads(res["result"])
+        it = int(res["iteration"])
+        data[scenario_name][it] = json.loads(res["result"])
 
     return data
 
 
-def _step_1_translation_extract_by_metric(file_path: str, metric: str) -> dict:
+def _step_1_translation_extract_by_metric(rows: Iterable[dict], metric: str) -> dict:
     data = {}
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        for res in reader:
-            n_req = int(res["batch_size"])
-
-            if n_req not in data:
-                data[n_req] = {
-                    "batch_size": int(res["batch_size"]),
-                    "n_policy_types": int(res["n_policy_types"]),
-                    "max_n_requirements": int(res["max_n_requirements"]),
-                    "data": {},
-                }
-
-            it = int(res["iteration"])
-            if it not in data[n_req]["data"]:
-                data[n_req]["data"][it] = []
-
-            if metric == "accuracy":
-                data[n_req]["data"][it].append(float(res["accuracy"]))
-            elif metric == "cost":
-                cost = float(res["total_cost"]) / (int(n_req) * int(res["n_policy_types"]))
-                if cost == 0:
-                    continue
-                data[n_req]["data"][it].append(cost)
+    for res in rows:
+        n_req = int(res["batch_size"])
+
+        if n_req not in data:
+            data[n_req] = {
+                "batch_size": int(res["batch_size"]),
+                "n_policy_types": int(res["n_policy_types"]),
+                "max_n_requirements": int(res["max_n_requirements"]),
+                "data": {},
+            }
+
+        it = int(res["iteration"])
+        if it not in data[n_req]["data"]:
+            data[n_req]["data"][it] = []
+
+        if metric == "accuracy":
+            data[n_req]["data"][it].append(float(res["accuracy"]))
+        elif metric == "cost":
+            cost = float(res["total_cost"]) / (int(n_req) * int(res["n_policy_types"]))
+            if cost == 0:
+                continue
+            data[n_req]["data"][it].append(cost)
 
     return data
 
 
-def _step_1_conflict_detection_extract_by_metric(file_path: str, metric: str) -> dict:
+def _step_1_conflict_detection_extract_by_metric(rows: Iterable[dict], metric: str) -> dict:
     data = {}
 
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        for res in reader:
-            n_req = int(res["batch_size"])
-
-            if n_req not in data:
-                data[n_req] = {
-                    "batch_size": int(res["batch_size"]),
-                    "n_policy_types": int(res["n_policy_types"]),
-                    "max_n_requirements": int(res["max_n_requirements"]),
-                    "TP": {},
-                    "FP": {},
-                    "FN": {},
-                    "TN": {},
-                }
-
-            it = int(res["iteration"])
-
-            if it not in data[n_req]["TP"]:
-                data[n_req]["TP"][it] = 0
-            if it not in data[n_req]["FN"]:
-                data[n_req]["FN"][it] = 0
-            if it not in data[n_req]["FP"]:
-                data[n_req]["FP"][it] = 0
-            if it not in data[n_req]["TN"]:
-                data[n_req]["TN"][it] = 0
-
-            if res["conflict_exist"] == "True":
-                if res["conflict_detect"] == "True":
-                    data[n_req]["TP"][it] += 1
-                else:
-                    data[n_req]["FN"][it] += 1
+    for res in rows:
+        n_req = int(res["batch_size"])
+
+        if n_req not in data:
+            data[n_req] = {
+                "batch_size": int(res["batch_size"]),
+                "n_policy_types": int(res["n_policy_types"]),
+                "max_n_requirements": int(res["max_n_requirements"]),
+                "TP": {},
+                "FP": {},
+                "FN": {},
+                "TN": {},
+            }
+
+        it = int(res["iteration"])
+
+        if it not in data[n_req]["TP"]:
+            data[n_req]["TP"][it] = 0
+        if it not in data[n_req]["FN"]:
+            data[n_req]["FN"][it] = 0
+        if it not in data[n_req]["FP"]:
+            data[n_req]["FP"][it] = 0
+        if it not in data[n_req]["TN"]:
+            data[n_req]["TN"][it] = 0
+
+        if str(res["conflict_exist"]) == "True":
+            if str(res["conflict_detect"]) == "True":
+                data[n_req]["TP"][it] += 1
+            else:
+                data[n_req]["FN"][it] += 1
+        else:
+            if str(res["conflict_detect"]) == "True":
+                data[n_req]["FP"][it] += 1
             else:
-                if res["conflict_detect"] == "True":
-                    data[n_req]["FP"][it] += 1
-                else:
-                    data[n_req]["TN"][it] += 1
+                data[n_req]["TN"][it] += 1
 
     for n_req, res in data.items():
         res["data"] = []
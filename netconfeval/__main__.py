@@ -0,0 +1,4 @@
+from netconfeval.cli import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import importlib
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Each command is imported only when selected, so the help and the argument parsing do not load any model backend
+COMMANDS = {
+    'translation': 'netconfeval.step_1_formal_spec_translation',
+    'conflict-detection': 'netconfeval.step_1_formal_spec_conflict_detection',
+    'conflict-distance': 'netconfeval.step_1_formal_spec_conflict_distance',
+    'function-call': 'netconfeval.step_1_function_call',
+    'code-gen': 'netconfeval.step_2_code_gen',
+    'low-level': 'netconfeval.step_3_low_level',
+    'matrix': 'netconfeval.matrix_runner',
+    'distributed': 'netconfeval.distributed',
+    'compile-policies': 'netconfeval.compile_policies',
+    'rescore': 'netconfeval.rescore',
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="netconfeval")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command in COMMANDS:
+        # The arguments (and the help) of each command are handled by the parser of its module
+        subparsers.add_parser(command, add_help=False)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> None:
+    args, command_argv = build_parser().parse_known_args(argv)
+
+    module = importlib.import_module(COMMANDS[args.command])
+    command_parser = module.build_parser()
+    command_parser.prog = f"netconfeval {args.command}"
+
+    module.main(command_parser.parse_args(command_argv))
+
+
+if __name__ == "__main__":
+    main()
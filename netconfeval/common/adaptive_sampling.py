@@ -0,0 +1,134 @@
+import math
+import random
+
+DEFAULT_TARGET_HALF_WIDTH = 0.15
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_PRIOR_STRENGTH = 2
+DEFAULT_MIN_CALLS_PER_CELL = 1
+
+
+def beta_binomial_interval(n: int, alpha: float, beta: float, confidence: float) -> (float, float, float):
+    # Mean, lower and upper quantiles of the number of successes in `n` trials with a Beta(alpha, beta) success rate
+    log_norm = math.lgamma(alpha + beta) - math.lgamma(alpha) - math.lgamma(beta) - math.lgamma(n + alpha + beta)
+    cdf = 0.0
+    low = high = None
+    for x in range(0, n + 1):
+        cdf += math.exp(
+            math.lgamma(n + 1) - math.lgamma(x + 1) - math.lgamma(n - x + 1) +
+            math.lgamma(x + alpha) + math.lgamma(n - x + beta) + log_norm
+        )
+        if low is None and cdf >= (1 - confidence) / 2:
+            low = x
+        if high is None and cdf >= 1 - (1 - confidence) / 2:
+            high = x
+            break
+
+    return n * alpha / (alpha + beta), low, high if high is not None else n
+
+
+class AdaptiveSampler:
+    """Estimates the success rate of each cell of a grid of Bernoulli experiments with a fraction of the trials.
+
+    Each cell has a finite population of trials (the work items of a full sweep), drawn in a random order, and the
+    estimated value is the rate over the whole population. Cells are stratified (e.g., by distance): the rate of a cell
+    has a Beta prior centered on the pooled rate of its stratum, worth `prior_strength` trials, and the trials not run
+    yet are predicted with the resulting Beta-Binomial distribution. The interval collapses to the exact rate when all
+    the trials of a cell are run. Trials are requested for the cells with the widest intervals, until all of them are
+    within `target_half_width`.
+    """
+
+    def __init__(self, cells: dict[tuple, list[int]], strata: dict[tuple, any],
+                 target_half_width: float = DEFAULT_TARGET_HALF_WIDTH, confidence: float = DEFAULT_CONFIDENCE,
+                 prior_strength: float = DEFAULT_PRIOR_STRENGTH, min_calls_per_cell: int = DEFAULT_MIN_CALLS_PER_CELL,
+                 seed: int = 0) -> None:
+        if prior_strength <= 0:
+            raise Exception(f"The prior strength must be positive, got {prior_strength}.")
+
+        rng = random.Random(seed)
+
+        self._pending: dict[tuple, list[int]] = {}
+        for cell, items in cells.items():
+            items = list(items)
+            rng.shuffle(items)
+            self._pending[cell] = items
+        self._population: dict[tuple, int] = {cell: len(items) for cell, items in cells.items()}
+        self._strata: dict[tuple, any] = strata
+        self._target_half_width: float = target_half_width
+        self._confidence: float = confidence
+        self._prior_strength: float = prior_strength
+        self._min_calls_per_cell: int = min_calls_per_cell
+
+        self.n_calls: dict[tuple, int] = {cell: 0 for cell in cells}
+        self.n_successes: dict[tuple, int] = {cell: 0 for cell in cells}
+
+    def record(self, cell: tuple, item: int, success: bool) -> None:
+        if item in self._pending[cell]:
+            self._pending[cell].remove(item)
+        self.n_calls[cell] += 1
+        self.n_successes[cell] += int(success)
+
+    def _stratum_rates(self) -> dict[any, float]:
+        calls = {}
+        successes = {}
+        for cell, stratum in self._strata.items():
+            calls[stratum] = calls.get(stratum, 0) + self.n_calls[cell]
+            successes[stratum] = successes.get(stratum, 0) + self.n_successes[cell]
+
+        return {stratum: (successes[stratum] + 0.5) / (calls[stratum] + 1) for stratum in calls}
+
+    def estimate(self, cell: tuple, stratum_rates: dict[any, float] | None = None) -> (float, float, float):
+        stratum_rates = stratum_rates if stratum_rates is not None else self._stratum_rates()
+        n = self.n_calls[cell]
+        population = self._population[cell]
+        if n >= population:
+            rate = self.n_successes[cell] / population if population else 0.0
+            return rate, rate, rate
+
+        n_successes = self.n_successes[cell]
+        stratum_rate = stratum_rates[self._strata[cell]]
+        mean, low, high = beta_binomial_interval(
+            population - n, n_successes + self._prior_strength * stratum_rate,
+            n - n_successes + self._prior_strength * (1 - stratum_rate), self._confidence
+        )
+
+        return (n_successes + mean) / population, (n_successes + low) / population, (n_successes + high) / population
+
+    def next_round(self, size: int) -> list[tuple[tuple, int]]:
+        # Every cell is first sampled `min_calls_per_cell` times, so each stratum rate is based on all its cells
+        selected = []
+        for cell, items in self._pending.items():
+            n_missing = self._min_calls_per_cell - self.n_calls[cell]
+            selected.extend((cell, item) for item in items[:max(0, n_missing)])
+        if selected:
+            return selected
+
+        stratum_rates = self._stratum_rates()
+        candidates = []
+        for cell, items in self._pending.items():
+            if not items:
+                continue
+
+            _, low, high = self.estimate(cell, stratum_rates)
+            if (high - low) / 2 > self._target_half_width:
+                candidates.append(((high - low) / 2, cell))
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        return [(cell, self._pending[cell][0]) for _, cell in candidates[:size]]
+
+    def intervals(self) -> list[dict]:
+        stratum_rates = self._stratum_rates()
+        rows = []
+        for cell in self._pending.keys():
+            estimate, low, high = self.estimate(cell, stratum_rates)
+            rows.append({
+                'cell': cell,
+                'n_calls': self.n_calls[cell],
+                'n_population': self._population[cell],
+                'n_detected': self.n_successes[cell],
+                'estimate': estimate,
+                'ci_low': low,
+                'ci_high': high,
+            })
+
+        return rows
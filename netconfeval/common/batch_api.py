@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+
+# Batch API requests are billed at half the price of synchronous ones
+BATCH_API_DISCOUNT = 0.5
+BATCH_API_ENDPOINT = "/v1/chat/completions"
+BATCH_API_COMPLETION_WINDOW = "24h"
+DEFAULT_POLL_INTERVAL = 30
+
+_FINAL_STATUSES = ['completed', 'failed', 'expired', 'cancelled']
+# Served responses never change, so the OpenAI client must not retry the failed ones
+_NO_RETRY_HEADERS = {'x-should-retry': "false"}
+
+
+def _request_key(body: dict) -> str:
+    return hashlib.sha256(
+        json.dumps({'messages': body['messages'], 'tools': body.get('tools', None)}, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def chat_request_body(llm: any, messages: list) -> dict:
+    from langchain_openai.chat_models.base import _convert_message_to_dict
+
+    # Same parameters sent by ChatOpenAI, so the replayed request matches the submitted one
+    params = {k: v for k, v in llm._default_params.items() if k != 'stream'}
+    return {**params, 'messages': [_convert_message_to_dict(message) for message in messages]}
+
+
+class BatchResultsTransport(httpx.BaseTransport):
+    """Serves chat completion requests with the responses of a completed batch, matching them by messages and tools.
+
+    Token usage is reported only the first time a response is served, so retries of the same request are not
+    counted as additional cost.
+    """
+
+    def __init__(self, results: dict) -> None:
+        self._results: dict = results
+        self._served: set = set()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("/chat/completions"):
+            return _error_response(request, 404, f"Request to `{request.url.path}` not supported in Batch API mode!")
+
+        key = _request_key(json.loads(request.content))
+        if key not in self._results:
+            return _error_response(request, 404, "Request not found in the Batch API results!")
+
+        status_code, body = self._results[key]
+        if key in self._served and 'usage' in body:
+            body = {**body, 'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}}
+        self._served.add(key)
+
+        return httpx.Response(status_code, json=body, headers=_NO_RETRY_HEADERS, request=request)
+
+
+def _error_response(request: httpx.Request, status_code: int, message: str) -> httpx.Response:
+    return httpx.Response(
+        status_code, json={'error': {'message': message, 'type': "batch_error"}}, headers=_NO_RETRY_HEADERS,
+        request=request
+    )
+
+
+def _read_results(client: any, file_id: str | None, results: dict, custom_ids: dict) -> None:
+    if file_id is None:
+        return
+
+    for line in client.files.content(file_id).text.splitlines():
+        if not line.strip():
+            continue
+
+        output = json.loads(line)
+        key = custom_ids[output['custom_id']]
+        if output.get('response', None) is not None:
+            results[key] = (output['response']['status_code'], output['response']['body'])
+        else:
+            # Requests that failed in the batch (e.g., expired) are reported as errors of the model
+            error = output.get('error', None) or {}
+            results[key] = (500, {'error': {'message': error.get('message', "Request failed in the batch."),
+                                            'type': "batch_error", 'code': error.get('code', None)}})
+
+
+def run_batch(client: any, bodies: list[dict], poll_interval: int = DEFAULT_POLL_INTERVAL) -> dict:
+    custom_ids = {}
+    with tempfile.NamedTemporaryFile('w', suffix=".jsonl", delete=False) as f:
+        for body in bodies:
+            key = _request_key(body)
+            # Identical requests (e.g., chunks with the same requirements) are only submitted once
+            if key in custom_ids.values():
+                continue
+
+            custom_id = f"request-{len(custom_ids)}"
+            custom_ids[custom_id] = key
+            f.write(json.dumps({'custom_id': custom_id, 'method': "POST", 'url': BATCH_API_ENDPOINT, 'body': body}))
+            f.write("\n")
+        requests_path = f.name
+
+    try:
+        with open(requests_path, 'rb') as f:
+            input_file = client.files.create(file=f, purpose="batch")
+    finally:
+        os.remove(requests_path)
+
+    batch = client.batches.create(
+        input_file_id=input_file.id, endpoint=BATCH_API_ENDPOINT, completion_window=BATCH_API_COMPLETION_WINDOW
+    )
+    logging.info(f"Submitted batch `{batch.id}` with {len(custom_ids)} requests.")
+
+    while batch.status not in _FINAL_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        if batch.request_counts is not None:
+            logging.info(f"Batch `{batch.id}` is {batch.status}: {batch.request_counts.completed}/"
+                         f"{batch.request_counts.total} completed, {batch.request_counts.failed} failed.")
+
+    if batch.status != 'completed':
+        raise Exception(f"Batch `{batch.id}` terminated with status `{batch.status}`: {batch.errors}")
+
+    results = {}
+    _read_results(client, batch.output_file_id, results, custom_ids)
+    _read_results(client, batch.error_file_id, results, custom_ids)
+
+    return results
+
+
+def get_batch_results_client(model_config: dict, bodies: list[dict],
+                             poll_interval: int = DEFAULT_POLL_INTERVAL) -> httpx.Client:
+    if model_config['type'] != 'openai':
+        raise Exception(f"Batch API mode not supported on type `{model_config['type']}`!")
+
+    from openai import OpenAI
+
+    results = run_batch(OpenAI(), bodies, poll_interval)
+
+    return httpx.Client(transport=BatchResultsTransport(results))
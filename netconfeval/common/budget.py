@@ -0,0 +1,133 @@
+import argparse
+import logging
+import time
+from typing import Callable
+
+from netconfeval.common.model_configs import model_configurations
+from netconfeval.common.utils import result_key
+
+DEFAULT_BUDGET_WARNING = 0.8
+# Completed work items needed before stopping on a projection rather than on the actual spending
+MIN_PROJECTION_ITEMS = 5
+
+
+def messages_text(messages: list) -> str:
+    """Returns the text of the messages of a prompt, either LangChain messages, (role, content) tuples or dicts."""
+    contents = []
+    for message in messages:
+        if isinstance(message, tuple):
+            content = message[1]
+        elif isinstance(message, dict):
+            content = message.get('content')
+        else:
+            content = message.content
+        if isinstance(content, str):
+            contents.append(content)
+
+    return "\n".join(contents)
+
+
+class BudgetGuard:
+    """Stops a run before it exceeds its cost (in USD) or wall time (in seconds) budget.
+
+    The totals of the run are projected from the completed work items: the cost and time per prompt token observed so
+    far are applied to the tokens of the remaining work items, counted with tiktoken on the text of the prompt that
+    each work item sends to the model (`prompt_text`). A warning is logged once when
+    a projected total exceeds `warning` times its budget, and the run stops when it exceeds the budget itself.
+    """
+
+    def __init__(self, model_name: str, key_columns: list[str], prompt_text: Callable[[dict], str],
+                 max_cost: float | None = None, max_wall_time: float | None = None,
+                 warning: float = DEFAULT_BUDGET_WARNING) -> None:
+        self._model_name: str = model_name
+        self._key_columns: list[str] = key_columns
+        self._max_cost: float | None = max_cost
+        self._max_wall_time: float | None = max_wall_time
+        self._warning: float = warning
+        self._prompt_text: Callable[[dict], str] = prompt_text
+
+        self._start: float = time.time()
+        self._pending: dict[tuple, int] = {}
+        self._pending_tokens: int = 0
+        self._done_tokens: int = 0
+        self._n_done: int = 0
+        self._cost: float = 0.0
+        self._warned: set[str] = set()
+        self._stopped: bool = False
+
+    def plan(self, work_items: list[dict]) -> None:
+        """Adds work items to the ones that are still to be run."""
+        if self._max_cost is None and self._max_wall_time is None:
+            return
+
+        from netconfeval.common.rate_limiter import count_tokens
+
+        for work_item in work_items:
+            key = result_key(work_item, self._key_columns)
+            if key not in self._pending:
+                # Items have at least a token, so the ones without a prompt text are still counted
+                self._pending[key] = max(1, count_tokens(self._model_name, self._prompt_text(work_item)))
+                self._pending_tokens += self._pending[key]
+
+    def projection(self) -> (float, float):
+        """Returns the projected total cost and wall time of the run."""
+        elapsed = time.time() - self._start
+        if self._done_tokens == 0:
+            return self._cost, elapsed
+
+        ratio = self._pending_tokens / self._done_tokens
+
+        return self._cost * (1 + ratio), elapsed * (1 + ratio)
+
+    def _check(self, name: str, spent: float, projected: float, budget: float | None, unit: str) -> None:
+        if budget is None or self._stopped:
+            return
+
+        if spent >= budget or (self._n_done >= MIN_PROJECTION_ITEMS and projected > budget):
+            self._stopped = True
+            logging.error(f"Projected {name} {projected:.2f}{unit} exceeds the budget of {budget:.2f}{unit} "
+                          f"({spent:.2f}{unit} so far), stopping after {self._n_done} work items. "
+                          f"Use `--resume` to complete the run.")
+        elif projected > budget * self._warning and name not in self._warned:
+            self._warned.add(name)
+            logging.warning(f"Projected {name} {projected:.2f}{unit} exceeds {self._warning:.0%} of the budget of "
+                            f"{budget:.2f}{unit} ({spent:.2f}{unit} after {self._n_done} work items).")
+
+    def record(self, result_row: dict) -> None:
+        tokens = self._pending.pop(result_key(result_row, self._key_columns), 0)
+        self._pending_tokens -= tokens
+        self._done_tokens += tokens
+        self._n_done += 1
+        self._cost += float(result_row.get('total_cost') or 0)
+
+        projected_cost, projected_time = self.projection()
+        self._check('cost', self._cost, projected_cost, self._max_cost, " USD")
+        self._check('wall time', time.time() - self._start, projected_time, self._max_wall_time, "s")
+
+    def track(self, write_row: Callable[[dict], None]) -> Callable[[dict], None]:
+        """Wraps the function writing the result rows, so each written row is recorded."""
+
+        def _write_row(result_row: dict) -> None:
+            write_row(result_row)
+            self.record(result_row)
+
+        return _write_row
+
+    def exhausted(self) -> bool:
+        if not self._stopped and self._max_wall_time is not None and time.time() - self._start >= self._max_wall_time:
+            self._stopped = True
+            logging.error(f"Wall time budget of {self._max_wall_time:.2f}s exhausted, stopping after {self._n_done} "
+                          f"work items. Use `--resume` to complete the run.")
+
+        return self._stopped
+
+
+def budget_guard(args: argparse.Namespace, work_items: list[dict], key_columns: list[str],
+                 prompt_text: Callable[[dict], str]) -> BudgetGuard:
+    model_name = model_configurations[args.model].get('model_name', args.model)
+    guard = BudgetGuard(
+        model_name, key_columns, prompt_text, args.max_cost, args.max_wall_time, args.budget_warning
+    )
+    guard.plan(work_items)
+
+    return guard
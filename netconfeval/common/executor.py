@@ -0,0 +1,55 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+
+async def _run_ordered(work_items: Iterable, worker: Callable, concurrency: int, callback: Callable,
+                       should_stop: Callable[[], bool] | None) -> None:
+    loop = asyncio.get_running_loop()
+
+    async def _run_item(index: int, work_item: any) -> (int, any):
+        # Each work item runs in a fresh copy of the context, so callbacks relying on context vars
+        # (e.g., `get_openai_callback`) only see the calls performed by that item.
+        ctx = contextvars.copy_context()
+        result = await loop.run_in_executor(pool, functools.partial(ctx.run, worker, work_item))
+        return index, result
+
+    items = enumerate(work_items)
+    running = set()
+    completed = {}
+    next_index = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        try:
+            while True:
+                # Work items are taken from the iterable only when a worker is free, so a lazy plan is never
+                # materialized. Items already running when the run is stopped are completed and handed to the callback
+                while len(running) < concurrency and (should_stop is None or not should_stop()):
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    running.add(asyncio.create_task(_run_item(*item)))
+                if not running:
+                    break
+
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, result = task.result()
+                    completed[index] = result
+
+                # Results are handed to the callback in submission order, as soon as the prefix is complete
+                while next_index in completed:
+                    callback(completed.pop(next_index))
+                    next_index += 1
+        finally:
+            for task in running:
+                task.cancel()
+
+
+def run_ordered(work_items: Iterable, worker: Callable, concurrency: int, callback: Callable,
+                should_stop: Callable[[], bool] | None = None) -> None:
+    if concurrency < 1:
+        raise Exception(f"Concurrency must be at least 1, got {concurrency}.")
+
+    asyncio.run(_run_ordered(work_items, worker, concurrency, callback, should_stop))
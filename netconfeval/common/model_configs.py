@@ -1,3 +1,5 @@
+import gc
+import sys
 from typing import Any
 
 
@@ -157,35 +159,110 @@ def _build_llama3_prompt(messages):
     return prompt
 
 
-def get_model_instance(model_name: str) -> Any:
-    if model_configurations[model_name]['type'] == 'HF':
-        from netconfeval.foundation.langchain.chat_models.hf import ChatHF
+def _load_hf_model(model_config: dict, cache: Any, http_client: Any) -> Any:
+    from netconfeval.foundation.langchain.chat_models.hf import ChatHF
+
+    return ChatHF(
+        model_name=model_config['model_name'],
+        max_length=model_config['max_length'],
+        use_quantization=model_config['use_quantization'],
+        prompt_func=model_config['prompt_builder'],
+        batch_size=model_config.get('batch_size', 1),
+        prefix_cache_size=model_config.get('prefix_cache_size', 0) * 1024 * 1024,
+        stop_on_json=model_config.get('stop_on_json', True),
+        cache=cache,
+    )
+
+
+def _load_ollama_model(model_config: dict, cache: Any, http_client: Any) -> Any:
+    from netconfeval.foundation.langchain.llms.ollama import PooledOllama, DEFAULT_BASE_URL, DEFAULT_KEEP_ALIVE
+
+    additional_kwargs = {}
+    if 'num_parallel' in model_config:
+        additional_kwargs['num_parallel'] = model_config['num_parallel']
+
+    return PooledOllama(
+        model=model_config['model_name'],
+        num_predict=model_config['num_predict'],
+        num_gpu=-1,
+        base_url=model_config.get('base_url', DEFAULT_BASE_URL),
+        keep_alive=model_config.get('keep_alive', DEFAULT_KEEP_ALIVE),
+        cache=cache,
+        **additional_kwargs
+    )
+
+
+def _load_openai_model(model_config: dict, cache: Any, http_client: Any) -> Any:
+    from langchain_openai import ChatOpenAI
+    from netconfeval.common.rate_limiter import get_rate_limited_clients
+
+    # A custom client (e.g., serving Batch API results) replaces the rate limited ones
+    http_async_client = None
+    client_args = {}
+    if http_client is None:
+        http_client, http_async_client = get_rate_limited_clients(model_config)
+        # Failed requests are retried by the rate limited transport, with the backoff shared by all the workers
+        client_args['max_retries'] = 0
+
+    return ChatOpenAI(
+        model_name=model_config['model_name'],
+        model_kwargs=model_config['args'],
+        http_client=http_client,
+        http_async_client=http_async_client,
+        cache=cache,
+        **client_args,
+    )
+
+
+# Backends are imported by their loader, so only the dependencies of the requested model type are loaded
+model_loaders = {
+    'HF': _load_hf_model,
+    'Ollama': _load_ollama_model,
+    'openai': _load_openai_model,
+}
+
+
+# Instances returned by `get_model_instance` while `keep_models_loaded` is enabled, so that consecutive experiments
+# in the same process (e.g., the matrix runner) do not load the same model again
+_loaded_models = {}
+_keep_loaded = False
+
+
+def keep_models_loaded(enabled: bool = True) -> None:
+    global _keep_loaded
+
+    _keep_loaded = enabled
+    if not enabled:
+        unload_models()
+
+
+def unload_models() -> None:
+    for model in _loaded_models.values():
+        if hasattr(model, 'close'):
+            model.close()
+    _loaded_models.clear()
+
+    gc.collect()
+    # Do not import torch if no HF model was loaded
+    if 'torch' in sys.modules and sys.modules['torch'].cuda.is_available():
+        sys.modules['torch'].cuda.empty_cache()
 
-        return ChatHF(
-            model_name=model_configurations[model_name]['model_name'],
-            max_length=model_configurations[model_name]['max_length'],
-            use_quantization=model_configurations[model_name]['use_quantization'],
-            prompt_func=model_configurations[model_name]['prompt_builder'],
-        )
 
-    elif model_configurations[model_name]['type'] == 'Ollama':
-        from langchain_community.llms import Ollama
+def get_model_instance(model_name: str, cache: Any = None, http_client: Any = None) -> Any:
+    model_type = model_configurations[model_name]['type']
+    if model_type not in model_loaders:
+        raise Exception(f"Type `{model_type}` for model `{model_name}` not supported!")
 
-        return Ollama(
-            model=model_configurations[model_name]['model_name'],
-            num_predict=model_configurations[model_name]['num_predict'],
-            num_gpu=-1
-        )
+    # Clients serving Batch API results are specific to an experiment, so those instances are never kept
+    if _keep_loaded and http_client is None:
+        if model_name not in _loaded_models:
+            _loaded_models[model_name] = model_loaders[model_type](model_configurations[model_name], None, None)
 
-    elif model_configurations[model_name]['type'] == 'openai':
-        from langchain_openai import ChatOpenAI
+        model = _loaded_models[model_name]
+        model.cache = cache
+        return model
 
-        return ChatOpenAI(
-            model_name=model_configurations[model_name]['model_name'],
-            model_kwargs=model_configurations[model_name]['args'],
-        )
-    else:
-        raise Exception(f"Type `{model_configurations[model_name]['type']}` for model `{model_name}` not supported!")
+    return model_loaders[model_type](model_configurations[model_name], cache, http_client)
 
 
 model_configurations = {
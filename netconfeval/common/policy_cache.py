@@ -0,0 +1,181 @@
+import array
+import csv
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from sortedcontainers import SortedSet
+
+from netconfeval.common.utils import policy_row
+
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "netconfeval-policies")
+
+MAGIC = b"NCEPOL02"
+BYTEORDER = b'<' if sys.byteorder == 'little' else b'>'
+# Magic, byte order of the arrays, number of strings and of requirements, size, modification time and SHA-256 of the CSV
+_HEADER = struct.Struct("<8sc3xIIQq32s")
+
+
+def _csv_hash(csv_file: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(csv_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.digest()
+
+
+def _csv_stamp(csv_file: str) -> (int, int):
+    stat = os.stat(csv_file)
+
+    return stat.st_size, stat.st_mtime_ns
+
+
+def cache_file(csv_file: str, cache_path: str = DEFAULT_CACHE_PATH) -> str:
+    return os.path.join(cache_path, f"{hashlib.sha256(os.path.abspath(csv_file).encode('utf-8')).hexdigest()}.bin")
+
+
+def _write_atomic(path: str, data: list[bytes]) -> None:
+    # Written to a temporary file first, so concurrent workers never map a partial file
+    with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False) as f:
+        for part in data:
+            f.write(part)
+    os.replace(f.name, path)
+
+
+def _is_compiled(path: str, csv_file: str) -> bool:
+    """Whether the compiled file at `path` matches the CSV.
+
+    The size and modification time of the CSV are compared first, the CSV is only hashed when they changed (e.g., after
+    a checkout). If the content is the same, the new size and modification time are stored in the compiled file.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return False
+    if len(header) < _HEADER.size:
+        return False
+
+    magic, byteorder, n_strings, n_rows, csv_size, csv_mtime_ns, csv_hash = _HEADER.unpack(header)
+    if magic != MAGIC or byteorder != BYTEORDER:
+        return False
+
+    stamp = _csv_stamp(csv_file)
+    if (csv_size, csv_mtime_ns) == stamp:
+        return True
+    if _csv_hash(csv_file) != csv_hash:
+        return False
+
+    with open(path, 'rb') as f:
+        f.seek(_HEADER.size)
+        body = f.read()
+    _write_atomic(path, [_HEADER.pack(MAGIC, BYTEORDER, n_strings, n_rows, *stamp, csv_hash), body])
+
+    return True
+
+
+def compile_policies(csv_file: str, cache_path: str = DEFAULT_CACHE_PATH) -> str:
+    """Writes the requirements of a Config2Spec policy CSV in a binary file, and returns its path.
+
+    The file is named after the path of the CSV, and contains the requirements of all the types in the CSV order:
+    the type, source and subnet are ids of interned strings, and the specifics are either a load balancing number of
+    paths or a string id. The arrays are stored in the native byte order, so they are memory-mapped without parsing.
+    """
+    path = cache_file(csv_file, cache_path)
+    # Taken before reading, so a CSV changed while compiling is compiled again
+    stamp = _csv_stamp(csv_file)
+    csv_hash = _csv_hash(csv_file)
+
+    strings = {}
+    columns = [array.array('I'), array.array('I'), array.array('I'), array.array('i')]
+    with open(csv_file, 'r') as file:
+        for row in csv.DictReader(file):
+            requirement = policy_row(row)
+            if requirement is None:
+                continue
+
+            for column, key in zip(columns, ["type", "source", "subnet"]):
+                column.append(strings.setdefault(requirement[key], len(strings)))
+            if requirement["type"] == "loadbalancing":
+                columns[3].append(requirement["specifics"])
+            else:
+                columns[3].append(strings.setdefault(requirement["specifics"], len(strings)))
+
+    encoded = [string.encode('utf-8') for string in strings.keys()]
+    offsets = array.array('I', [0])
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+
+    os.makedirs(cache_path, exist_ok=True)
+    _write_atomic(path, [
+        _HEADER.pack(MAGIC, BYTEORDER, len(strings), len(columns[0]), *stamp, csv_hash),
+        offsets.tobytes(), *[column.tobytes() for column in columns], b"".join(encoded)
+    ])
+
+    logging.info(f"Compiled {len(columns[0])} requirements of `{csv_file}` to `{path}`.")
+
+    return path
+
+
+def _read_array(view: memoryview, offset: int, typecode: str, n: int) -> (list, int):
+    with view[offset:offset + 4 * n] as part, part.cast(typecode) as values:
+        return values.tolist(), offset + 4 * n
+
+
+def _map_policies(path: str, policy_types: SortedSet[str]) -> list | None:
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            memoryview(mapped) as view:
+        if len(mapped) < _HEADER.size:
+            return None
+        magic, byteorder, n_strings, n_rows, _, _, _ = _HEADER.unpack_from(mapped)
+        if magic != MAGIC or byteorder != BYTEORDER:
+            return None
+
+        offsets, position = _read_array(view, _HEADER.size, 'I', n_strings + 1)
+        types, position = _read_array(view, position, 'I', n_rows)
+        sources, position = _read_array(view, position, 'I', n_rows)
+        subnets, position = _read_array(view, position, 'I', n_rows)
+        specifics, position = _read_array(view, position, 'i', n_rows)
+
+        # Only the strings of the selected requirements are decoded, once each
+        decoded = {}
+
+        def _string(string_id: int) -> str:
+            if string_id not in decoded:
+                decoded[string_id] = str(
+                    mapped[position + offsets[string_id]:position + offsets[string_id + 1]], 'utf-8'
+                )
+
+            return decoded[string_id]
+
+        type_ids = {string_id for string_id in set(types) if _string(string_id) in policy_types}
+
+        requirements = []
+        for row in range(n_rows):
+            if types[row] not in type_ids:
+                continue
+
+            policy_type = _string(types[row])
+            requirements.append({
+                "type": policy_type,
+                "source": _string(sources[row]),
+                "subnet": _string(subnets[row]),
+                "specifics": specifics[row] if policy_type == "loadbalancing" else _string(specifics[row])
+            })
+
+    return requirements
+
+
+def load_policies(csv_file: str, policy_types: SortedSet[str], cache_path: str = DEFAULT_CACHE_PATH) -> list:
+    """Returns the same requirements as `load_csv`, from the compiled policies of the CSV (compiled if missing)."""
+    path = cache_file(csv_file, cache_path)
+    requirements = _map_policies(path, policy_types) if _is_compiled(path, csv_file) else None
+    if requirements is None:
+        requirements = _map_policies(compile_policies(csv_file, cache_path), policy_types)
+
+    return requirements
@@ -0,0 +1,295 @@
+import asyncio
+import email.utils
+import fcntl
+import functools
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+
+import httpx
+import tiktoken
+
+DEFAULT_STATE_PATH = os.path.join(tempfile.gettempdir(), "netconfeval-rate-limits")
+DEFAULT_MAX_RETRIES = 8
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# Same status codes retried by the OpenAI client, whose retries are disabled on the rate limited clients
+RETRY_STATUS_CODES = [408, 409, 429, 500, 502, 503, 504]
+
+_DURATION_REGEX = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def _parse_duration(value: str) -> float:
+    # OpenAI reset headers are in the form `1s`, `6m0s` or `20ms`
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in _DURATION_REGEX.findall(value))
+
+
+def _parse_retry_after(value: str) -> float | None:
+    # `Retry-After` is either a number of seconds or an HTTP date
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(retry_time.timestamp() - time.time(), 0)
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute of a model.
+
+    The bucket state is stored in a JSON file guarded by `flock`, so the budget is shared by all the threads and
+    processes using the same model. Limits that are not configured are learned from the `x-ratelimit-*` headers.
+    """
+
+    def __init__(self, name: str, rpm: int | None = None, tpm: int | None = None,
+                 state_path: str = DEFAULT_STATE_PATH) -> None:
+        os.makedirs(state_path, exist_ok=True)
+
+        self.name: str = name
+        self._path: str = os.path.join(state_path, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.json")
+        self._rpm: int | None = rpm
+        self._tpm: int | None = tpm
+
+    def _update_state(self, update: callable) -> any:
+        # Each call opens its own file description, so `flock` also serializes threads of the same process
+        with open(self._path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                state = json.loads(content) if content else {}
+
+                now = time.time()
+                # Configured limits take precedence over the ones learned in previous runs
+                state['rpm'] = self._rpm if self._rpm is not None else state.get('rpm', None)
+                state['tpm'] = self._tpm if self._tpm is not None else state.get('tpm', None)
+                if state.get('requests', None) is None:
+                    state['requests'] = state['rpm']
+                if state.get('tokens', None) is None:
+                    state['tokens'] = state['tpm']
+                state.setdefault('blocked_until', 0)
+                elapsed = now - state.get('updated', now)
+                state['updated'] = now
+                if state['rpm'] is not None:
+                    state['requests'] = min(state['rpm'], state['requests'] + elapsed * state['rpm'] / 60)
+                if state['tpm'] is not None:
+                    state['tokens'] = min(state['tpm'], state['tokens'] + elapsed * state['tpm'] / 60)
+
+                result = update(state, now)
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        return result
+
+    def acquire(self, n_tokens: int) -> None:
+        def _try_acquire(state: dict, now: float) -> float:
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+
+            # A request larger than the whole bucket would never be served, so it only waits for a full bucket
+            tokens = min(n_tokens, state['tpm']) if state['tpm'] is not None else n_tokens
+
+            wait_time = 0
+            if state['rpm'] is not None and state['requests'] < 1:
+                wait_time = max(wait_time, (1 - state['requests']) * 60 / state['rpm'])
+            if state['tpm'] is not None and state['tokens'] < tokens:
+                wait_time = max(wait_time, (tokens - state['tokens']) * 60 / state['tpm'])
+            if wait_time > 0:
+                return wait_time
+
+            if state['rpm'] is not None:
+                state['requests'] -= 1
+            if state['tpm'] is not None:
+                state['tokens'] -= tokens
+
+            return 0
+
+        while True:
+            wait_time = self._update_state(_try_acquire)
+            if wait_time <= 0:
+                return
+
+            logging.debug(f"Rate limit of `{self.name}` reached, waiting {wait_time:.2f}s...")
+            time.sleep(wait_time)
+
+    def update_from_headers(self, headers: httpx.Headers) -> None:
+        def _update(state: dict, now: float) -> None:
+            for kind, bucket in [('requests', 'rpm'), ('tokens', 'tpm')]:
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit is not None and (self._rpm if bucket == 'rpm' else self._tpm) is None:
+                    if state[bucket] is None:
+                        state[kind] = int(limit)
+                    state[bucket] = int(limit)
+                if remaining is not None and state[bucket] is not None:
+                    state[kind] = min(state[kind], int(remaining))
+
+        self._update_state(_update)
+
+    def backoff(self, attempt: int, headers: httpx.Headers) -> float:
+        delay = _parse_retry_after(headers["retry-after"]) if "retry-after" in headers else None
+        if delay is None:
+            reset = [
+                _parse_duration(headers[header]) for header in
+                ["x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"] if header in headers
+            ]
+            delay = min(min(reset), BACKOFF_MAX) if reset else 0
+            # Full jitter, so that concurrent workers do not retry at the same time
+            delay = max(delay, random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+        def _block(state: dict, now: float) -> None:
+            state['blocked_until'] = max(state['blocked_until'], now + delay)
+
+        self._update_state(_block)
+
+        return delay
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model_name: str) -> tiktoken.Encoding | None:
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use, the estimation falls back to the text length if not available
+        logging.warning(f"Cannot load tiktoken encoding for `{model_name}`: {e}")
+        return None
+
+
+def _count_tokens(encoding: tiktoken.Encoding | None, text: str) -> int:
+    return len(encoding.encode(text)) if encoding is not None else len(text) // 4
+
+
+def count_tokens(model_name: str, text: str) -> int:
+    """Returns the number of tokens of a text for a model, estimated from its length if tiktoken is not available."""
+    return _count_tokens(_get_encoding(model_name), text)
+
+
+def _estimate_tokens(request: httpx.Request) -> int:
+    try:
+        body = json.loads(request.content)
+    except (ValueError, UnicodeDecodeError):
+        return 0
+
+    encoding = _get_encoding(body.get('model', ''))
+
+    n_tokens = 0
+    for message in body.get('messages', []):
+        # Each message has a few tokens of overhead for the role and separators
+        n_tokens += 4
+        content = message.get('content')
+        if isinstance(content, str):
+            n_tokens += _count_tokens(encoding, content)
+    if 'tools' in body:
+        n_tokens += _count_tokens(encoding, json.dumps(body['tools']))
+    if isinstance(body.get('input'), str):
+        n_tokens += _count_tokens(encoding, body['input'])
+
+    # The declared completion budget is counted by the API as well
+    n_tokens += body.get('max_tokens') or 0
+
+    return n_tokens
+
+
+class RateLimitedTransport(httpx.HTTPTransport):
+    def __init__(self, rate_limiter: RateLimiter, max_retries: int = DEFAULT_MAX_RETRIES, **kwargs) -> None:
+        super().__init__(**kwargs)
+
+        self._rate_limiter: RateLimiter = rate_limiter
+        self._max_retries: int = max_retries
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        n_tokens = _estimate_tokens(request)
+        attempt = 0
+        while True:
+            self._rate_limiter.acquire(n_tokens)
+            try:
+                response = super().handle_request(request)
+            except httpx.TransportError as e:
+                if attempt >= self._max_retries:
+                    raise
+
+                delay = self._rate_limiter.backoff(attempt, httpx.Headers())
+                logging.warning(f"Request to `{self._rate_limiter.name}` failed: {e}, "
+                                f"retrying in {delay:.2f}s (attempt {attempt + 1}/{self._max_retries})...")
+                attempt += 1
+                continue
+
+            self._rate_limiter.update_from_headers(response.headers)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self._max_retries:
+                return response
+
+            response.read()
+            response.close()
+            delay = self._rate_limiter.backoff(attempt, response.headers)
+            logging.warning(f"Request to `{self._rate_limiter.name}` failed with status code {response.status_code}, "
+                            f"retrying in {delay:.2f}s (attempt {attempt + 1}/{self._max_retries})...")
+            attempt += 1
+
+
+class AsyncRateLimitedTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, rate_limiter: RateLimiter, max_retries: int = DEFAULT_MAX_RETRIES, **kwargs) -> None:
+        super().__init__(**kwargs)
+
+        self._rate_limiter: RateLimiter = rate_limiter
+        self._max_retries: int = max_retries
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        n_tokens = _estimate_tokens(request)
+        attempt = 0
+        while True:
+            await asyncio.to_thread(self._rate_limiter.acquire, n_tokens)
+            try:
+                response = await super().handle_async_request(request)
+            except httpx.TransportError as e:
+                if attempt >= self._max_retries:
+                    raise
+
+                delay = await asyncio.to_thread(self._rate_limiter.backoff, attempt, httpx.Headers())
+                logging.warning(f"Request to `{self._rate_limiter.name}` failed: {e}, "
+                                f"retrying in {delay:.2f}s (attempt {attempt + 1}/{self._max_retries})...")
+                attempt += 1
+                continue
+
+            await asyncio.to_thread(self._rate_limiter.update_from_headers, response.headers)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self._max_retries:
+                return response
+
+            await response.aread()
+            await response.aclose()
+            delay = await asyncio.to_thread(self._rate_limiter.backoff, attempt, response.headers)
+            logging.warning(f"Request to `{self._rate_limiter.name}` failed with status code {response.status_code}, "
+                            f"retrying in {delay:.2f}s (attempt {attempt + 1}/{self._max_retries})...")
+            attempt += 1
+
+
+def get_rate_limited_clients(model_config: dict) -> (httpx.Client, httpx.AsyncClient):
+    """Returns the HTTP clients sharing the rate limits of a model.
+
+    The clients retry the failed requests, so the OpenAI clients using them must be created with `max_retries=0`.
+    """
+    rate_limiter = RateLimiter(model_config['model_name'], model_config.get('rpm', None), model_config.get('tpm', None))
+
+    # Same timeout used by the OpenAI client by default
+    timeout = httpx.Timeout(timeout=600, connect=5.0)
+    return (
+        httpx.Client(transport=RateLimitedTransport(rate_limiter), timeout=timeout),
+        httpx.AsyncClient(transport=AsyncRateLimitedTransport(rate_limiter), timeout=timeout)
+    )
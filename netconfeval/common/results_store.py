@@ -0,0 +1,336 @@
+import argparse
+import csv
+import fnmatch
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Generator
+
+from netconfeval.common.utils import load_resumed_rows
+
+DEFAULT_FLUSH_ROWS = 64
+DEFAULT_FLUSH_INTERVAL = 30
+
+# Declared types of the result columns, values of `COMPRESSED` columns are stored as zlib-compressed UTF-8 text
+BOOLEAN = 'BOOLEAN'
+INTEGER = 'INTEGER'
+REAL = 'REAL'
+TEXT = 'TEXT'
+COMPRESSED = 'ZTEXT'
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _column_type(value: any, compressed: bool) -> str:
+    if compressed:
+        return COMPRESSED
+    elif isinstance(value, bool):
+        return BOOLEAN
+    elif isinstance(value, int):
+        return INTEGER
+    elif isinstance(value, float):
+        return REAL
+
+    return TEXT
+
+
+def _encode(value: any, column_type: str) -> any:
+    if value is None:
+        return None
+    elif column_type == COMPRESSED:
+        return zlib.compress(str(value).encode('utf-8'))
+    elif column_type == BOOLEAN and isinstance(value, bool):
+        return int(value)
+    elif column_type == TEXT or not isinstance(value, (int, float)):
+        # Other values are stored as the CSV writer would print them
+        return str(value)
+
+    return value
+
+
+def _decode(value: any, column_type: str) -> any:
+    if value is None:
+        return None
+    elif column_type == COMPRESSED:
+        return zlib.decompress(value).decode('utf-8')
+    elif column_type == BOOLEAN and isinstance(value, int):
+        return bool(value)
+
+    return value
+
+
+class ResultsStore:
+    """Result rows of many experiments in a single SQLite database, in place of a CSV file for each run.
+
+    Each experiment has its own table, whose columns are typed after the first row written. Large text columns (e.g.,
+    the diffs of Step 1 or the device configurations of Step 3) are compressed, and are only decompressed when they
+    are selected by a query.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = os.path.abspath(path)
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS experiments (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, "
+                "command TEXT NOT NULL, args TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS columns (experiment_id INTEGER NOT NULL, position INTEGER NOT NULL, "
+                "name TEXT NOT NULL, type TEXT NOT NULL, PRIMARY KEY (experiment_id, position))"
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _experiment_id(self, name: str) -> int | None:
+        row = self._connection.execute("SELECT id FROM experiments WHERE name = ?", (name,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def _columns(self, experiment_id: int) -> dict[str, str]:
+        return dict(self._connection.execute(
+            "SELECT name, type FROM columns WHERE experiment_id = ? ORDER BY position", (experiment_id,)
+        ).fetchall())
+
+    def create_experiment(self, name: str, command: str, args: dict | None = None) -> None:
+        with self._lock, self._connection:
+            if self._experiment_id(name) is not None:
+                raise Exception(f"Experiment `{name}` already exists in `{self.path}`!")
+
+            cursor = self._connection.execute(
+                "INSERT INTO experiments (name, command, args, created) VALUES (?, ?, ?, ?)",
+                (name, command, json.dumps(args if args is not None else {}, default=str), time.time())
+            )
+            self._connection.execute(f"CREATE TABLE results_{cursor.lastrowid} (row_id INTEGER PRIMARY KEY)")
+
+    def drop_experiment(self, name: str) -> None:
+        with self._lock, self._connection:
+            experiment_id = self._experiment_id(name)
+            if experiment_id is not None:
+                self._connection.execute(f"DROP TABLE results_{experiment_id}")
+                self._connection.execute("DELETE FROM columns WHERE experiment_id = ?", (experiment_id,))
+                self._connection.execute("DELETE FROM experiments WHERE id = ?", (experiment_id,))
+
+    def insert(self, name: str, rows: list[dict], compressed_columns: list[str] | None = None) -> None:
+        compressed_columns = compressed_columns if compressed_columns is not None else []
+        with self._lock, self._connection:
+            experiment_id = self._experiment_id(name)
+            if experiment_id is None:
+                raise Exception(f"Experiment `{name}` not found in `{self.path}`!")
+
+            columns = self._columns(experiment_id)
+            for row in rows:
+                for column, value in row.items():
+                    if column not in columns:
+                        # The type of a column is taken from its first value, numbers may still change type later
+                        columns[column] = _column_type(value, column in compressed_columns)
+                        self._connection.execute(
+                            f"ALTER TABLE results_{experiment_id} ADD COLUMN {_quote(column)} {columns[column]}"
+                        )
+                        self._connection.execute(
+                            "INSERT INTO columns (experiment_id, position, name, type) VALUES (?, ?, ?, ?)",
+                            (experiment_id, len(columns) - 1, column, columns[column])
+                        )
+
+            for row in rows:
+                self._connection.execute(
+                    f"INSERT INTO results_{experiment_id} ({', '.join(_quote(column) for column in row.keys())}) "
+                    f"VALUES ({', '.join('?' for _ in row)})",
+                    [_encode(value, columns[column]) for column, value in row.items()]
+                )
+
+    def experiments(self, command: str | None = None, pattern: str | None = None) -> list[dict]:
+        """Returns the experiments of a command whose name matches the glob `pattern`, from the most recent one."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, name, command, args, created FROM experiments ORDER BY created DESC, id DESC"
+            ).fetchall()
+
+            experiments = []
+            for experiment_id, name, experiment_command, args, created in rows:
+                if (command is not None and experiment_command != command) or \
+                        (pattern is not None and not fnmatch.fnmatchcase(name, pattern)):
+                    continue
+
+                n_rows = self._connection.execute(f"SELECT COUNT(*) FROM results_{experiment_id}").fetchone()[0]
+                experiments.append({
+                    'name': name, 'command': experiment_command, 'args': json.loads(args), 'created': created,
+                    'n_rows': n_rows,
+                    'columns': self._columns(experiment_id)
+                })
+
+        return experiments
+
+    def rows(self, name: str, columns: list[str] | None = None,
+             where: dict | None = None) -> Generator[dict, None, None]:
+        """Yields the rows of an experiment in insertion order.
+
+        Only the `columns` selected are read and decoded, and rows can be filtered on the equality of some columns.
+        """
+        with self._lock:
+            experiment_id = self._experiment_id(name)
+            if experiment_id is None:
+                raise Exception(f"Experiment `{name}` not found in `{self.path}`!")
+
+            types = self._columns(experiment_id)
+
+        columns = columns if columns is not None else list(types.keys())
+        where = where if where is not None else {}
+        for column in list(columns) + list(where.keys()):
+            if column not in types:
+                raise Exception(f"Column `{column}` not found in experiment `{name}`!")
+        if not columns:
+            return
+
+        query = f"SELECT {', '.join(_quote(column) for column in columns)} FROM results_{experiment_id}"
+        if where:
+            query += f" WHERE {' AND '.join(f'{_quote(column)} = ?' for column in where.keys())}"
+        query += " ORDER BY row_id"
+        params = [_encode(value, types[column]) for column, value in where.items()]
+
+        with self._lock:
+            records = self._connection.execute(query, params).fetchall()
+
+        for record in records:
+            yield {column: _decode(value, types[column]) for column, value in zip(columns, record)}
+
+
+class ResultsWriter:
+    """Appends the rows of an experiment to a `ResultsStore`, in a transaction every `flush_rows` rows or
+    `flush_interval` seconds."""
+
+    def __init__(self, store: ResultsStore, name: str, compressed_columns: list[str] | None = None,
+                 flush_rows: int = DEFAULT_FLUSH_ROWS, flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> None:
+        self._store: ResultsStore = store
+        self._name: str = name
+        self._compressed_columns: list[str] = compressed_columns if compressed_columns is not None else []
+        self._flush_rows: int = flush_rows
+        self._flush_interval: float = flush_interval
+
+        self._buffer: list[dict] = []
+        self._last_flush: float = time.time()
+
+    def write(self, row: dict) -> None:
+        self._buffer.append(row)
+        if len(self._buffer) >= self._flush_rows or time.time() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._store.insert(self._name, self._buffer, self._compressed_columns)
+            self._buffer = []
+        self._last_flush = time.time()
+
+    def close(self) -> None:
+        self.flush()
+
+
+def load_resumed_results(args: argparse.Namespace, columns: list[str] | None = None) -> (list[str] | None, list[dict]):
+    """Reads the rows to resume from, either from the result file or from the experiment in `--results_store`.
+
+    Results without one of `columns` were written by another version of the script, whose values may have another
+    meaning, so they cannot be resumed.
+    """
+    if not args.results_store:
+        fieldnames, rows = load_resumed_rows(args.resume)
+    else:
+        store = ResultsStore(args.results_store)
+        try:
+            fieldnames, rows = None, list(store.rows(args.resume))
+        finally:
+            store.close()
+
+    resumed_columns = fieldnames if fieldnames is not None else (rows[0].keys() if rows else None)
+    if columns and resumed_columns is not None:
+        missing = [column for column in columns if column not in resumed_columns]
+        if missing:
+            raise Exception(f"Cannot resume `{args.resume}`, it has no {', '.join(missing)} columns. "
+                            f"It was written by an older version, start a new run instead!")
+
+    return fieldnames, rows
+
+
+@contextmanager
+def open_results(args: argparse.Namespace, command: str, name: str, fieldnames: list[str] | None = None,
+                 compressed_columns: list[str] | None = None) -> Generator[Callable[[dict], None], None, None]:
+    """Yields a function writing a result row, to the CSV file of the experiment or to `--results_store`.
+
+    When resuming, rows are appended to the result file (or to the stored experiment) passed to `--resume`.
+    """
+    if args.results_store:
+        store = ResultsStore(args.results_store)
+        if not args.resume:
+            store.create_experiment(name, command, vars(args))
+        writer = ResultsWriter(store, args.resume if args.resume else name, compressed_columns)
+        try:
+            yield writer.write
+        finally:
+            writer.close()
+            store.close()
+        return
+
+    results_file = args.resume if args.resume else os.path.join(args.results_path, f"result-{name}.csv")
+    with open(results_file, 'a' if args.resume else 'w') as f:
+        w = csv.DictWriter(f, fieldnames) if fieldnames else None
+
+        def write_row(result_row: dict) -> None:
+            nonlocal w
+            if w is None:
+                w = csv.DictWriter(f, result_row.keys())
+                w.writeheader()
+
+            w.writerow(result_row)
+            f.flush()
+
+        yield write_row
+
+
+def find_results(results_path: str, command: str, pattern: str, columns: list[str] | None = None,
+                 where: dict | None = None) -> Generator[dict, None, None] | None:
+    """Returns the rows of an experiment of `command` whose name matches the glob `pattern`, or None if there is none.
+
+    `results_path` is either a directory of result CSV files or a `ResultsStore` database. Rows read from CSV files
+    contain strings, and are filtered on the string representation of the `where` values.
+    """
+    if os.path.isfile(results_path):
+        store = ResultsStore(results_path)
+        experiments = store.experiments(command, pattern)
+        if not experiments:
+            store.close()
+            return None
+
+        if len(experiments) > 1:
+            logging.warning(f"{len(experiments)} experiments match `{pattern}` in `{results_path}`, "
+                            f"reading the most recent one.")
+
+        def _stored_rows() -> Generator[dict, None, None]:
+            try:
+                yield from store.rows(experiments[0]['name'], columns, where)
+            finally:
+                store.close()
+
+        return _stored_rows()
+
+    results_files_list = glob.glob(os.path.join(results_path, f"result-{pattern}.csv"))
+    if len(results_files_list) == 0:
+        return None
+
+    def _csv_rows() -> Generator[dict, None, None]:
+        with open(results_files_list.pop(), 'r') as file:
+            for res in csv.DictReader(file):
+                if all(res[column] == str(value) for column, value in (where or {}).items()):
+                    yield res if columns is None else {column: res[column] for column in columns}
+
+    return _csv_rows()
@@ -0,0 +1,151 @@
+import copy
+import logging
+from collections import Counter
+from itertools import repeat
+from typing import Hashable
+
+from netconfeval.common.spec_diff import format_diff
+
+POLICY_TYPES = ['reachability', 'waypoint', 'loadbalancing']
+METRICS = ['precision', 'recall', 'f1']
+SCORE_COLUMNS = [f"{metric}_{policy_type}" for policy_type in POLICY_TYPES for metric in METRICS]
+
+
+def _atom(value: any) -> Hashable:
+    # Values parsed from JSON are hashable unless they are lists or objects
+    return value if value is None or isinstance(value, (str, int, float)) else str(value)
+
+
+def _atoms(values: any) -> list:
+    if not isinstance(values, (list, tuple, set, frozenset)):
+        # A single value is returned by some models in place of a list with one element
+        return [_atom(values)]
+    if all(type(value) is str for value in values):
+        return values
+
+    return [_atom(value) for value in values]
+
+
+def _number(value: any) -> Hashable:
+    if type(value) is int:
+        return value
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return _atom(value)
+
+
+def _policies(spec: dict, policy_type: str) -> dict:
+    policies = spec.get(policy_type)
+
+    return policies if isinstance(policies, dict) else {}
+
+
+class CanonicalSpec:
+    """Specification with hashable policies, so the policies of two specifications are matched with set operations.
+
+    Reachability policies are (router, subnet) pairs counted with their multiplicity, waypoint policies map the
+    `(router,subnet)` key to the frozenset of its switches, and load balancing policies map the key to the number of
+    paths.
+    """
+
+    __slots__ = ['reachability', 'waypoint', 'loadbalancing']
+
+    def __init__(self, spec: dict) -> None:
+        self.reachability: Counter[tuple[str, str]] = Counter()
+        for router, subnets in _policies(spec, "reachability").items():
+            self.reachability.update(zip(repeat(router), _atoms(subnets)))
+        self.waypoint: dict[str, frozenset] = {
+            key: frozenset(_atoms(switches)) for key, switches in _policies(spec, "waypoint").items()
+        }
+        self.loadbalancing: dict[str, Hashable] = {
+            key: _number(n_paths) for key, n_paths in _policies(spec, "loadbalancing").items()
+        }
+
+    def count(self, policy_type: str) -> int:
+        return sum(self.reachability.values()) if policy_type == "reachability" else len(getattr(self, policy_type))
+
+
+def _missing(spec: CanonicalSpec, other: CanonicalSpec, policy_type: str) -> Counter:
+    # Policies of `spec` (with their multiplicity) that are not matched by a policy of `other`
+    if policy_type == "reachability":
+        missing = spec.reachability.keys() - other.reachability.keys()
+
+        return Counter({pair: spec.reachability[pair] for pair in missing})
+    elif policy_type == "waypoint":
+        # The switches of a waypoint must all be in the other one
+        return Counter(
+            key for key, switches in spec.waypoint.items() - other.waypoint.items()
+            if key not in other.waypoint or not switches <= other.waypoint[key]
+        )
+
+    return Counter(key for key, _ in spec.loadbalancing.items() - other.loadbalancing.items())
+
+
+def score_spec(expected: dict, result: dict) -> dict:
+    """Returns the `total`, `success`, `fail`, `wrong` and `accuracy` of a result, and the precision, recall and F1
+    score for each policy type."""
+    expected_spec = CanonicalSpec(expected)
+    result_spec = CanonicalSpec(result)
+    log_policies = logging.getLogger().isEnabledFor(logging.WARNING)
+
+    scores = {'total': 0, 'fail': 0, 'wrong': 0}
+    n_expected = 0
+    for policy_type in POLICY_TYPES:
+        type_expected = expected_spec.count(policy_type)
+        type_returned = result_spec.count(policy_type)
+        failed = _missing(expected_spec, result_spec, policy_type)
+        wrong = _missing(result_spec, expected_spec, policy_type)
+        if policy_type == "reachability":
+            # A reachability that is not expected is not wrong if it is implied by an expected waypoint
+            for router, subnet in [pair for pair in wrong.keys() if f"({pair[0]},{pair[1]})" in expected_spec.waypoint]:
+                del wrong[(router, subnet)]
+
+        if log_policies:
+            for policy in sorted(failed.keys(), key=str):
+                logging.warning(f"Fail to translate expected {_describe(policy_type, policy)}.")
+            for policy in sorted(wrong.keys(), key=str):
+                logging.warning(f"Translate wrongly {_describe(policy_type, policy)}.")
+
+        n_expected += type_expected
+        scores['total'] += type_returned
+        scores['fail'] += sum(failed.values())
+        scores['wrong'] += sum(wrong.values())
+
+        precision = (type_returned - sum(wrong.values())) / type_returned if type_returned else 0
+        recall = (type_expected - sum(failed.values())) / type_expected if type_expected else 0
+        scores[f"precision_{policy_type}"] = precision
+        scores[f"recall_{policy_type}"] = recall
+        scores[f"f1_{policy_type}"] = 2 * precision * recall / (precision + recall) if precision + recall else 0
+
+    scores['success'] = n_expected - scores['fail']
+    scores['accuracy'] = scores['success'] / n_expected
+
+    return scores
+
+
+def normalize_spec(result: dict) -> dict:
+    # Models often return the `(router, subnet)` keys of the waypoint and load balancing policies with spaces
+    normalized = copy.copy(result)
+    for policy_type in ["waypoint", "loadbalancing"]:
+        if policy_type in result:
+            normalized[policy_type] = {key.replace(" ", ""): value for key, value in result[policy_type].items()}
+
+    return normalized
+
+
+def score_output(expected: dict, output: dict, differ: str = 'spec') -> dict:
+    """Returns the scores and the `diff` of the specification returned by a model, after normalizing it."""
+    result = normalize_spec(output)
+
+    return {**score_spec(expected, result), 'diff': format_diff(expected, result, differ)}
+
+
+def _describe(policy_type: str, policy: any) -> str:
+    if policy_type == "reachability":
+        return f"reachability from `{policy[0]}` to `{policy[1]}`"
+    elif policy_type == "loadbalancing":
+        return f"load balancing `{policy}`"
+
+    return f"{policy_type} `{policy}`"
@@ -0,0 +1,130 @@
+import json
+from typing import Hashable
+
+DIFFERS = ['spec', 'deepdiff']
+
+
+def _element_key(element: any) -> Hashable:
+    return element if isinstance(element, Hashable) else json.dumps(element, sort_keys=True, default=str)
+
+
+def _elements(values: list, excluded: list) -> list:
+    # Elements of `values` that are not in `excluded`, once each and in their order, as DeepDiff ignoring the order
+    excluded_keys = {_element_key(element) for element in excluded}
+    elements = {}
+    for element in values:
+        key = _element_key(element)
+        if key not in excluded_keys and key not in elements:
+            elements[key] = element
+
+    return list(elements.values())
+
+
+def _map_diff(expected: dict, result: dict) -> dict:
+    added = {}
+    removed = {}
+    changed = {}
+    for key, value in expected.items():
+        if key not in result:
+            removed[key] = value
+        elif isinstance(value, list) and isinstance(result[key], list):
+            # Lists (subnets of a reachability, switches of a waypoint) are compared as sets
+            added_elements = _elements(result[key], value)
+            removed_elements = _elements(value, result[key])
+            if added_elements:
+                added[key] = added_elements
+            if removed_elements:
+                removed[key] = removed_elements
+        elif type(value) is not type(result[key]) or value != result[key]:
+            changed[key] = [value, result[key]]
+
+    for key, value in result.items():
+        if key not in expected:
+            added[key] = value
+
+    sections = [('added', added), ('removed', removed), ('changed', changed)]
+
+    return {name: section for name, section in sections if section}
+
+
+def spec_diff(expected: dict, result: dict) -> dict:
+    """Returns the differences between two specifications, for each policy type.
+
+    For each policy type, `added` and `removed` contain the keys (e.g., the routers of the reachability policies) only
+    in the result or only in the expected specification, and the list elements (e.g., subnets or switches) added or
+    removed for the keys in both. `changed` contains the other values that differ, as [expected, result]. Policy types
+    that do not differ are omitted, so equal specifications have an empty diff.
+    """
+    diff = {}
+    for policy_type in list(expected.keys()) + [key for key in result.keys() if key not in expected]:
+        expected_policies = expected.get(policy_type, {})
+        result_policies = result.get(policy_type, {})
+        if isinstance(expected_policies, dict) and isinstance(result_policies, dict):
+            policy_diff = _map_diff(expected_policies, result_policies)
+        elif type(expected_policies) is not type(result_policies) or expected_policies != result_policies:
+            policy_diff = {'changed': [expected_policies, result_policies]}
+        else:
+            policy_diff = {}
+
+        if policy_diff:
+            diff[policy_type] = policy_diff
+
+    return diff
+
+
+def diff_keys(diff: dict) -> set:
+    """Returns the policies (type and key) with a difference in a `spec_diff`, or the type alone if it is not a map."""
+    keys = set()
+    for policy_type, sections in diff.items():
+        for section in sections.values():
+            if isinstance(section, dict):
+                keys.update((policy_type, key) for key in section.keys())
+            else:
+                keys.add((policy_type,))
+
+    return keys
+
+
+def deepdiff_keys(expected: dict, result: dict, diff: any) -> set:
+    """Returns the policies with a difference in a DeepDiff of two specifications, as `diff_keys`.
+
+    A policy type added or removed counts for each of its keys.
+    """
+    from deepdiff.path import parse_path
+
+    keys = set()
+    paths = [parse_path(path) for path in diff.affected_paths]
+    if [] in paths:
+        # DeepDiff reports the whole specification as changed when none of its policy types is in both
+        paths = [[policy_type] for policy_type in expected.keys() | result.keys()]
+
+    for elements in paths:
+        if len(elements) > 1:
+            keys.add(tuple(elements[:2]))
+            continue
+
+        # DeepDiff also reports a whole policy type as changed when none of its keys is in both specifications
+        expected_policies = expected.get(elements[0], {})
+        result_policies = result.get(elements[0], {})
+        if isinstance(expected_policies, dict) and isinstance(result_policies, dict):
+            keys.update(
+                (elements[0], key) for key in expected_policies.keys() | result_policies.keys()
+                if key not in expected_policies or key not in result_policies
+                or expected_policies[key] != result_policies[key]
+            )
+        else:
+            keys.add((elements[0],))
+
+    return keys
+
+
+def format_diff(expected: dict, result: dict, differ: str = 'spec') -> str:
+    """Returns the diff stored in the `diff` column of the results, as JSON with the `spec` differ."""
+    if differ == 'deepdiff':
+        from deepdiff import DeepDiff
+
+        return str(DeepDiff(expected, result, ignore_order=True))
+    elif differ == 'spec':
+        return json.dumps(spec_diff(expected, result), default=str)
+
+    raise Exception(f"Unsupported differ `{differ}`!")
@@ -0,0 +1,155 @@
+import contextvars
+import functools
+import gzip
+import json
+import logging
+import os
+import queue
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Generator
+
+LOG_FORMATS = ['text', 'jsonl']
+DEFAULT_FLUSH_INTERVAL = 5
+
+_run_id: contextvars.ContextVar[str | None] = contextvars.ContextVar('trace_run_id', default=None)
+_work_item: contextvars.ContextVar[dict | None] = contextvars.ContextVar('trace_work_item', default=None)
+
+
+class Lazy:
+    """Argument of a log message computed only when the message is written, by the logging thread.
+
+    The arguments of the function must not be modified after the log call.
+    """
+
+    __slots__ = ['_func', '_args', '_kwargs', '_value']
+
+    def __init__(self, func: Callable, *args, **kwargs) -> None:
+        self._func: Callable = func
+        self._args: tuple = args
+        self._kwargs: dict = kwargs
+        self._value: str | None = None
+
+    def __str__(self) -> str:
+        if self._value is None:
+            self._value = str(self._func(*self._args, **self._kwargs))
+
+        return self._value
+
+
+def set_trace_run(run_id: str | None) -> contextvars.Token:
+    return _run_id.set(run_id)
+
+
+def trace_work_items(worker: Callable, key_columns: list[str]) -> Callable:
+    """Wraps the worker of an experiment, so the logs of each work item carry its key columns."""
+
+    @functools.wraps(worker)
+    def _worker(work_item: dict) -> any:
+        _work_item.set({column: work_item[column] for column in key_columns})
+        return worker(work_item)
+
+    return _worker
+
+
+class _TraceQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the trace context is attached in the calling thread, the message is formatted by the listener
+        record.run_id = _run_id.get()
+        record.work_item = _work_item.get()
+
+        return record
+
+
+class _TraceQueueListener(QueueListener):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The message is formatted once for all the handlers, and a wrong one must not stop the listener thread
+        try:
+            record.msg = record.getMessage()
+        except Exception as e:
+            record.msg = f"Cannot format log message {record.msg!r} with arguments {record.args!r}: {e}"
+        record.args = None
+
+        return record
+
+
+class JsonlTraceHandler(logging.Handler):
+    """Writes each record as a JSON line in a gzip-compressed file, with the run and work item that logged it."""
+
+    def __init__(self, path: str, flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> None:
+        super().__init__()
+
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._flush_interval: float = flush_interval
+        self._last_flush: float = time.time()
+        self._exception_formatter: logging.Formatter = logging.Formatter()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            entry = {
+                'time': record.created,
+                'level': record.levelname,
+                'run_id': getattr(record, 'run_id', None),
+                'work_item': getattr(record, 'work_item', None),
+                'thread': record.threadName,
+                'message': record.getMessage(),
+            }
+            if record.exc_info:
+                entry['exception'] = self._exception_formatter.formatException(record.exc_info)
+
+            self._file.write(json.dumps(entry, default=str) + "\n")
+            if time.time() - self._last_flush >= self._flush_interval:
+                self._file.flush()
+                self._last_flush = time.time()
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            if not self._file.closed:
+                self._file.close()
+        finally:
+            self.release()
+            super().close()
+
+
+@contextmanager
+def experiment_logging(log_path: str, name: str, log_format: str = 'text') -> Generator[None, None, None]:
+    """Adds the log file of an experiment, and moves all the root handlers behind a queue.
+
+    Records are enqueued by the calling thread, and formatted and written (to stdout and to the log file) by a
+    background thread, so the work items do not wait for the I/O. The log file is `log-<name>.log` with the `text`
+    format, or `log-<name>.jsonl.gz` with the `jsonl` one.
+    """
+    if log_format not in LOG_FORMATS:
+        raise Exception(f"Unsupported log format `{log_format}`!")
+
+    if log_format == 'jsonl':
+        file_handler = JsonlTraceHandler(os.path.abspath(os.path.join(log_path, f"log-{name}.jsonl.gz")))
+    else:
+        file_handler = logging.FileHandler(os.path.abspath(os.path.join(log_path, f"log-{name}.log")))
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+    file_handler.setLevel(logging.WARNING)
+
+    handlers = list(logging.root.handlers)
+    log_queue = queue.SimpleQueue()
+    queue_handler = _TraceQueueHandler(log_queue)
+    listener = _TraceQueueListener(log_queue, *handlers, file_handler, respect_handler_level=True)
+    for handler in handlers:
+        logging.root.removeHandler(handler)
+    logging.root.addHandler(queue_handler)
+
+    token = _run_id.set(name)
+    listener.start()
+    try:
+        yield
+    finally:
+        # Stopping the listener writes all the records still in the queue
+        listener.stop()
+        logging.root.removeHandler(queue_handler)
+        for handler in handlers:
+            logging.root.addHandler(handler)
+        file_handler.close()
+        _run_id.reset(token)
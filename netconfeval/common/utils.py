@@ -1,5 +1,8 @@
+import bisect
 import copy
 import csv
+import heapq
+import io
 import logging
 import math
 import random
@@ -9,69 +12,159 @@ from typing import Generator, Sized
 from sortedcontainers import SortedSet
 
 
+def policy_row(row: dict) -> dict | None:
+    """Returns the requirement of a row of the Config2Spec policy CSV, or None if the requirement is not used."""
+    key_type = row["type"].replace("PolicyType.", "").replace("Simple", "").lower()
+    if key_type == "loadbalancing":
+        return {
+            "type": key_type,
+            "source": row['Sources'],
+            "subnet": row['subnet'],
+            "specifics": int(row['specifics'])
+        }
+    elif row['Status'] == 'PolicyStatus.HOLDS' and row['Sources'] != row['specifics']:
+        return {
+            "type": key_type,
+            "source": row['Sources'],
+            "subnet": row['subnet'],
+            "specifics": row['specifics']
+        }
+
+    return None
+
+
 def load_csv(csv_file: str, policy_types: SortedSet[str]) -> list:
     filtered_data = []
     with open(csv_file, 'r') as file:
         reader = csv.DictReader(file)
         for row in reader:
-            key_type = row["type"].replace("PolicyType.", "").replace("Simple", "").lower()
-            if key_type in policy_types:
-                if key_type == "loadbalancing":
-                    filtered_row = {
-                        "type": key_type,
-                        "source": row['Sources'],
-                        "subnet": row['subnet'],
-                        "specifics": int(row['specifics'])
-                    }
-                    filtered_data.append(filtered_row)
-                elif row['Status'] == 'PolicyStatus.HOLDS' and row['Sources'] != row['specifics']:
-                    filtered_row = {
-                        "type": key_type,
-                        "source": row['Sources'],
-                        "subnet": row['subnet'],
-                        "specifics": row['specifics']
-                    }
-                    filtered_data.append(filtered_row)
+            filtered_row = policy_row(row)
+            if filtered_row is not None and filtered_row["type"] in policy_types:
+                filtered_data.append(filtered_row)
 
     return filtered_data
 
 
-def pick_sample(n: int, requirements: list, it: int, policy_types: SortedSet[str]) -> list:
+def load_resumed_rows(csv_file: str) -> (list[str] | None, list[dict]):
+    """Reads the header and the rows of a result file to resume.
+
+    A row partially written by an interrupted run is removed from the file, so new rows are appended after the
+    last complete one.
+    """
+    with open(csv_file, 'r', newline='') as file:
+        content = file.read()
+
+    consumed = 0
+
+    def _lines() -> Generator:
+        nonlocal consumed
+        for line in io.StringIO(content, newline=''):
+            consumed += len(line)
+            yield line
+
+    records = []
+    complete_end = 0
+    try:
+        # Strict mode raises an error on a quoted field left open by a partial record, instead of returning it
+        for record in csv.reader(_lines(), strict=True):
+            # The reader stops at the end of each record, the last one is partial if not terminated by a new line
+            if content[consumed - 1] not in "\r\n":
+                break
+            records.append(record)
+            complete_end = consumed
+    except csv.Error:
+        pass
+
+    if complete_end < len(content):
+        logging.warning(f"Removing a partially written row from `{csv_file}`.")
+        with open(csv_file, 'w', newline='') as file:
+            file.write(content[:complete_end])
+
+    if not records:
+        return None, []
+
+    return records[0], [dict(zip(records[0], record)) for record in records[1:]]
+
+
+def result_key(row: dict, key_columns: list[str]) -> tuple:
+    # Values read from a result file are strings, so work items are compared with their string representation
+    return tuple(str(row[column]) for column in key_columns)
+
+
+class PolicyIndex:
+    """Requirements of a dataset indexed by type, (type, source) and (type, source, subnet).
+
+    Each index keeps the positions of the requirements in the dataset order, so lookups return the same requirement
+    as a scan of the dataset list. The requirements are shared with the dataset list.
+    """
+
+    def __init__(self, requirements: list[dict]) -> None:
+        self.requirements: list[dict] = requirements
+
+        self._by_type: dict[str, list[int]] = {}
+        self._by_source: dict[tuple, list[int]] = {}
+        self._by_subnet: dict[tuple, list[int]] = {}
+        for position, requirement in enumerate(requirements):
+            self._by_type.setdefault(requirement["type"], []).append(position)
+            self._by_source.setdefault((requirement["type"], requirement["source"]), []).append(position)
+            self._by_subnet.setdefault(
+                (requirement["type"], requirement["source"], requirement["subnet"]), []
+            ).append(position)
+
+    def __len__(self) -> int:
+        return len(self.requirements)
+
+    def first(self, policy_type: str, n: int, keys: list[float]) -> list[dict]:
+        """Returns the `n` requirements of a type with the smallest keys, as slicing the dataset sorted by `keys`."""
+        positions = heapq.nsmallest(n, self._by_type.get(policy_type, []), key=keys.__getitem__)
+
+        return [self.requirements[position] for position in positions]
+
+    def last(self, policy_type: str, source: str, subnet: str | None = None) -> int | None:
+        """Returns the position of the last requirement matching the type, source and (optionally) subnet."""
+        if subnet is None:
+            positions = self._by_source.get((policy_type, source))
+        else:
+            positions = self._by_subnet.get((policy_type, source, subnet))
+
+        return positions[-1] if positions else None
+
+    def set_subnet(self, position: int, subnet: str) -> None:
+        requirement = self.requirements[position]
+        self._by_subnet[(requirement["type"], requirement["source"], requirement["subnet"])].remove(position)
+        requirement["subnet"] = subnet
+        bisect.insort(self._by_subnet.setdefault((requirement["type"], requirement["source"], subnet), []), position)
+
+
+def pick_sample(n: int, requirements: list | PolicyIndex, it: int, policy_types: SortedSet[str]) -> list:
+    index = requirements if isinstance(requirements, PolicyIndex) else PolicyIndex(requirements)
+
     random.seed(5000 + it)
-    shuffled_list = sorted(requirements, key=lambda k: random.random())
+    # The keys of the shuffle are drawn for the whole dataset, so the random state is the same as sorting it
+    shuffle_keys = [random.random() for _ in range(len(index))]
     if len(policy_types) == 1 and "reachability" in policy_types:
-        return [x for x in shuffled_list if x["type"] == "reachability"][:n]
+        return index.first("reachability", n, shuffle_keys)
 
     n_per_requirement = math.ceil(n / len(policy_types))
-    waypoint_samples = [x for x in shuffled_list if x["type"] == "waypoint"][:n_per_requirement]
+    waypoint_samples = index.first("waypoint", n_per_requirement, shuffle_keys)
 
     final_list = []
 
     for sample in waypoint_samples:
-        reachability_samples = [
-            x for x in requirements if x["type"] == "reachability" and x["source"] == sample["source"]
-                                       and x["subnet"] == sample["subnet"]
-        ]
-        filtered_sample = None if not reachability_samples else reachability_samples.pop()
+        position = index.last("reachability", sample["source"], sample["subnet"])
+        filtered_sample = None if position is None else index.requirements[position]
         final_list.append(filtered_sample)
 
         final_list.append(sample)
 
         if "loadbalancing" in policy_types:
-            loadbalancing_samples = [
-                x for x in requirements \
-                if x["type"] == "loadbalancing" and x["source"] == sample["source"] and x["subnet"] == sample["subnet"]
-            ]
-            if loadbalancing_samples:
-                filtered_sample = loadbalancing_samples.pop()
-            else:
-                loadbalancing_samples = [
-                    x for x in requirements if x["type"] == "loadbalancing" and x["source"] == sample["source"]
-                ]
-                filtered_sample = None if not loadbalancing_samples else loadbalancing_samples.pop()
-                filtered_sample["subnet"] = sample["subnet"]
-
-            final_list.append(filtered_sample)
+            position = index.last("loadbalancing", sample["source"], sample["subnet"])
+            if position is None:
+                position = index.last("loadbalancing", sample["source"])
+                # The requirement is moved to the subnet of the waypoint, also in the dataset used by later samples
+                index.set_subnet(position, sample["subnet"])
+
+            final_list.append(index.requirements[position])
 
     return final_list[:n]
 
@@ -145,20 +238,22 @@ no_waypoint_statements = [
 ]
 
 
-def convert_to_human_language(data: list[dict]) -> list[str]:
+def convert_to_human_language(data: list[dict], rng: random.Random | None = None) -> list[str]:
+    # Statements are drawn from the global random state, unless a generator is given
+    choice = rng.choice if rng is not None else random.choice
     language_statements = []
 
     for item in data:
         if item["type"] == 'reachability':
-            statement = random.choice(reachability_statements)
+            statement = choice(reachability_statements)
         elif item["type"] == 'waypoint':
-            statement = random.choice(waypoint_statements)
+            statement = choice(waypoint_statements)
         elif item["type"] == 'loadbalancing':
-            statement = random.choice(loadbalancing_statements)
+            statement = choice(loadbalancing_statements)
         elif item["type"] == 'no_reachability':
-            statement = random.choice(no_reachability_statements)
+            statement = choice(no_reachability_statements)
         elif item["type"] == 'no_waypoint':
-            statement = random.choice(no_waypoint_statements)
+            statement = choice(no_waypoint_statements)
         else:
             return []
 
@@ -192,94 +287,3 @@ def insert_conflict(data: list[dict], start: int | None = None, end: int | None
         conflict_statement_2["specifics"] += 1
 
     data.insert(index, conflict_statement_2)
-
-
-def check_subnet_exists_in_reachability(router: str, subnet: str, result: dict) -> bool:
-    if "reachability" not in result:
-        return False
-
-    result = result["reachability"]
-    if router in result.keys():
-        if subnet in result[router]:
-            return True
-
-    return False
-
-
-def check_value_exists_in_waypoint(waypoint: str, switches: list, result: dict) -> bool:
-    if "waypoint" not in result:
-        return False
-
-    waypoints = result["waypoint"]
-    if waypoint in waypoints and (switch in waypoints[waypoint] for switch in switches):
-        return True
-
-    return False
-
-
-def check_value_exists_in_loadbalacing(loadbalancing: str, num: int, result: dict) -> bool:
-    if "loadbalancing" not in result:
-        return False
-
-    loadbalancings = result["loadbalancing"]
-    if loadbalancing in loadbalancings and int(loadbalancings[loadbalancing]) == num:
-        return True
-
-    return False
-
-
-def compare_result(expected: dict, result: dict, result_row: dict) -> None:
-    count_expected = 0
-    count_res = 0
-    count_fail = 0
-    count_wrong = 0
-    if "reachability" in expected:
-        for router, subnets in expected["reachability"].items():
-            for subnet in subnets:
-                count_expected += 1
-                if not check_subnet_exists_in_reachability(router, subnet, result):
-                    count_fail += 1
-                    logging.warning(f"Fail to translate expected reachability from `{router}` to `{subnet}`.")
-
-    if "waypoint" in expected:
-        for waypoint, switches in expected["waypoint"].items():
-            count_expected += 1
-            if not check_value_exists_in_waypoint(waypoint, switches, result):
-                count_fail += 1
-                logging.warning(f"Fail to translate expected waypoint `{waypoint}`.")
-
-    if "loadbalancing" in expected:
-        for loadbalancing, num in expected["loadbalancing"].items():
-            count_expected += 1
-            if not check_value_exists_in_loadbalacing(loadbalancing, num, result):
-                count_fail += 1
-                logging.warning(f"Fail to translate expected load balancing `{loadbalancing}`.")
-
-    if "reachability" in result:
-        for router, subnets in result["reachability"].items():
-            for subnet in subnets:
-                count_res += 1
-                if not check_subnet_exists_in_reachability(router, subnet, expected):
-                    if "waypoint" not in expected or f"({router},{subnet})" not in expected["waypoint"]:
-                        count_wrong += 1
-                        logging.warning(f"Translate wrongly reachability from `{router}` to `{subnet}`.")
-
-    if "waypoint" in result:
-        for waypoint, switches in result["waypoint"].items():
-            count_res += 1
-            if not check_value_exists_in_waypoint(waypoint, switches, expected):
-                count_wrong += 1
-                logging.warning(f"Translate wrongly waypoint `{waypoint}`.")
-
-    if "loadbalancing" in result:
-        for loadbalancing, num in result["loadbalancing"].items():
-            count_res += 1
-            if not check_value_exists_in_loadbalacing(loadbalancing, num, expected):
-                count_wrong += 1
-                logging.warning(f"Translate wrongly load balancing `{loadbalancing}`.")
-
-    result_row['total'] = count_res
-    result_row['fail'] = count_fail
-    result_row['wrong'] = count_wrong
-    result_row['success'] = count_expected - count_fail
-    result_row['accuracy'] = result_row['success'] / count_expected
@@ -0,0 +1,277 @@
+import json
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+
+DEFAULT_LEASE_TIMEOUT = 600
+DEFAULT_MAX_ATTEMPTS = 3
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _to_json_row(result_row: dict) -> dict:
+    # Values are stored as the CSV writer would print them, so merged files match the ones written locally
+    return {
+        k: v if v is None or isinstance(v, (bool, int, float, str)) else str(v) for k, v in result_row.items()
+    }
+
+
+class WorkQueue(ABC):
+    """Work items of the experiments, shared by a coordinator and any number of workers.
+
+    Workers lease one item at a time and must complete, release or extend it before the lease expires, otherwise the
+    item is handed to another worker. An item that fails (or whose lease expires) `max_attempts` times is marked as
+    failed.
+    """
+
+    @abstractmethod
+    def publish_experiment(self, name: str, command: str, model: str, argv: list[str], results_path: str,
+                           keys: list[list]) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_timeout: float, models: list[str] | None = None,
+              exclude: set[int] | None = None) -> tuple[int, int] | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def extend_lease(self, experiment_id: int, index: int, worker_id: str, lease_timeout: float) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete(self, experiment_id: int, index: int, worker_id: str, result_row: dict) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, experiment_id: int, index: int, worker_id: str, error: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def experiment(self, experiment_id: int) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def experiments(self) -> list[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def item_key(self, experiment_id: int, index: int) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def results(self, experiment_id: int) -> list[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def errors(self, experiment_id: int) -> list[tuple[int, str]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def remaining(self, models: list[str] | None = None) -> int:
+        raise NotImplementedError
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue stored in a SQLite database, which can be placed on a storage shared by all the hosts.
+
+    Every operation runs in its own `BEGIN IMMEDIATE` transaction, so leases are atomic across processes. The default
+    rollback journal is used, since WAL mode requires shared memory and does not work on network file systems.
+    """
+
+    def __init__(self, path: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> None:
+        self.path: str = os.path.abspath(path)
+        self.max_attempts: int = max_attempts
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS experiments (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, "
+                "command TEXT NOT NULL, model TEXT NOT NULL, argv TEXT NOT NULL, results_path TEXT NOT NULL, "
+                "created REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS items (experiment_id INTEGER NOT NULL, idx INTEGER NOT NULL, "
+                "key TEXT NOT NULL, status TEXT NOT NULL, worker_id TEXT, lease_expires REAL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, result TEXT, PRIMARY KEY (experiment_id, idx))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status, experiment_id, idx)")
+
+    def _transaction(self) -> '_Transaction':
+        return _Transaction(self.path)
+
+    def publish_experiment(self, name: str, command: str, model: str, argv: list[str], results_path: str,
+                           keys: list[list]) -> int:
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM experiments WHERE name = ?", (name,)).fetchone() is not None:
+                raise Exception(f"Experiment `{name}` already published in `{self.path}`!")
+
+            cursor = conn.execute(
+                "INSERT INTO experiments (name, command, model, argv, results_path, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, command, model, json.dumps(argv), results_path, time.time())
+            )
+            experiment_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO items (experiment_id, idx, key, status) VALUES (?, ?, ?, ?)",
+                [(experiment_id, idx, json.dumps(key), PENDING) for idx, key in enumerate(keys)]
+            )
+
+        return experiment_id
+
+    def lease(self, worker_id: str, lease_timeout: float, models: list[str] | None = None,
+              exclude: set[int] | None = None) -> tuple[int, int] | None:
+        now = time.time()
+        with self._transaction() as conn:
+            # Items whose lease expired too many times are not handed out anymore
+            conn.execute(
+                "UPDATE items SET status = ?, error = COALESCE(error, 'Lease expired') "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts)
+            )
+
+            query = ("SELECT items.experiment_id, items.idx FROM items JOIN experiments ON experiments.id = "
+                     "items.experiment_id WHERE (items.status = ? OR (items.status = ? AND items.lease_expires < ?))")
+            params = [PENDING, LEASED, now]
+            if models is not None:
+                query += f" AND experiments.model IN ({', '.join('?' for _ in models)})"
+                params.extend(models)
+            if exclude:
+                query += f" AND items.experiment_id NOT IN ({', '.join('?' for _ in exclude)})"
+                params.extend(exclude)
+            query += " ORDER BY items.experiment_id, items.idx LIMIT 1"
+
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE items SET status = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE experiment_id = ? AND idx = ?",
+                (LEASED, worker_id, now + lease_timeout, row[0], row[1])
+            )
+
+        return row[0], row[1]
+
+    def extend_lease(self, experiment_id: int, index: int, worker_id: str, lease_timeout: float) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE items SET lease_expires = ? WHERE experiment_id = ? AND idx = ? AND status = ? AND "
+                "worker_id = ?",
+                (time.time() + lease_timeout, experiment_id, index, LEASED, worker_id)
+            )
+
+        return cursor.rowcount > 0
+
+    def complete(self, experiment_id: int, index: int, worker_id: str, result_row: dict) -> bool:
+        # The first completion wins, also when the lease expired and the item was handed to another worker
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE items SET status = ?, worker_id = ?, result = ?, error = NULL "
+                "WHERE experiment_id = ? AND idx = ? AND status != ?",
+                (DONE, worker_id, json.dumps(_to_json_row(result_row)), experiment_id, index, DONE)
+            )
+
+        return cursor.rowcount > 0
+
+    def release(self, experiment_id: int, index: int, worker_id: str, error: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_expires = NULL, "
+                "error = ? WHERE experiment_id = ? AND idx = ? AND status = ? AND worker_id = ?",
+                (self.max_attempts, FAILED, PENDING, error, experiment_id, index, LEASED, worker_id)
+            )
+
+    def _experiment_from_row(self, conn: sqlite3.Connection, row: tuple) -> dict:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM items WHERE experiment_id = ? GROUP BY status",
+                                   (row[0],)).fetchall())
+        return {
+            'id': row[0],
+            'name': row[1],
+            'command': row[2],
+            'model': row[3],
+            'argv': json.loads(row[4]),
+            'results_path': row[5],
+            'n_items': sum(counts.values()),
+            **{status: counts.get(status, 0) for status in [PENDING, LEASED, DONE, FAILED]},
+        }
+
+    def experiment(self, experiment_id: int) -> dict:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, name, command, model, argv, results_path FROM experiments WHERE id = ?", (experiment_id,)
+            ).fetchone()
+            if row is None:
+                raise Exception(f"Experiment `{experiment_id}` not found in `{self.path}`!")
+
+            return self._experiment_from_row(conn, row)
+
+    def experiments(self) -> list[dict]:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, name, command, model, argv, results_path FROM experiments ORDER BY id"
+            ).fetchall()
+
+            return [self._experiment_from_row(conn, row) for row in rows]
+
+    def item_key(self, experiment_id: int, index: int) -> list:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT key FROM items WHERE experiment_id = ? AND idx = ?", (experiment_id, index)
+            ).fetchone()
+
+        return json.loads(row[0])
+
+    def results(self, experiment_id: int) -> list[dict]:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT result FROM items WHERE experiment_id = ? AND status = ? ORDER BY idx", (experiment_id, DONE)
+            ).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+    def errors(self, experiment_id: int) -> list[tuple[int, str]]:
+        with self._transaction() as conn:
+            return conn.execute(
+                "SELECT idx, error FROM items WHERE experiment_id = ? AND status = ? ORDER BY idx",
+                (experiment_id, FAILED)
+            ).fetchall()
+
+    def remaining(self, models: list[str] | None = None) -> int:
+        query = ("SELECT COUNT(*) FROM items JOIN experiments ON experiments.id = items.experiment_id "
+                 "WHERE items.status IN (?, ?)")
+        params = [PENDING, LEASED]
+        if models is not None:
+            query += f" AND experiments.model IN ({', '.join('?' for _ in models)})"
+            params.extend(models)
+
+        with self._transaction() as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+
+class _Transaction:
+    def __init__(self, path: str) -> None:
+        self._path: str = path
+        self._conn: sqlite3.Connection | None = None
+
+    def __enter__(self) -> sqlite3.Connection:
+        # A fresh connection for each transaction, so the queue can be shared by the threads of a worker
+        self._conn = sqlite3.connect(self._path, timeout=60, isolation_level=None)
+        self._conn.execute("BEGIN IMMEDIATE")
+
+        return self._conn
+
+    def __exit__(self, exc_type: type | None, exc_val: Exception | None, exc_tb: object) -> None:
+        try:
+            self._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self._conn.close()
+
+
+def get_work_queue(url: str) -> WorkQueue:
+    if url.startswith("sqlite:///"):
+        return SQLiteWorkQueue(url[len("sqlite:///"):])
+
+    raise Exception(f"Work queue `{url}` not supported! Use `sqlite:///<path>`.")
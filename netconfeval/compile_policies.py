@@ -0,0 +1,42 @@
+import argparse
+import logging
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from netconfeval.common.policy_cache import DEFAULT_CACHE_PATH, compile_policies
+
+
+# Repository root: the default policy file is resolved from it, not from the working directory
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--policy_file", type=str, nargs='+', required=False,
+                        default=[os.path.join(ROOT_PATH, "assets", "step_1_policies.csv")])
+    parser.add_argument('--policy_cache', type=str, required=False, default=DEFAULT_CACHE_PATH)
+
+    return parser
+
+
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    for policy_file in args.policy_file:
+        compile_policies(policy_file, args.policy_cache)
+
+
+if __name__ == "__main__":
+    main(parse_args())
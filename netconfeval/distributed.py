@@ -0,0 +1,293 @@
+import argparse
+import contextlib
+import contextvars
+import csv
+import importlib
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from netconfeval.cli import COMMANDS
+from netconfeval.common.model_configs import model_configurations, keep_models_loaded, unload_models
+from netconfeval.common.results_store import ResultsStore
+from netconfeval.common.trace_logging import LOG_FORMATS, experiment_logging, set_trace_run
+from netconfeval.common.utils import result_key
+from netconfeval.common.work_queue import DEFAULT_LEASE_TIMEOUT, WorkQueue, get_work_queue
+from netconfeval.matrix_runner import load_spec
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    publish_parser = subparsers.add_parser('publish')
+    publish_parser.add_argument('--queue', type=str, required=True)
+    publish_parser.add_argument('--spec', type=str, required=True)
+    publish_parser.add_argument('--models', type=str, required=False, nargs='+', default=None,
+                                choices=model_configurations.keys())
+    publish_parser.add_argument('--n_runs', type=int, required=False, default=None)
+
+    work_parser = subparsers.add_parser('work')
+    work_parser.add_argument('--queue', type=str, required=True)
+    work_parser.add_argument('--models', type=str, required=False, nargs='+', default=None,
+                             choices=model_configurations.keys())
+    work_parser.add_argument('--lease_timeout', type=int, required=False, default=DEFAULT_LEASE_TIMEOUT)
+    work_parser.add_argument('--poll_interval', type=int, required=False, default=10)
+    work_parser.add_argument('--concurrency', type=int, required=False, default=1)
+    work_parser.add_argument('--log_path', type=str, required=False, default=None)
+    work_parser.add_argument('--log_format', choices=LOG_FORMATS, required=False, default='text')
+
+    merge_parser = subparsers.add_parser('merge')
+    merge_parser.add_argument('--queue', type=str, required=True)
+    merge_parser.add_argument('--results_path', type=str, required=False, default=None)
+    merge_parser.add_argument('--partial', action="store_true")
+    merge_parser.add_argument('--results_store', type=str, required=False, default=None)
+
+    status_parser = subparsers.add_parser('status')
+    status_parser.add_argument('--queue', type=str, required=True)
+
+    return parser
+
+
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
+
+
+def publish(args: argparse.Namespace) -> None:
+    queue = get_work_queue(args.queue)
+    runs = load_spec(args.spec, args.models, args.n_runs)
+
+    # Names are computed with the same timestamp, so that the merged files of a publication can be found together
+    results_time = time.strftime("%Y%m%d-%H%M%S")
+    experiments = []
+    for model, model_runs in runs.items():
+        for command, module, argv, experiment_args in model_runs:
+            if getattr(experiment_args, 'batch_api', False) or experiment_args.resume or \
+                    getattr(experiment_args, 'sampling', 'full') != 'full':
+                raise Exception(f"Experiment `{command}` on model `{model}` cannot be distributed with "
+                                f"`--batch_api`, `--resume` or adaptive sampling!")
+
+            name = module.experiment_name(experiment_args, results_time)
+            if name in [experiment[0] for experiment in experiments]:
+                raise Exception(f"Experiment `{name}` is duplicated in `{args.spec}`!")
+
+            experiments.append((name, command, model, argv, module, experiment_args))
+
+    for name, command, model, argv, module, experiment_args in experiments:
+        keys = [list(result_key(work_item, module.RESUME_KEY)) for work_item in module.plan_experiment(experiment_args)]
+        queue.publish_experiment(name, command, model, argv, os.path.abspath(experiment_args.results_path), keys)
+        logging.info(f"Published experiment `{name}` with {len(keys)} work items.")
+
+
+class _Worker:
+    def __init__(self, queue: WorkQueue, args: argparse.Namespace) -> None:
+        self.queue: WorkQueue = queue
+        self.args: argparse.Namespace = args
+        self.worker_id: str = f"{socket.gethostname()}-{os.getpid()}"
+
+        self._exit_stack: contextlib.ExitStack = contextlib.ExitStack()
+        # Experiment id -> (name, driver module, work items, worker function, maximum number of items run at the same
+        # time)
+        self._experiments: dict[int, tuple[str, object, list[dict], callable, int]] = {}
+        self._active: dict[tuple[int, int], Future] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self._stop: threading.Event = threading.Event()
+
+    def _setup_experiment(self, experiment_id: int) -> None:
+        if experiment_id not in self._experiments:
+            experiment = self.queue.experiment(experiment_id)
+            module = importlib.import_module(COMMANDS[experiment['command']])
+            experiment_args = module.build_parser().parse_args(experiment['argv'])
+
+            logging.info(f"Setting up experiment `{experiment['name']}`...")
+            work_items = module.plan_experiment(experiment_args)
+            if len(work_items) != experiment['n_items']:
+                raise Exception(f"Experiment `{experiment['name']}` planned {len(work_items)} work items on this "
+                                f"host, {experiment['n_items']} were published!")
+
+            worker = self._exit_stack.enter_context(module.experiment_worker(experiment_args, work_items))
+            # Drivers without the `concurrency` argument (steps 2 and 3) run their items one at a time
+            capacity = getattr(experiment_args, 'concurrency', 1)
+            self._experiments[experiment_id] = (experiment['name'], module, work_items, worker, capacity)
+
+    def _run_item(self, experiment_id: int, index: int) -> None:
+        try:
+            name, module, work_items, worker, _ = self._experiments[experiment_id]
+            work_item = work_items[index]
+            key = self.queue.item_key(experiment_id, index)
+            if list(result_key(work_item, module.RESUME_KEY)) != key:
+                raise Exception(f"Work item {index} planned on this host does not match the published one {key}!")
+
+            # Each work item runs in a fresh copy of the context, as in the local executor, tagged with its experiment
+            ctx = contextvars.copy_context()
+            ctx.run(set_trace_run, name)
+            result_row = ctx.run(worker, work_item)
+            if not self.queue.complete(experiment_id, index, self.worker_id, result_row):
+                logging.warning(f"Work item {index} of experiment {experiment_id} was already completed by another "
+                                f"worker, result discarded.")
+        except Exception as e:
+            logging.error(f"Work item {index} of experiment {experiment_id} failed: {e}")
+            self.queue.release(experiment_id, index, self.worker_id, str(e))
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.args.lease_timeout / 3):
+            with self._lock:
+                leased = list(self._active.keys())
+
+            for experiment_id, index in leased:
+                if not self.queue.extend_lease(experiment_id, index, self.worker_id, self.args.lease_timeout):
+                    logging.warning(f"Lease of work item {index} of experiment {experiment_id} lost.")
+
+    def _saturated(self) -> set[int]:
+        running = {}
+        for experiment_id, _ in self._active.keys():
+            running[experiment_id] = running.get(experiment_id, 0) + 1
+
+        return {
+            experiment_id for experiment_id, n_running in running.items()
+            if n_running >= self._experiments[experiment_id][4]
+        }
+
+    def run(self) -> None:
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+
+        keep_models_loaded()
+        try:
+            with self._exit_stack, ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+                while True:
+                    with self._lock:
+                        for leased, future in list(self._active.items()):
+                            if future.done():
+                                del self._active[leased]
+
+                    if len(self._active) < self.args.concurrency:
+                        leased = self.queue.lease(
+                            self.worker_id, self.args.lease_timeout, self.args.models, self._saturated()
+                        )
+                        if leased is not None:
+                            try:
+                                self._setup_experiment(leased[0])
+                            except (Exception, SystemExit) as e:
+                                logging.error(f"Cannot set up experiment {leased[0]}: {e}")
+                                self.queue.release(leased[0], leased[1], self.worker_id, str(e))
+                                continue
+
+                            # Loading the model may take longer than the lease
+                            if not self.queue.extend_lease(*leased, self.worker_id, self.args.lease_timeout):
+                                logging.warning(f"Lease of work item {leased[1]} of experiment {leased[0]} lost.")
+                                continue
+
+                            with self._lock:
+                                self._active[leased] = pool.submit(self._run_item, *leased)
+                            continue
+
+                    if self._active:
+                        wait(list(self._active.values()), timeout=self.args.poll_interval, return_when=FIRST_COMPLETED)
+                    elif self.queue.remaining(self.args.models) == 0:
+                        break
+                    else:
+                        # The remaining items are leased by other workers, they are taken over if their lease expires
+                        time.sleep(self.args.poll_interval)
+        finally:
+            self._stop.set()
+            unload_models()
+            keep_models_loaded(False)
+
+        logging.info(f"Worker `{self.worker_id}` done, no work items left.")
+
+
+def work(args: argparse.Namespace) -> None:
+    queue = get_work_queue(args.queue)
+    worker = _Worker(queue, args)
+
+    if args.log_path:
+        os.makedirs(args.log_path, exist_ok=True)
+        with experiment_logging(args.log_path, f"worker-{worker.worker_id}", args.log_format):
+            worker.run()
+    else:
+        worker.run()
+
+
+def merge(args: argparse.Namespace) -> None:
+    queue = get_work_queue(args.queue)
+
+    incomplete = []
+    for experiment in queue.experiments():
+        if experiment['done'] < experiment['n_items']:
+            for index, error in queue.errors(experiment['id']):
+                logging.error(f"Work item {index} of experiment `{experiment['name']}` failed: {error}")
+            if not args.partial:
+                logging.warning(f"Experiment `{experiment['name']}` has {experiment['done']}/{experiment['n_items']} "
+                                f"work items completed, skipping.")
+                incomplete.append(experiment['name'])
+                continue
+
+        rows = queue.results(experiment['id'])
+        if not rows:
+            continue
+
+        if args.results_store:
+            module = importlib.import_module(COMMANDS[experiment['command']])
+            experiment_args = module.build_parser().parse_args(experiment['argv'])
+            store = ResultsStore(args.results_store)
+            try:
+                # As the merged CSV files, experiments merged again are overwritten
+                store.drop_experiment(experiment['name'])
+                store.create_experiment(experiment['name'], experiment['command'], vars(experiment_args))
+                store.insert(experiment['name'], rows, module.COMPRESSED_COLUMNS)
+            finally:
+                store.close()
+
+            logging.info(f"Merged {len(rows)} rows of experiment `{experiment['name']}` into `{args.results_store}`.")
+            continue
+
+        results_path = args.results_path if args.results_path else experiment['results_path']
+        os.makedirs(results_path, exist_ok=True)
+        results_file = os.path.join(results_path, f"result-{experiment['name']}.csv")
+        with open(results_file, 'w') as f:
+            w = csv.DictWriter(f, rows[0].keys())
+            w.writeheader()
+            w.writerows(rows)
+
+        logging.info(f"Merged {len(rows)} rows of experiment `{experiment['name']}` into `{results_file}`.")
+
+    if incomplete:
+        exit(1)
+
+
+def status(args: argparse.Namespace) -> None:
+    queue = get_work_queue(args.queue)
+    for experiment in queue.experiments():
+        logging.info(f"{experiment['name']} ({experiment['model']}): {experiment['done']}/{experiment['n_items']} "
+                     f"done, {experiment['leased']} leased, {experiment['pending']} pending, "
+                     f"{experiment['failed']} failed")
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    if args.action == 'publish':
+        publish(args)
+    elif args.action == 'work':
+        work(args)
+    elif args.action == 'merge':
+        merge(args)
+    elif args.action == 'status':
+        status(args)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,45 @@
+import contextvars
+from contextlib import contextmanager
+from typing import Generator
+
+CACHE_MODES = ['read-write', 'read-only', 'refresh']
+
+DEFAULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+
+class CacheStats:
+    __slots__ = ['hits', 'misses']
+
+    def __init__(self) -> None:
+        self.hits: int = 0
+        self.misses: int = 0
+
+
+_cache_stats: contextvars.ContextVar[CacheStats | None] = contextvars.ContextVar("cache_stats", default=None)
+_cache_attempt: contextvars.ContextVar[int] = contextvars.ContextVar("cache_attempt", default=0)
+
+
+def start_cache_stats() -> CacheStats:
+    """Start counting cache hits and misses in the current context.
+
+    The executor runs each work item in its own copy of the context, so the returned counters only include
+    the lookups performed while processing that item.
+    """
+    stats = CacheStats()
+    _cache_stats.set(stats)
+
+    return stats
+
+
+@contextmanager
+def cache_attempt(attempt: int) -> Generator[None, None, None]:
+    """Cache the responses of the calls in the context as the `attempt`-th try of their prompt.
+
+    Retries of the same prompt (e.g., after a response that cannot be parsed) are cached separately, so they do not
+    replay the response of the failed attempt. A cached run replays the responses of all the attempts of the run.
+    """
+    token = _cache_attempt.set(attempt)
+    try:
+        yield
+    finally:
+        _cache_attempt.reset(token)
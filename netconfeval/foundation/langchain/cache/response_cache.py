@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+
+from .cache_stats import CACHE_MODES, DEFAULT_CACHE_MAX_SIZE, _cache_attempt, _cache_stats
+
+
+def _json_default(obj: Any) -> str:
+    # Model configurations may contain callables (e.g., the prompt builders of HF models)
+    return getattr(obj, '__name__', str(obj))
+
+
+class ResponseCache(BaseCache):
+    """Persistent, content-addressed cache of LLM responses backed by SQLite.
+
+    Entries are keyed on a hash of the model configuration, the rendered prompt, the sampling parameters and the
+    attempt of the prompt (see `cache_attempt`).
+    When the total size of the stored responses exceeds `max_size` bytes, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str, model_config: dict, mode: str = 'read-write',
+                 max_size: int = DEFAULT_CACHE_MAX_SIZE) -> None:
+        if mode not in CACHE_MODES:
+            raise Exception(f"Unsupported cache mode `{mode}`!")
+
+        self._mode: str = mode
+        self._max_size: int = max_size
+        self._config_hash: str = hashlib.sha256(
+            json.dumps(model_config, sort_keys=True, default=_json_default).encode('utf-8')
+        ).hexdigest()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        key = hashlib.sha256(self._config_hash.encode('utf-8'))
+        key.update(b"\0" + llm_string.encode('utf-8'))
+        key.update(b"\0" + prompt.encode('utf-8'))
+        # First attempts keep the keys of the entries cached before retries were keyed separately
+        attempt = _cache_attempt.get()
+        if attempt > 0:
+            key.update(b"\0" + str(attempt).encode('utf-8'))
+
+        return key.hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        stats = _cache_stats.get()
+        if self._mode == 'refresh':
+            if stats is not None:
+                stats.misses += 1
+            return None
+
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._mode == 'read-write':
+                with self._connection:
+                    self._connection.execute(
+                        "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+                    )
+
+        if row is None:
+            if stats is not None:
+                stats.misses += 1
+            return None
+
+        if stats is not None:
+            stats.hits += 1
+        logging.debug(f"Cache hit for key `{key}`.")
+
+        generations = [loads(generation) for generation in json.loads(row[0])]
+        # Replayed generations are marked, so that their token usage and timings are not accounted again
+        for generation in generations:
+            generation.generation_info = {**(generation.generation_info or {}), 'cached': True}
+
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if self._mode == 'read-only':
+            return
+
+        key = self._key(prompt, llm_string)
+        value = json.dumps([dumps(generation) for generation in return_val])
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time())
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        (total_size,) = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total_size <= self._max_size:
+            return
+
+        evicted = 0
+        for key, size in self._connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if total_size <= self._max_size:
+                break
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_size -= size
+            evicted += 1
+
+        logging.debug(f"Evicted {evicted} entries from the response cache.")
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
@@ -0,0 +1,110 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Generator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+# Ollama reports durations in nanoseconds
+_NS_PER_SECOND = 1e9
+
+
+def _usage_from_generation_info(generation_info: dict | None) -> tuple[int, int, float, float, float] | None:
+    """Returns (prompt tokens, completion tokens, time to first token, prefill time, decode time) of a generation."""
+    if not generation_info or generation_info.get('cached', False):
+        return None
+
+    if 'eval_count' in generation_info:
+        # Ollama: responses are not streamed, so the time to first token is everything but the decoding
+        decode_time = generation_info.get('eval_duration', 0) / _NS_PER_SECOND
+        return (
+            generation_info.get('prompt_eval_count', 0),
+            generation_info['eval_count'],
+            generation_info.get('total_duration', 0) / _NS_PER_SECOND - decode_time,
+            generation_info.get('prompt_eval_duration', 0) / _NS_PER_SECOND,
+            decode_time,
+        )
+
+    if 'completion_tokens' in generation_info:
+        # HuggingFace: tokens are counted with the model tokenizer and timings are measured around `generate`
+        return (
+            generation_info.get('prompt_tokens', 0),
+            generation_info['completion_tokens'],
+            generation_info.get('time_to_first_token', 0),
+            generation_info.get('prefill_time', 0),
+            generation_info.get('decode_time', 0),
+        )
+
+    return None
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Collects token usage and timings reported by the local backends (HuggingFace and Ollama).
+
+    Responses served by the response cache are not counted.
+    """
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    n_calls: int = 0
+    total_time_to_first_token: float = 0
+    prefill_time: float = 0
+    decode_time: float = 0
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.completion_tokens / self.decode_time if self.decode_time > 0 else 0
+
+    @property
+    def time_to_first_token(self) -> float:
+        return self.total_time_to_first_token / self.n_calls if self.n_calls > 0 else 0
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = _usage_from_generation_info(generation.generation_info)
+                if usage is None:
+                    continue
+
+                prompt_tokens, completion_tokens, time_to_first_token, prefill_time, decode_time = usage
+                with self._lock:
+                    self.prompt_tokens += prompt_tokens
+                    self.completion_tokens += completion_tokens
+                    self.n_calls += 1
+                    self.total_time_to_first_token += time_to_first_token
+                    self.prefill_time += prefill_time
+                    self.decode_time += decode_time
+
+    def record(self, result_row: dict) -> None:
+        result_row['prompt_tokens'] = self.prompt_tokens
+        result_row['completion_tokens'] = self.completion_tokens
+        result_row['tokens_per_second'] = self.tokens_per_second
+        result_row['time_to_first_token'] = self.time_to_first_token
+        result_row['prefill_time'] = self.prefill_time
+        result_row['decode_time'] = self.decode_time
+
+
+usage_callback_var: ContextVar[Optional[UsageCallbackHandler]] = ContextVar("usage_callback", default=None)
+register_configure_hook(usage_callback_var, True)
+
+
+@contextmanager
+def get_usage_callback(cb: UsageCallbackHandler | None = None) -> Generator[UsageCallbackHandler, None, None]:
+    """Collects the usage of the calls in the context, on top of the one already in `cb` if passed."""
+    if cb is None:
+        cb = UsageCallbackHandler()
+    token = usage_callback_var.set(cb)
+    try:
+        yield cb
+    finally:
+        # Restores the enclosing handler, if any
+        usage_callback_var.reset(token)
@@ -1,13 +1,25 @@
+import asyncio
+import copy
+import hashlib
 import logging
-from typing import Any, List, Optional
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
 
 from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun
 from langchain.chat_models.base import BaseChatModel
 from langchain.schema import BaseMessage, AIMessage, ChatResult, ChatGeneration, HumanMessage, SystemMessage
+import torch
 from torch import bfloat16
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
     pipeline,
     BitsAndBytesConfig
 )
@@ -37,12 +49,301 @@ def _parse_chat_history(history: List[BaseMessage]) -> list[str]:
     return chat_history
 
 
+def _get_prompt_prefix(messages: List[BaseMessage], input_text: str) -> str | None:
+    """Return the part of the rendered prompt that ends with the leading system messages, if any."""
+    prefix_content = None
+    for message in messages:
+        if not isinstance(message, SystemMessage):
+            break
+        prefix_content = message.content.strip()
+
+    if not prefix_content:
+        return None
+
+    position = input_text.find(prefix_content)
+    if position < 0:
+        return None
+
+    return input_text[:position + len(prefix_content)]
+
+
+class _JsonObjectScanner:
+    """Tracks the brace and quote balance of a text fed in chunks, starting from the first `{`."""
+    __slots__ = ['_started', '_depth', '_in_string', '_escape']
+
+    def __init__(self) -> None:
+        self._started: bool = False
+        self._depth: int = 0
+        self._in_string: bool = False
+        self._escape: bool = False
+
+    def feed(self, text: str) -> int:
+        """Return the position in `text` right after the end of the top-level JSON object, -1 if not complete yet."""
+        for idx, char in enumerate(text):
+            if not self._started:
+                if char == '{':
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    return idx + 1
+
+        return -1
+
+
+def _truncate_response(text: str, stop: list[str] | None, stop_reason: str | None) -> str:
+    if stop_reason == 'json':
+        end = _JsonObjectScanner().feed(text)
+        if end >= 0:
+            text = text[:end]
+
+    if stop:
+        positions = [text.find(stop_string) for stop_string in stop if stop_string in text]
+        if positions:
+            text = text[:min(positions)]
+
+    return text
+
+
+class _StopCriteria(StoppingCriteria):
+    """Stops each generated sequence once it emitted a complete JSON object or one of the stop strings."""
+
+    def __init__(self, tokenizer: Any, stops: list[list[str] | None], stop_on_json: bool, max_length: int) -> None:
+        self._tokenizer: Any = tokenizer
+        self._stops: list[list[str]] = [stop if stop else [] for stop in stops]
+        self._stop_on_json: bool = stop_on_json
+        self._max_length: int = max_length
+        self._start: int | None = None
+        self._scanners: list[_JsonObjectScanner] = [_JsonObjectScanner() for _ in stops]
+        self._texts: list[str] = [""] * len(stops)
+        self._offsets: list[tuple[int, int]] = []
+
+        # Criteria are evaluated after each decoding step, so the first call marks the end of the prefill
+        self.first_token_time: float | None = None
+        self.stop_reasons: list[str | None] = [None] * len(stops)
+        # Tokens left of the `max_length` budget when a sequence is stopped, i.e., an upper bound of the tokens saved,
+        # since the model may have emitted the end of sequence token earlier
+        self.remaining_tokens: list[int] = [0] * len(stops)
+
+    def _decode_delta(self, row: int, token_ids: list[int]) -> str:
+        # Incremental detokenization: tokens are decoded together with the previous ones, so that spaces and
+        # multi-byte characters split across tokens are rendered correctly
+        prefix_offset, read_offset = self._offsets[row]
+        prefix_text = self._tokenizer.decode(token_ids[prefix_offset:read_offset], skip_special_tokens=True)
+        new_text = self._tokenizer.decode(token_ids[prefix_offset:], skip_special_tokens=True)
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return ""
+
+        self._offsets[row] = (read_offset, len(token_ids))
+        return new_text[len(prefix_text):]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs: Any) -> torch.BoolTensor:
+        if self._start is None:
+            self.first_token_time = time.perf_counter()
+            self._start = input_ids.shape[1] - 1
+            self._offsets = [(0, 0)] * input_ids.shape[0]
+
+        is_done = []
+        for row in range(input_ids.shape[0]):
+            if self.stop_reasons[row] is None:
+                delta = self._decode_delta(row, input_ids[row, self._start:].tolist())
+                if delta:
+                    if self._stop_on_json and self._scanners[row].feed(delta) >= 0:
+                        self.stop_reasons[row] = 'json'
+
+                    longest_stop = max((len(stop_string) for stop_string in self._stops[row]), default=0)
+                    tail = self._texts[row][-longest_stop:] if longest_stop > 0 else ""
+                    self._texts[row] += delta
+                    if any(stop_string in tail + delta for stop_string in self._stops[row]):
+                        self.stop_reasons[row] = 'stop'
+
+                if self.stop_reasons[row] is not None:
+                    self.remaining_tokens[row] = max(self._max_length - input_ids.shape[1], 0)
+
+            is_done.append(self.stop_reasons[row] is not None)
+
+        return torch.tensor(is_done, dtype=torch.bool, device=input_ids.device)
+
+
+class _GenerationRequest:
+    __slots__ = ['input_text', 'prefix', 'stop', 'prompt_tokens', 'submit_time']
+
+    def __init__(self, input_text: str, prefix: str | None, stop: list[str] | None) -> None:
+        self.input_text: str = input_text
+        self.prefix: str | None = prefix
+        self.stop: list[str] | None = stop
+        self.prompt_tokens: int | None = None
+        self.submit_time: float = time.perf_counter()
+
+
+class _PrefixCache:
+    """LRU cache of the past key values of prompt prefixes, bounded by the memory used by their tensors."""
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size: int = max_size
+        self._size: int = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def _key(prefix_ids: list[int]) -> str:
+        return hashlib.sha256(",".join(map(str, prefix_ids)).encode()).hexdigest()
+
+    @staticmethod
+    def _tensors_size(past_key_values: DynamicCache) -> int:
+        # The legacy format (a key/value pair per layer) is stable across the `DynamicCache` internal layouts
+        return sum(
+            tensor.nelement() * tensor.element_size()
+            for layer in past_key_values.to_legacy_cache() for tensor in layer
+        )
+
+    def get(self, prefix_ids: list[int]) -> DynamicCache | None:
+        key = self._key(prefix_ids)
+        if key not in self._entries:
+            return None
+
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, prefix_ids: list[int], past_key_values: DynamicCache) -> None:
+        size = self._tensors_size(past_key_values)
+        if size > self._max_size:
+            return
+
+        self._entries[self._key(prefix_ids)] = (past_key_values, size)
+        self._size += size
+        while self._size > self._max_size:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+            logger.debug(f"Evicted a prompt prefix of {evicted_size} bytes from the prefix cache.")
+
+
+class _PromptBatcher:
+    """Collects the prompts submitted by concurrent callers and generates them in batches.
+
+    A batch is closed when it reaches `batch_size` prompts or when `batch_timeout` seconds elapsed since its
+    first prompt. A prompt submitted alone is generated right away, unless the previous batch was shared by concurrent
+    callers, so a single caller never waits for the timeout. Batches are processed by a single thread, so the pipeline
+    is never called concurrently.
+
+    When more than `batch_size` prompts are waiting, they are sorted by `length` before being split into batches, so
+    each batch groups prompts of similar length and needs less padding.
+    """
+
+    def __init__(self, generate_batch: Callable[[list[_GenerationRequest]], list[tuple[str, dict]]],
+                 batch_size: int, batch_timeout: float,
+                 length: Callable[[_GenerationRequest], int] | None = None) -> None:
+        self._generate_batch: Callable[[list[_GenerationRequest]], list[tuple[str, dict]]] = generate_batch
+        self._batch_size: int = batch_size
+        self._batch_timeout: float = batch_timeout
+        self._length: Callable[[_GenerationRequest], int] | None = length
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock: threading.Lock = threading.Lock()
+        # Whether the previous batch had more than one prompt, i.e., other callers may submit a prompt soon
+        self._concurrent: bool = False
+
+    def submit(self, request: _GenerationRequest) -> Future:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        future = Future()
+        self._queue.put((request, future))
+
+        return future
+
+    def close(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                # The worker thread holds a reference to the model, it must exit to release the weights
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            pending = [item]
+            batch_timeout = self._batch_timeout if self._concurrent or not self._queue.empty() else 0
+            deadline = time.monotonic() + batch_timeout
+            while len(pending) < self._batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Close after generating the pending prompts
+                    self._queue.put(None)
+                    break
+                pending.append(item)
+
+            # Take the other waiting prompts as well, to bucket them by length across batches
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                pending.append(item)
+
+            if self._length is not None and len(pending) > self._batch_size:
+                pending.sort(key=lambda pending_item: self._length(pending_item[0]))
+
+            self._concurrent = len(pending) > 1
+            for start in range(0, len(pending), self._batch_size):
+                self._process(pending[start:start + self._batch_size])
+
+    def _process(self, batch: list[tuple[_GenerationRequest, Future]]) -> None:
+        logger.debug(f"Generating a batch of {len(batch)} prompts.")
+        try:
+            outputs = self._generate_batch([request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+
+
 class ChatHF(BaseChatModel):
     model_name: str
     max_length: int
     temperature: float | None
     use_quantization: bool
+    batch_size: int = 1
+    batch_timeout: float = 0.1
+    prefix_cache_size: int = 0
+    stop_on_json: bool = True
     text_pipeline: Any
+    generation_kwargs: Any
+    prefix_cache: Any
+    prompt_batcher: Any
     prompt_func: Any
 
     # Need to set the LD_LIBRARY_PATH to use quantization (BitsAndBytesConfig)
@@ -60,12 +361,23 @@ class ChatHF(BaseChatModel):
         self.temperature = kwargs.get('temperature', 0.01)
         self.use_quantization = kwargs.get('use_quantization', False)
         self.prompt_func = kwargs.get('prompt_func', None)
+        self.batch_size = kwargs.get('batch_size', 1)
+        self.batch_timeout = kwargs.get('batch_timeout', 0.1)
+        self.prefix_cache_size = kwargs.get('prefix_cache_size', 0)
+        self.stop_on_json = kwargs.get('stop_on_json', True)
         self.text_pipeline = self._initialize_text_pipeline()
+        self.prefix_cache = _PrefixCache(self.prefix_cache_size) if self.prefix_cache_size > 0 else None
+        self.prompt_batcher = _PromptBatcher(
+            self._generate_batch, self.batch_size, self.batch_timeout, length=self._prompt_tokens
+        )
 
     @property
     def _llm_type(self) -> str:
         return self.model_name
 
+    def close(self) -> None:
+        self.prompt_batcher.close()
+
     def _initialize_text_pipeline(self):
         additional_model_kwargs = {}
         if self.use_quantization:
@@ -88,27 +400,161 @@ class ChatHF(BaseChatModel):
             self.model_name,
             trust_remote_code=True,
         )
+        # Batched prompts are left-padded, so that the generation starts right after each prompt
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = 'left'
 
         # Can be tuned using online replicate demo for a model
         # For example, check: https://replicate.com/meta/llama-2-70b-chat
+        self.generation_kwargs = {
+            'do_sample': True,
+            'top_p': 1,
+            'num_return_sequences': 1,
+            'eos_token_id': tokenizer.eos_token_id,
+            'pad_token_id': tokenizer.pad_token_id,
+            'max_length': self.max_length,
+            'temperature': self.temperature,
+            'repetition_penalty': 1,
+        }
         text_pipeline = pipeline(
             "text-generation",
             model=model,
             tokenizer=tokenizer,
             trust_remote_code=True,
             device_map='auto',
-            do_sample=True,
-            top_p=1,
-            num_return_sequences=1,
-            eos_token_id=tokenizer.eos_token_id,
-            pad_token_id=tokenizer.pad_token_id,
-            max_length=self.max_length,
-            temperature=self.temperature,
-            repetition_penalty=1,
+            **self.generation_kwargs
         )
 
         return text_pipeline
 
+    def _get_prefix_past_key_values(self, input_ids: list[int], prefix: str) -> (int, DynamicCache | None):
+        # The prefix is tokenized on its own, so only the tokens that are identical in the full prompt can be reused
+        prefix_ids = self.text_pipeline.tokenizer(prefix).input_ids
+        n_prefix_ids = 0
+        for prefix_id, input_id in zip(prefix_ids, input_ids[:-1]):
+            if prefix_id != input_id:
+                break
+            n_prefix_ids += 1
+
+        if n_prefix_ids == 0:
+            return 0, None
+
+        prefix_ids = input_ids[:n_prefix_ids]
+        past_key_values = self.prefix_cache.get(prefix_ids)
+        if past_key_values is None:
+            model = self.text_pipeline.model
+            past_key_values = DynamicCache()
+            with torch.no_grad():
+                model(
+                    input_ids=torch.tensor([prefix_ids], device=model.device),
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+            self.prefix_cache.put(prefix_ids, past_key_values)
+            logger.debug(f"Computed past key values for a prompt prefix of {n_prefix_ids} tokens.")
+
+        return n_prefix_ids, past_key_values
+
+    def _generate_with_prefix(self, input_text: str, prefix: str, stop_criteria: _StopCriteria) -> str | None:
+        tokenizer = self.text_pipeline.tokenizer
+        input_ids = tokenizer(input_text).input_ids
+        n_prefix_ids, past_key_values = self._get_prefix_past_key_values(input_ids, prefix)
+        if past_key_values is None:
+            return None
+
+        model = self.text_pipeline.model
+        input_tensor = torch.tensor([input_ids], device=model.device)
+        with torch.no_grad():
+            # Generation extends the cache in place, so it runs on a copy of the cached prefix
+            output_ids = model.generate(
+                input_ids=input_tensor,
+                attention_mask=torch.ones_like(input_tensor),
+                past_key_values=copy.deepcopy(past_key_values),
+                stopping_criteria=StoppingCriteriaList([stop_criteria]),
+                **self.generation_kwargs
+            )
+
+        return tokenizer.decode(output_ids[0][len(input_ids):], skip_special_tokens=True)
+
+    def _generate_batch(self, requests: list[_GenerationRequest]) -> list[tuple[str, dict]]:
+        tokenizer = self.text_pipeline.tokenizer
+        stop_criteria = _StopCriteria(
+            tokenizer, [request.stop for request in requests], self.stop_on_json, self.max_length
+        )
+
+        start_time = time.perf_counter()
+        response_texts = None
+        # Left padding shifts the prefix positions in each row, so cached prefixes are only used for single prompts
+        if len(requests) == 1 and self.prefix_cache is not None and requests[0].prefix is not None:
+            response_text = self._generate_with_prefix(requests[0].input_text, requests[0].prefix, stop_criteria)
+            if response_text is not None:
+                response_texts = [response_text]
+
+        if response_texts is None:
+            generations = self.text_pipeline(
+                [request.input_text for request in requests], batch_size=len(requests),
+                stopping_criteria=StoppingCriteriaList([stop_criteria])
+            )
+            response_texts = [
+                generation[0]['generated_text'][len(request.input_text):]
+                for request, generation in zip(requests, generations)
+            ]
+
+        end_time = time.perf_counter()
+        first_token_time = stop_criteria.first_token_time if stop_criteria.first_token_time else end_time
+
+        results = []
+        for row, (request, response_text) in enumerate(zip(requests, response_texts)):
+            stop_reason = stop_criteria.stop_reasons[row]
+            if stop_reason is not None:
+                logger.debug(f"Generation stopped ({stop_reason}) with {stop_criteria.remaining_tokens[row]} "
+                             f"tokens left.")
+
+            response_text = _truncate_response(response_text, request.stop, stop_reason)
+            # Prompts of the same batch share the prefill and decode times
+            results.append((
+                response_text,
+                {
+                    'stop_reason': stop_reason,
+                    'remaining_tokens': stop_criteria.remaining_tokens[row],
+                    'prompt_tokens': self._prompt_tokens(request),
+                    'completion_tokens': len(tokenizer(response_text, add_special_tokens=False).input_ids),
+                    'time_to_first_token': first_token_time - request.submit_time,
+                    'prefill_time': first_token_time - start_time,
+                    'decode_time': end_time - first_token_time,
+                }
+            ))
+
+        return results
+
+    def _prompt_tokens(self, request: _GenerationRequest) -> int:
+        # Fast tokenizers are not thread-safe, prompts are only tokenized by the batching thread
+        if request.prompt_tokens is None:
+            request.prompt_tokens = len(self.text_pipeline.tokenizer(request.input_text).input_ids)
+
+        return request.prompt_tokens
+
+    @staticmethod
+    def _to_llm_output(generation_info: dict) -> dict:
+        return {
+            'remaining_tokens': generation_info['remaining_tokens'],
+            'token_usage': {
+                'prompt_tokens': generation_info['prompt_tokens'],
+                'completion_tokens': generation_info['completion_tokens'],
+            }
+        }
+
+    def _combine_llm_outputs(self, llm_outputs: List[Optional[dict]]) -> dict:
+        llm_outputs = [llm_output for llm_output in llm_outputs if llm_output]
+        return {
+            'remaining_tokens': sum(llm_output['remaining_tokens'] for llm_output in llm_outputs),
+            'token_usage': {
+                key: sum(llm_output['token_usage'][key] for llm_output in llm_outputs)
+                for key in ['prompt_tokens', 'completion_tokens']
+            }
+        }
+
     def _generate(
             self,
             messages: List[BaseMessage],
@@ -117,10 +563,13 @@ class ChatHF(BaseChatModel):
     ) -> ChatResult:
         chat_history = _parse_chat_history(messages)
         input_text = self.prompt_func(chat_history)
-        generation = self.text_pipeline(input_text)
-        response_text = generation[0]['generated_text'][len(input_text):]
+        prefix = _get_prompt_prefix(messages, input_text)
+        response_text, generation_info = self.prompt_batcher.submit(_GenerationRequest(input_text, prefix, stop)).result()
         message = AIMessage(content=response_text)
-        return ChatResult(generations=[ChatGeneration(message=message)])
+        return ChatResult(
+            generations=[ChatGeneration(message=message, generation_info=generation_info)],
+            llm_output=self._to_llm_output(generation_info)
+        )
 
     async def _agenerate(
             self,
@@ -129,6 +578,14 @@ class ChatHF(BaseChatModel):
             run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
             **kwargs: Any,
     ) -> ChatResult:
-        raise NotImplementedError(
-            """HF doesn't support async requests at the moment."""
+        chat_history = _parse_chat_history(messages)
+        input_text = self.prompt_func(chat_history)
+        prefix = _get_prompt_prefix(messages, input_text)
+        response_text, generation_info = await asyncio.wrap_future(
+            self.prompt_batcher.submit(_GenerationRequest(input_text, prefix, stop))
+        )
+        message = AIMessage(content=response_text)
+        return ChatResult(
+            generations=[ChatGeneration(message=message, generation_info=generation_info)],
+            llm_output=self._to_llm_output(generation_info)
         )
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+import httpx
+import requests
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.outputs import Generation, LLMResult
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+DEFAULT_KEEP_ALIVE = "30m"
+
+
+def _get_server_num_parallel() -> int:
+    return int(os.environ.get('OLLAMA_NUM_PARALLEL', 1))
+
+
+class PooledOllama(BaseLLM):
+    """Ollama completion model that reuses HTTP connections and sends up to `num_parallel` concurrent requests.
+
+    The model is kept loaded by the server for `keep_alive` after each request, so consecutive chunks do not pay
+    the model loading time.
+    """
+    base_url: str = DEFAULT_BASE_URL
+    model: str
+    num_predict: int | None = None
+    num_gpu: int | None = None
+    temperature: float | None = None
+    keep_alive: str | int = DEFAULT_KEEP_ALIVE
+    num_parallel: int = 1
+    timeout: float | None = None
+    session: Any = None
+    request_semaphore: Any = None
+    executor: Any = None
+    async_clients: Any = None
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        if 'num_parallel' not in kwargs:
+            self.num_parallel = _get_server_num_parallel()
+        if self.num_parallel < 1:
+            raise Exception(f"Ollama num_parallel must be at least 1, got {self.num_parallel}.")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.num_parallel)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.request_semaphore = threading.BoundedSemaphore(self.num_parallel)
+        self.executor = ThreadPoolExecutor(max_workers=self.num_parallel)
+        # Connections of an async client are bound to the event loop that opened them, so each loop has its own client
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def _llm_type(self) -> str:
+        return "ollama-llm"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {
+            'model': self.model,
+            'num_predict': self.num_predict,
+            'num_gpu': self.num_gpu,
+            'temperature': self.temperature,
+        }
+
+    def _build_payload(self, prompt: str, stop: Optional[List[str]]) -> dict:
+        options = {
+            key: value for key, value in [
+                ('num_predict', self.num_predict),
+                ('num_gpu', self.num_gpu),
+                ('temperature', self.temperature),
+                ('stop', stop),
+            ] if value is not None
+        }
+
+        return {
+            'model': self.model,
+            'prompt': prompt,
+            'stream': False,
+            'keep_alive': self.keep_alive,
+            'options': options,
+        }
+
+    @staticmethod
+    def _to_generation(response: dict) -> Generation:
+        return Generation(
+            text=response.get('response', ''),
+            generation_info={
+                key: response[key] for key in [
+                    'done_reason', 'prompt_eval_count', 'eval_count', 'total_duration', 'load_duration',
+                    'prompt_eval_duration', 'eval_duration'
+                ] if key in response
+            }
+        )
+
+    def _to_llm_result(self, generations: list[Generation]) -> LLMResult:
+        token_usage = {
+            'prompt_tokens': sum(generation.generation_info.get('prompt_eval_count', 0) for generation in generations),
+            'completion_tokens': sum(generation.generation_info.get('eval_count', 0) for generation in generations),
+        }
+        return LLMResult(
+            generations=[[generation] for generation in generations],
+            llm_output={'token_usage': token_usage, 'model_name': self.model}
+        )
+
+    def _call_api(self, prompt: str, stop: Optional[List[str]]) -> Generation:
+        with self.request_semaphore:
+            response = self.session.post(
+                f"{self.base_url}/api/generate", json=self._build_payload(prompt, stop), timeout=self.timeout
+            )
+
+        if response.status_code != 200:
+            raise Exception(f"Ollama call failed with status code {response.status_code}: {response.text}")
+
+        return self._to_generation(response.json())
+
+    def _async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop, None)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.num_parallel), timeout=httpx.Timeout(self.timeout)
+            )
+            self.async_clients[loop] = client
+
+        return client
+
+    async def _acall_api(self, prompt: str, stop: Optional[List[str]]) -> Generation:
+        # The connection pool of the client limits the concurrent requests of the loop to `num_parallel`
+        response = await self._async_client().post(
+            f"{self.base_url}/api/generate", json=self._build_payload(prompt, stop)
+        )
+
+        if response.status_code != 200:
+            raise Exception(f"Ollama call failed with status code {response.status_code}: {response.text}")
+
+        return self._to_generation(response.json())
+
+    def _generate(
+            self,
+            prompts: List[str],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> LLMResult:
+        if len(prompts) == 1:
+            generations = [self._call_api(prompts[0], stop)]
+        else:
+            generations = list(self.executor.map(lambda prompt: self._call_api(prompt, stop), prompts))
+
+        return self._to_llm_result(generations)
+
+    async def _agenerate(
+            self,
+            prompts: List[str],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> LLMResult:
+        generations = await asyncio.gather(*[self._acall_api(prompt, stop) for prompt in prompts])
+
+        return self._to_llm_result(list(generations))
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    async def aclose(self) -> None:
+        """Closes the async client of the running event loop, it must be called before the loop is closed."""
+        client = self.async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
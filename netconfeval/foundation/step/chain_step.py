@@ -4,6 +4,9 @@ from typing import Callable
 
 from langchain.chains.llm import LLMChain
 
+from .prompt_plan import PromptPlan
+from ..langchain.cache.cache_stats import cache_attempt
+from ..tracing.spans import span
 from ..verifier.verifier import Verifier
 
 DEFAULT_FEEDBACK_RETRIES = 10
@@ -15,10 +18,10 @@ class ChainStep:
         'failure_number', 'format_error', 'syntax_error', 'test_error'
     ]
 
-    def __init__(self, llm_chain: LLMChain, input_formatter: Callable, output_formatter: Callable,
+    def __init__(self, llm_chain: LLMChain | PromptPlan, input_formatter: Callable, output_formatter: Callable,
                  verifier: Verifier | None = None, feedback_prompt: str | None = None,
                  feedback_retries: int | None = None) -> None:
-        self._llm_chain: LLMChain = llm_chain
+        self._llm_chain: LLMChain | PromptPlan = llm_chain
         self._verifier: Verifier | None = verifier
         self._feedback_prompt: str | None = feedback_prompt
         self._feedback_retries: int = feedback_retries if feedback_retries else DEFAULT_FEEDBACK_RETRIES
@@ -42,56 +45,77 @@ class ChainStep:
         logging.debug(f"input_data={input_data}")
 
         result = None
+        attempt = 0
         while not success and self.failure_number < self._feedback_retries:
-            response = self._llm_chain.invoke(input_data)
-            try:
-                output = self.output_parser(response)
-                logging.debug(output)
-            except json.JSONDecodeError:
-                self._llm_chain.memory.clear()
-                logging.error(f"Output JSON format error: {response}")
-                self.failure_number += 1
-                self.format_error += 1
-                continue
-            try:
-                if output["status"].lower() == "error":
-                    return False, output
-
-                result = output["result"]
-            except KeyError:
-                self._llm_chain.memory.clear()
-                logging.error(f"Missing \"result\" JSON key: {response}")
-                self.failure_number += 1
-                self.format_error += 1
-                continue
-
-            # Nothing to verify, exit the loop
-            if self._verifier is None:
-                break
-
-            success, errors = self._verifier.verify(result, data)
-            if not success:
-                self.failure_number += 1
-
-                # No feedback, just retry
-                if self.failure_number >= self._feedback_retries:
-                    raise Exception("Too many failures.")
-
-                if self._feedback_prompt is not None:
-                    feedback = self.prepare_feedback_prompts(errors)
-
-                    logging.warning(feedback)
-                    if "Code generation wrongly" in feedback:
-                        self.test_error += 1
-                    else:
-                        self.syntax_error += 1
-
-                    input_data = {"input": feedback}
+            with span('attempt'):
+                # Retries with the same input are not served the cached response of the failed attempt
+                with cache_attempt(attempt):
+                    response = self._invoke(input_data)
+                attempt += 1
+                try:
+                    with span('parse'):
+                        output = self.output_parser(response)
+                    logging.debug(output)
+                except json.JSONDecodeError:
+                    self._clear_memory()
+                    logging.error(f"Output JSON format error: {response}")
+                    self.failure_number += 1
+                    self.format_error += 1
+                    continue
+                try:
+                    if output["status"].lower() == "error":
+                        return False, output
+
+                    result = output["result"]
+                except KeyError:
+                    self._clear_memory()
+                    logging.error(f"Missing \"result\" JSON key: {response}")
+                    self.failure_number += 1
+                    self.format_error += 1
+                    continue
+
+                # Nothing to verify, exit the loop
+                if self._verifier is None:
+                    break
+
+                with span('verify'):
+                    success, errors = self._verifier.verify(result, data)
+                if not success:
+                    self.failure_number += 1
+
+                    # No feedback, just retry
+                    if self.failure_number >= self._feedback_retries:
+                        raise Exception("Too many failures.")
+
+                    if self._feedback_prompt is not None:
+                        feedback = self.prepare_feedback_prompts(errors)
+
+                        logging.warning(feedback)
+                        if "Code generation wrongly" in feedback:
+                            self.test_error += 1
+                        else:
+                            self.syntax_error += 1
+
+                        input_data = {"input": feedback}
 
         logging.warning(result)
 
         return True, self._output_formatter(result)
 
+    def _invoke(self, input_data: dict) -> dict:
+        # A prompt plan records its own rendering and model spans
+        if isinstance(self._llm_chain, PromptPlan):
+            return self._llm_chain.invoke(input_data)
+
+        with span('model'):
+            return self._llm_chain.invoke(input_data)
+
+    def _clear_memory(self) -> None:
+        if isinstance(self._llm_chain, PromptPlan):
+            self._llm_chain.clear_memory()
+        else:
+            self._llm_chain.memory.clear()
+
     def prepare_feedback_prompts(self, feedback: str) -> str:
         return self._feedback_prompt.format(feedback=feedback)
 
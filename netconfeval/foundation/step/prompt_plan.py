@@ -0,0 +1,85 @@
+import copy
+import logging
+
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.schema.memory import BaseMemory
+from langchain.schema.messages import BaseMessage, get_buffer_string
+
+from ..tracing.spans import span
+
+
+class PromptPlan:
+    """Chat prompt compiled once and sent directly to the model, in place of an `LLMChain` built for every call.
+
+    Messages without variables are rendered when the plan is built. Placeholders not filled by the inputs or by the
+    memory are rendered as an empty history. The memory is only needed by steps with a feedback loop, and is bound to
+    a copy of the plan with `with_memory`, so the compiled messages are shared by all the work items.
+    """
+
+    __slots__ = ['_llm', '_parts', '_history_variables', '_verbose', 'input_variables', 'memory']
+
+    def __init__(self, llm: any, messages: list, verbose: bool = False) -> None:
+        prompt = ChatPromptTemplate.from_messages(messages)
+
+        self._llm: any = llm
+        self._parts: list = []
+        self._history_variables: list[str] = []
+        for message in prompt.messages:
+            if isinstance(message, MessagesPlaceholder):
+                self._history_variables.append(message.variable_name)
+                self._parts.append(message)
+            elif isinstance(message, BaseMessage):
+                self._parts.append([message])
+            elif not message.input_variables:
+                self._parts.append(message.format_messages())
+            else:
+                self._parts.append(message)
+        self._verbose: bool = verbose
+
+        self.input_variables: list[str] = prompt.input_variables
+        self.memory: BaseMemory | None = None
+
+    def with_memory(self, memory: BaseMemory) -> 'PromptPlan':
+        plan = copy.copy(self)
+        plan.memory = memory
+
+        return plan
+
+    def clear_memory(self) -> None:
+        if self.memory is not None:
+            self.memory.clear()
+
+    def format_messages(self, **kwargs) -> list[BaseMessage]:
+        variables = {name: [] for name in self._history_variables}
+        variables.update(kwargs)
+
+        messages = []
+        for part in self._parts:
+            if isinstance(part, list):
+                messages.extend(part)
+            else:
+                messages.extend(part.format_messages(**variables))
+
+        return messages
+
+    def invoke(self, inputs: dict) -> dict:
+        variables = self.memory.load_memory_variables(inputs) if self.memory is not None else {}
+        variables.update(inputs)
+
+        missing = set(self.input_variables) - set(variables.keys()) - set(self._history_variables)
+        if missing:
+            raise ValueError(f"Missing some input keys: {missing}")
+
+        with span('render'):
+            messages = self.format_messages(**variables)
+        if self._verbose:
+            logging.info(f"Prompt after formatting:\n{get_buffer_string(messages)}")
+
+        with span('model'):
+            response = self._llm.invoke(messages)
+        text = response.content if isinstance(response, BaseMessage) else response
+
+        if self.memory is not None:
+            self.memory.save_context(inputs, {'text': text})
+
+        return {'text': text}
@@ -0,0 +1,116 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Generator
+
+
+def phase_columns(phases: list[str]) -> list[str]:
+    return [f"time_{phase}" for phase in phases]
+
+
+class SpanRecorder:
+    __slots__ = ['phases', 'label', 'start', 'spans']
+
+    def __init__(self, phases: list[str], label: dict | None = None) -> None:
+        # Phases reported in the result rows as `time_<phase>` columns (in seconds), nested phases are included in the
+        # enclosing ones (e.g., each `attempt` of a chain step includes its `render`, `model`, `parse` and `verify`)
+        self.phases: list[str] = phases
+        self.label: dict = label if label is not None else {}
+        self.start: float = time.perf_counter()
+        # (Phase, start, duration, thread)
+        self.spans: list[tuple[str, float, float, int]] = []
+
+    def record(self, result_row: dict) -> None:
+        """Adds the time spent in each phase to the result row, and the spans to the Chrome trace of the run."""
+        totals = {phase: 0.0 for phase in self.phases}
+        for phase, _, duration, _ in self.spans:
+            totals[phase] = totals.get(phase, 0.0) + duration
+
+        for phase, column in zip(self.phases, phase_columns(self.phases)):
+            result_row[column] = totals[phase]
+        result_row['n_attempts'] = sum(1 for phase, _, _, _ in self.spans if phase == 'attempt')
+
+        trace = _chrome_trace.get()
+        if trace is not None:
+            trace.add(self, time.perf_counter())
+
+
+class ChromeTrace:
+    """Spans of all the work items of a run, written in the Chrome trace event format (`chrome://tracing`)."""
+
+    def __init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self._origin: float = time.perf_counter()
+        self._events: list[dict] = []
+
+    def _event(self, name: str, start: float, duration: float, thread: int, args: dict | None = None) -> dict:
+        event = {
+            'name': name, 'ph': 'X', 'ts': (start - self._origin) * 1e6, 'dur': duration * 1e6, 'pid': os.getpid(),
+            'tid': thread
+        }
+        if args:
+            event['args'] = args
+
+        return event
+
+    def add(self, recorder: SpanRecorder, end: float) -> None:
+        thread = threading.get_ident()
+        label = ", ".join(f"{key}={value}" for key, value in recorder.label.items())
+        events = [self._event(f"work_item {label}", recorder.start, end - recorder.start, thread, recorder.label)]
+        events.extend(self._event(*span) for span in recorder.spans)
+
+        with self._lock:
+            self._events.extend(events)
+
+    def write(self, path: str) -> None:
+        with self._lock, open(path, 'w') as f:
+            json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f)
+
+
+_spans: contextvars.ContextVar[SpanRecorder | None] = contextvars.ContextVar("spans", default=None)
+_chrome_trace: contextvars.ContextVar[ChromeTrace | None] = contextvars.ContextVar("chrome_trace", default=None)
+
+
+def start_spans(phases: list[str], label: dict | None = None) -> SpanRecorder:
+    """Start recording the spans of the phases in the current context.
+
+    As for the cache statistics, the executor runs each work item in its own copy of the context, so the returned
+    recorder only includes the spans of that item.
+    """
+    recorder = SpanRecorder(phases, label)
+    _spans.set(recorder)
+
+    return recorder
+
+
+@contextmanager
+def span(phase: str) -> Generator[None, None, None]:
+    recorder = _spans.get()
+    if recorder is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.spans.append((phase, start, time.perf_counter() - start, threading.get_ident()))
+
+
+@contextmanager
+def chrome_trace(path: str | None) -> Generator[None, None, None]:
+    """Collects the spans of the work items started in this context, and writes them to `path` at the end."""
+    if path is None:
+        yield
+        return
+
+    trace = ChromeTrace()
+    token = _chrome_trace.set(trace)
+    try:
+        yield
+    finally:
+        _chrome_trace.reset(token)
+        trace.write(path)
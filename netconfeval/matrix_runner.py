@@ -0,0 +1,117 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from netconfeval.cli import COMMANDS
+from netconfeval.common.model_configs import model_configurations, keep_models_loaded, unload_models
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spec', type=str, required=True)
+    parser.add_argument('--models', type=str, required=False, nargs='+', default=None,
+                        choices=model_configurations.keys())
+    parser.add_argument('--n_runs', type=int, required=False, default=None)
+
+    return parser
+
+
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
+
+
+def _to_argv(arguments: dict) -> list[str]:
+    argv = []
+    for name, value in arguments.items():
+        if value is None or value is False:
+            continue
+
+        argv.append(f"--{name}")
+        if isinstance(value, list):
+            argv.extend(str(item) for item in value)
+        elif value is not True:
+            argv.append(str(value))
+
+    return argv
+
+
+def load_spec(spec_path: str, models: list[str] | None = None,
+              n_runs: int | None = None) -> dict[str, list[tuple[str, object, list[str], argparse.Namespace]]]:
+    with open(spec_path, 'r') as f:
+        spec = json.load(f)
+
+    models = models if models else spec['models']
+    common_args = spec.get('args', {})
+    if n_runs is not None:
+        common_args['n_runs'] = n_runs
+
+    # All the experiments are parsed before running any of them, so errors in the spec are reported immediately
+    runs = {}
+    for model in models:
+        runs[model] = []
+        for experiment in spec['experiments']:
+            if experiment['command'] not in COMMANDS or experiment['command'] in ['matrix', 'distributed']:
+                raise Exception(f"Command `{experiment['command']}` not supported in the experiment matrix!")
+
+            module = importlib.import_module(COMMANDS[experiment['command']])
+            parser = module.build_parser()
+            parser.prog = f"netconfeval {experiment['command']}"
+            argv = _to_argv({**common_args, **experiment.get('args', {}), 'model': model})
+            runs[model].append((experiment['command'], module, argv, parser.parse_args(argv)))
+
+    return runs
+
+
+def _run_experiment(module: object, experiment_args: argparse.Namespace) -> None:
+    # Each experiment adds its own log file handler, which must not receive the logs of the following ones
+    handlers = list(logging.root.handlers)
+    try:
+        module.main(experiment_args)
+    finally:
+        for handler in list(logging.root.handlers):
+            if handler not in handlers:
+                logging.root.removeHandler(handler)
+                handler.close()
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    runs = load_spec(args.spec, args.models, args.n_runs)
+
+    failed = []
+    keep_models_loaded()
+    try:
+        for model, model_runs in runs.items():
+            for idx, (command, module, _, experiment_args) in enumerate(model_runs):
+                logging.info(f"Running experiment {idx + 1}/{len(model_runs)} (`{command}`) on model `{model}`...")
+                try:
+                    _run_experiment(module, experiment_args)
+                except (Exception, SystemExit) as e:
+                    logging.error(f"Experiment {idx + 1} (`{command}`) on model `{model}` failed: {e}")
+                    failed.append((model, idx + 1, command))
+
+            # Release the model before loading the next one
+            unload_models()
+    finally:
+        keep_models_loaded(False)
+
+    if failed:
+        logging.error(f"{len(failed)} experiments failed: " +
+                      ", ".join(f"{command} #{idx} on {model}" for model, idx, command in failed))
+        exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
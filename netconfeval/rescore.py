@@ -0,0 +1,137 @@
+import argparse
+import csv
+import functools
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Generator
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from netconfeval.cli import COMMANDS
+from netconfeval.common.results_store import ResultsStore
+from netconfeval.common.scoring import score_output
+from netconfeval.common.spec_diff import DIFFERS
+
+# Columns of the Step 1 result rows with the stored model outputs, written since outputs are persisted
+OUTPUT_COLUMNS = ['expected_spec', 'model_output']
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--results', type=str, nargs='+', required=True)
+    parser.add_argument('--results_store', type=str, required=False, default=None)
+    parser.add_argument('--results_path', type=str, required=False, default=None)
+    parser.add_argument('--differ', choices=DIFFERS, required=False, default='spec')
+    parser.add_argument('--processes', type=int, required=False, default=os.cpu_count())
+    parser.add_argument('--chunk_size', type=int, required=False, default=64)
+
+    return parser
+
+
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
+
+
+def _init_process() -> None:
+    # The policies failed or translated wrongly are already in the log of the experiment
+    logging.getLogger().setLevel(logging.ERROR)
+
+
+def rescore_row(row: dict, differ: str) -> dict:
+    """Returns the row with the scores and the diff computed again from its stored model output.
+
+    Rows without a model output (errors, detected conflicts, or runs before the outputs were stored) are unchanged.
+    """
+    if not row.get('model_output'):
+        return row
+
+    return {**row, **score_output(json.loads(row['expected_spec']), json.loads(row['model_output']), differ)}
+
+
+def _rescore_rows(rows: list[dict], args: argparse.Namespace) -> Generator[dict, None, None]:
+    with ProcessPoolExecutor(max_workers=args.processes, initializer=_init_process) as pool:
+        # Rows are returned in the order of the result file
+        yield from pool.map(functools.partial(rescore_row, differ=args.differ), rows, chunksize=args.chunk_size)
+
+
+def rescore_file(results_file: str, args: argparse.Namespace) -> None:
+    with open(results_file, 'r') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+
+    if fieldnames is None or not all(column in fieldnames for column in OUTPUT_COLUMNS):
+        logging.warning(f"`{results_file}` does not contain the model outputs, skipping.")
+        return
+
+    results_path = args.results_path if args.results_path else os.path.join(os.path.dirname(results_file), "rescored")
+    os.makedirs(results_path, exist_ok=True)
+    rescored_file = os.path.join(results_path, os.path.basename(results_file))
+    if os.path.abspath(rescored_file) == os.path.abspath(results_file):
+        raise Exception(f"Rescored results of `{results_file}` would overwrite it!")
+
+    start_time = time.time()
+    rescored_rows = list(_rescore_rows(rows, args))
+    # Scores added after the experiment was run are appended as new columns
+    fieldnames = list(dict.fromkeys(fieldnames + [column for row in rescored_rows for column in row.keys()]))
+    with open(rescored_file, 'w') as f:
+        w = csv.DictWriter(f, fieldnames)
+        w.writeheader()
+        w.writerows(rescored_rows)
+
+    logging.info(f"Rescored {len(rows)} rows of `{results_file}` in {time.time() - start_time:.1f}s, "
+                 f"written to `{rescored_file}`.")
+
+
+def rescore_experiment(store: ResultsStore, experiment: dict, args: argparse.Namespace) -> None:
+    if not all(column in experiment['columns'] for column in OUTPUT_COLUMNS):
+        logging.warning(f"Experiment `{experiment['name']}` does not contain the model outputs, skipping.")
+        return
+
+    start_time = time.time()
+    rows = list(store.rows(experiment['name']))
+    name = f"{experiment['name']}-rescored-{time.strftime('%Y%m%d-%H%M%S')}"
+    module = importlib.import_module(COMMANDS[experiment['command']])
+    store.create_experiment(name, experiment['command'], {**experiment['args'], 'differ': args.differ})
+    store.insert(name, list(_rescore_rows(rows, args)), module.COMPRESSED_COLUMNS)
+
+    logging.info(f"Rescored {len(rows)} rows of `{experiment['name']}` in {time.time() - start_time:.1f}s, "
+                 f"stored as `{name}`.")
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    if not args.results_store:
+        for results_file in args.results:
+            rescore_file(results_file, args)
+        return
+
+    # With `--results_store`, `--results` are glob patterns of the experiment names
+    store = ResultsStore(args.results_store)
+    try:
+        experiments = {
+            experiment['name']: experiment for pattern in args.results for experiment in store.experiments(None, pattern)
+        }
+        if not experiments:
+            raise Exception(f"No experiment matches {args.results} in `{args.results_store}`!")
+
+        for experiment in experiments.values():
+            rescore_experiment(store, experiment, args)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main(parse_args())
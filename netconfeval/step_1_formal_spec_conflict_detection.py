@@ -1,52 +1,242 @@
 import argparse
+import functools
 import json
 import os
 import sys
 import time
+from contextlib import contextmanager
 from json import JSONDecodeError
-
-from deepdiff import DeepDiff
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.callbacks import get_openai_callback
+from typing import Any, Callable, Generator
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
 from netconfeval.formatters.formatters import step_1_input_formatter, step_1_conflict_formatter
-from netconfeval.foundation.step.chain_step import ChainStep
+from netconfeval.common.batch_api import BATCH_API_DISCOUNT, DEFAULT_POLL_INTERVAL, chat_request_body, \
+    get_batch_results_client
+from netconfeval.common.budget import DEFAULT_BUDGET_WARNING, budget_guard, messages_text
+from netconfeval.common.executor import run_ordered
 from netconfeval.common.model_configs import model_configurations, get_model_instance
+from netconfeval.common.policy_cache import DEFAULT_CACHE_PATH, load_policies
+from netconfeval.common.results_store import load_resumed_results, open_results
+from netconfeval.common.scoring import SCORE_COLUMNS, score_output
+from netconfeval.common.spec_diff import DIFFERS
+from netconfeval.common.trace_logging import LOG_FORMATS, Lazy, experiment_logging, trace_work_items
 from netconfeval.common.utils import *
+from netconfeval.foundation.langchain.cache.cache_stats import CACHE_MODES, start_cache_stats
+from netconfeval.foundation.tracing.spans import chrome_trace, phase_columns, span, start_spans
 
 
-def parse_args() -> argparse.Namespace:
+# Repository root: the default assets and results paths are resolved from it, not from the working directory
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Columns identifying a work item in the result file, used to skip the completed ones with `--resume`
+RESUME_KEY = ['iteration', 'batch_size', 'chunk']
+# Columns compressed in `--results_store`
+COMPRESSED_COLUMNS = ['diff', 'expected_spec', 'model_output']
+# Phases of the work items reported in the `time_<phase>` columns
+PHASES = ['attempt', 'render', 'model', 'parse', 'score']
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', choices=list(model_configurations.keys()),
                         required=True)
     parser.add_argument('--n_runs', type=int, required=False, default=5)
     parser.add_argument("--policy_file", type=str, required=False,
-                        default=os.path.join("..", "assets", "step_1_policies.csv"))
+                        default=os.path.join(ROOT_PATH, "assets", "step_1_policies.csv"))
+    parser.add_argument('--policy_cache', type=str, required=False, default=DEFAULT_CACHE_PATH)
     parser.add_argument('--batch_size', type=int, nargs="+", required=False,
                         default=[1, 2, 5, 10, 20, 25, 50, 100])
     parser.add_argument('--policy_types', choices=["reachability", "waypoint", "loadbalancing"],
                         required=False, nargs='+', default=["reachability"])
     parser.add_argument(
-        '--results_path', type=str, default=os.path.join("..", "results_conflict_detection")
+        '--results_path', type=str, default=os.path.join(ROOT_PATH, "results_conflict_detection")
     )
     parser.add_argument('--combined', action='store_true', required=False)
+    parser.add_argument('--concurrency', type=int, required=False, default=1)
+    parser.add_argument('--cache_path', type=str, required=False, default=None)
+    parser.add_argument('--cache_mode', choices=CACHE_MODES, required=False, default='read-write')
+    parser.add_argument('--cache_max_size', type=int, required=False, default=1024)
+    parser.add_argument('--batch_api', action='store_true', required=False)
+    parser.add_argument('--batch_poll_interval', type=int, required=False, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument('--resume', type=str, required=False, default=None)
+    parser.add_argument('--results_store', type=str, required=False, default=None)
+    parser.add_argument('--log_format', choices=LOG_FORMATS, required=False, default='text')
+    parser.add_argument('--chrome_trace', action='store_true', required=False)
+    parser.add_argument('--differ', choices=DIFFERS, required=False, default='spec')
+    parser.add_argument('--max_cost', type=float, required=False, default=None)
+    parser.add_argument('--max_wall_time', type=float, required=False, default=None)
+    parser.add_argument('--budget_warning', type=float, required=False, default=DEFAULT_BUDGET_WARNING)
+
+    return parser
 
-    return parser.parse_args()
 
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
 
-def main(args: argparse.Namespace) -> None:
-    logging.basicConfig(
-        format='[%(levelname)s] %(message)s',
-        level=logging.INFO,
-        handlers=[
-            logging.StreamHandler(sys.stdout)
-        ]
+
+def plan_work_items(args: argparse.Namespace, dataset: list, policy_types: SortedSet[str]) -> list[dict]:
+    n_policy_types = len(policy_types)
+    max_n_requirements = max(args.batch_size) * n_policy_types
+
+    # Sampling, conflict insertion and translation to human language consume the global random state,
+    # so work items are always planned sequentially, in the same order of the experiments.
+    policy_index = PolicyIndex(dataset)
+    work_items = []
+    for it in range(0, args.n_runs):
+        logging.info(f"Planning iteration n. {it + 1}...")
+        samples = pick_sample(max_n_requirements, policy_index, it, policy_types)
+
+        for batch_size in args.batch_size:
+            flag_conflict = True
+            chunk_samples = list(chunk_list(samples, batch_size * n_policy_types))
+            if len(chunk_samples) == 1:
+                chunk_new = copy.deepcopy(chunk_samples[0])
+                chunk_samples.append(chunk_new)
+
+            for i, sample in enumerate(chunk_samples):
+                conflict_exist = flag_conflict
+                if flag_conflict:
+                    insert_conflict(sample)
+                flag_conflict = not flag_conflict
+
+                work_items.append({
+                    'iteration': it,
+                    'batch_size': batch_size,
+                    'chunk': i,
+                    'n_policy_types': n_policy_types,
+                    'max_n_requirements': max_n_requirements,
+                    'conflict_exist': conflict_exist,
+                    'expected_spec': transform_sample_to_expected(sample),
+                    'human_language': convert_to_human_language(sample),
+                })
+
+    return work_items
+
+
+def prompt_text(work_item: dict, prompt_plan: Any) -> str:
+    return messages_text(prompt_plan.format_messages(**step_1_input_formatter(' '.join(work_item['human_language']))))
+
+
+def run_work_item(work_item: dict, prompt_plan: Any, args: argparse.Namespace) -> dict:
+    from langchain_community.callbacks import get_openai_callback
+
+    from netconfeval.foundation.langchain.callbacks.usage_callback import get_usage_callback
+    from netconfeval.foundation.step.chain_step import ChainStep
+
+    it = work_item['iteration']
+    i = work_item['chunk']
+    batch_size = work_item['batch_size']
+    n_policy_types = work_item['n_policy_types']
+    expected_spec = work_item['expected_spec']
+    human_language = work_item['human_language']
+
+    logging.info(f"Performing experiment with {batch_size * n_policy_types} "
+                 f"batch size on chunk {i} (iteration n. {it + 1})...")
+
+    result_row = {
+        'model_error': '',
+        'format_error': '',
+        'batch_size': batch_size,
+        'n_policy_types': n_policy_types,
+        'max_n_requirements': work_item['max_n_requirements'],
+        'iteration': it,
+        'chunk': i,
+        'time': 0,
+        'total': 0,
+        'success': 0,
+        'fail': 0,
+        'wrong': 0,
+        'accuracy': 0,
+        **{column: 0 for column in SCORE_COLUMNS},
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'total_cost': 0,
+        'tokens_per_second': 0,
+        'time_to_first_token': 0,
+        'prefill_time': 0,
+        'decode_time': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'diff': '',
+        'expected_spec': json.dumps(expected_spec),
+        'model_output': '',
+        'conflict_exist': work_item['conflict_exist'],
+        'conflict_detect': False,
+    }
+
+    logging.warning(f"==== RUN #{it + 1} (CHUNK #{i + 1}) - BATCH: {batch_size}*{n_policy_types} ====")
+    logging.warning("Expected Result: %s", Lazy(json.dumps, expected_spec, indent=4))
+    logging.warning("Human Translation: %s", Lazy(" ".join, human_language))
+
+    skip_compare = False
+    cache_stats = start_cache_stats()
+    spans = start_spans(PHASES, {column: work_item[column] for column in RESUME_KEY})
+    start_time = time.time()
+
+    step_1 = ChainStep(
+        llm_chain=prompt_plan,
+        input_formatter=step_1_input_formatter,
+        output_formatter=step_1_conflict_formatter,
+        # The batch only contains the first response of each prompt, a retry would be served the same response
+        feedback_retries=1 if args.batch_api else None
     )
 
+    result = {}
+    output = ''
+    try:
+        if model_configurations[args.model]['type'] == 'openai':
+            with get_openai_callback() as cb:
+                status, output = step_1.process(' '.join(human_language))
+                result_row['prompt_tokens'] = cb.prompt_tokens
+                result_row['completion_tokens'] = cb.completion_tokens
+                result_row['total_cost'] = cb.total_cost * (BATCH_API_DISCOUNT if args.batch_api else 1)
+        else:
+            with get_usage_callback() as cb:
+                status, output = step_1.process(' '.join(human_language))
+                cb.record(result_row)
+        logging.warning("Output: %s", output)
+        if not status:
+            result_row['conflict_detect'] = True
+            result_row['diff'] = output
+            skip_compare = True
+        elif "args" in output:
+            result = output["args"][0]
+            print("result: ", result)
+        else:
+            result_row['format_error'] = str(output)
+            skip_compare = True
+
+    except JSONDecodeError as e:
+        result_row['format_error'] = str(e)
+        result = output
+        skip_compare = True
+    except Exception as e:
+        result_row['model_error'] = str(e)
+        skip_compare = True
+
+    logging.warning("LLM Result: %s", result)
+    logging.warning("==================================================================")
+
+    # Time until the response is parsed, also for the responses that cannot be scored
+    result_row['time'] = time.time() - start_time
+    if not skip_compare:
+        with span('score'):
+            result_row['model_output'] = json.dumps(result, default=str)
+            result_row.update(score_output(expected_spec, result, args.differ))
+
+    result_row['cache_hits'] = cache_stats.hits
+    result_row['cache_misses'] = cache_stats.misses
+    spans.record(result_row)
+
+    return result_row
+
+
+def experiment_name(args: argparse.Namespace, results_time: str) -> str:
+    return (f"{args.model}{'-combined' if args.combined else ''}-{'_'.join(SortedSet(args.policy_types))}-conflict-"
+            f"{results_time}")
+
+
+def plan_experiment(args: argparse.Namespace) -> list[dict]:
     policy_types = SortedSet(args.policy_types)
     if "reachability" not in policy_types:
         logging.error("`reachability` is not in policy_types! Aborting...")
@@ -55,182 +245,106 @@ def main(args: argparse.Namespace) -> None:
         logging.error("You cannot require for `loadbalancing` without `waypoint`! Aborting...")
         exit(1)
 
+    dataset = load_policies(args.policy_file, policy_types, args.policy_cache)
+
+    return plan_work_items(args, dataset, policy_types)
+
+
+@contextmanager
+def experiment_worker(args: argparse.Namespace, work_items: list[dict]) -> Generator[Callable, None, None]:
+    from langchain.prompts import MessagesPlaceholder
+
+    from netconfeval.foundation.langchain.cache.response_cache import ResponseCache
+    from netconfeval.foundation.step.prompt_plan import PromptPlan
+
     if args.combined:
         from netconfeval.prompts.step_1_reachability_waypoint_load import SETUP_PROMPT, FUNCTION_PROMPT, \
             ASK_FOR_RESULT_PROMPT
     else:
         from netconfeval.prompts.step_1_conflict_detection import SETUP_PROMPT, FUNCTION_PROMPT, ASK_FOR_RESULT_PROMPT
 
-    os.makedirs(args.results_path, exist_ok=True)
+    cache = None
+    if args.cache_path:
+        cache = ResponseCache(
+            args.cache_path, model_configurations[args.model], args.cache_mode, args.cache_max_size * 1024 * 1024
+        )
 
-    results_time = time.strftime("%Y%m%d-%H%M%S")
-    file_handler = logging.FileHandler(
-        os.path.abspath(
-            os.path.join(
-                args.results_path,
-                f"log-{args.model}{'-combined' if args.combined else ''}-{'_'.join(policy_types)}-conflict-{results_time}.log"
-            )
+    llm_step_1 = get_model_instance(args.model, cache=cache)
+
+    if model_configurations[args.model]['type'] in ['HF', 'Ollama']:
+        # Combine all system prompts with a new line separator
+        combined_system_prompt = f"{SETUP_PROMPT}\n{FUNCTION_PROMPT}\n{ASK_FOR_RESULT_PROMPT}"
+        messages = [
+            ("system", combined_system_prompt),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("user", "{input}"),
+        ]
+    elif model_configurations[args.model]['type'] == 'openai':
+        messages = [
+            ("system", SETUP_PROMPT),
+            ("system", FUNCTION_PROMPT),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}"),
+            ("system", ASK_FOR_RESULT_PROMPT),
+        ]
+    else:
+        raise Exception(
+            f"Type `{model_configurations[args.model]['type']}` for Model `{args.model}` not supported!"
         )
+
+    # The messages only depend on the model type and the policy types, so they are compiled once for all the chunks
+    prompt_plan = PromptPlan(llm_step_1, messages)
+
+    if args.batch_api:
+        # All the prompts are submitted in a single batch, then the chain calls are served with its results
+        bodies = [
+            chat_request_body(llm_step_1, prompt_plan.format_messages(
+                **step_1_input_formatter(' '.join(work_item['human_language']))
+            ))
+            for work_item in work_items
+        ]
+        http_client = get_batch_results_client(model_configurations[args.model], bodies, args.batch_poll_interval)
+        llm_step_1 = get_model_instance(args.model, cache=cache, http_client=http_client)
+        prompt_plan = PromptPlan(llm_step_1, messages)
+
+    worker = trace_work_items(functools.partial(run_work_item, prompt_plan=prompt_plan, args=args), RESUME_KEY)
+    # The budget is estimated on the prompts sent to the model
+    worker.prompt_text = functools.partial(prompt_text, prompt_plan=prompt_plan)
+    yield worker
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
     )
-    file_handler.setFormatter(logging.Formatter('%(message)s'))
-    file_handler.setLevel(logging.WARNING)
-    logging.root.addHandler(file_handler)
 
-    dataset = load_csv(args.policy_file, policy_types)
+    # All the work items are planned also when resuming, so the samples of each iteration do not change
+    work_items = plan_experiment(args)
 
-    llm_step_1 = get_model_instance(args.model)
+    os.makedirs(args.results_path, exist_ok=True)
 
-    n_policy_types = len(policy_types)
-    max_n_requirements = max(args.batch_size) * n_policy_types
-    w = None
-
-    filename = f"result-{args.model}{'-combined' if args.combined else ''}-{'_'.join(policy_types)}-conflict-{results_time}.csv"
-
-    with open(os.path.join(args.results_path, filename), 'w') as f:
-        for it in range(0, args.n_runs):
-            logging.info(f"Performing iteration n. {it + 1}...")
-            samples = pick_sample(max_n_requirements, dataset, it, policy_types)
-
-            for batch_size in args.batch_size:
-                flag_conflict = True
-                logging.info(f"Performing experiment "
-                             f"with {batch_size * n_policy_types} batch size (iteration n. {it + 1})...")
-                chunk_samples = list(chunk_list(samples, batch_size * n_policy_types))
-                if len(chunk_samples) == 1:
-                    chunk_new = copy.deepcopy(chunk_samples[0])
-                    chunk_samples.append(chunk_new)
-
-                for i, sample in enumerate(chunk_samples):
-                    logging.info(f"Performing experiment with {batch_size * n_policy_types} "
-                                 f"batch size on chunk {i} (iteration n. {it + 1})...")
-
-                    result_row = {
-                        'model_error': '',
-                        'format_error': '',
-                        'batch_size': batch_size,
-                        'n_policy_types': n_policy_types,
-                        'max_n_requirements': max_n_requirements,
-                        'iteration': it,
-                        'chunk': i,
-                        'time': 0,
-                        'total': 0,
-                        'success': 0,
-                        'fail': 0,
-                        'wrong': 0,
-                        'accuracy': 0,
-                        'prompt_tokens': 0,
-                        'completion_tokens': 0,
-                        'total_cost': 0,
-                        'diff': '',
-                        'conflict_exist': flag_conflict,
-                        'conflict_detect': False,
-                    }
-
-                    if w is None:
-                        w = csv.DictWriter(f, result_row.keys())
-                        w.writeheader()
-
-                    if flag_conflict:
-                        insert_conflict(sample)
-                    flag_conflict = not flag_conflict
-
-                    expected_spec = transform_sample_to_expected(sample)
-                    human_language = convert_to_human_language(sample)
-
-                    logging.warning(f"==== RUN #{it + 1} (CHUNK #{i + 1}) - BATCH: {batch_size}*{n_policy_types} ====")
-                    logging.warning("Expected Result: " + json.dumps(expected_spec, indent=4))
-                    logging.warning("Human Translation: " + " ".join(human_language))
-
-                    skip_compare = False
-                    start_time = time.time()
-                    if model_configurations[args.model]['type'] in ['HF', 'Ollama']:
-                        # Combine all system prompts with a new line separator
-                        combined_system_prompt = f"{SETUP_PROMPT}\n{FUNCTION_PROMPT}\n{ASK_FOR_RESULT_PROMPT}"
-                        messages = [
-                            ("system", combined_system_prompt),
-                            MessagesPlaceholder(variable_name="chat_history"),
-                            ("user", "{input}"),
-                        ]
-                    elif model_configurations[args.model]['type'] == 'openai':
-                        messages = [
-                            ("system", SETUP_PROMPT),
-                            ("system", FUNCTION_PROMPT),
-                            MessagesPlaceholder(variable_name="chat_history"),
-                            ("human", "{input}"),
-                            ("system", ASK_FOR_RESULT_PROMPT),
-                        ]
-                    else:
-                        raise Exception(
-                            f"Type `{model_configurations[args.model]['type']}` for Model `{args.model}` not supported!"
-                        )
-
-                    prompt = ChatPromptTemplate.from_messages(messages)
-                    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-                    chain_step = LLMChain(
-                        llm=llm_step_1,
-                        prompt=prompt,
-                        verbose=False,
-                        memory=memory
-                    )
-                    step_1 = ChainStep(
-                        llm_chain=chain_step,
-                        input_formatter=step_1_input_formatter,
-                        output_formatter=step_1_conflict_formatter,
-                    )
-
-                    result = {}
-                    output = ''
-                    try:
-                        if model_configurations[args.model]['type'] == 'openai':
-                            with get_openai_callback() as cb:
-                                status, output = step_1.process(' '.join(human_language))
-                                result_row['prompt_tokens'] = cb.prompt_tokens
-                                result_row['completion_tokens'] = cb.completion_tokens
-                                result_row['total_cost'] = cb.total_cost
-                        else:
-                            status, output = step_1.process(' '.join(human_language))
-                        logging.warning("Output: ", output)
-                        if not status:
-                            result_row['conflict_detect'] = True
-                            result_row['diff'] = output
-                            skip_compare = True
-                        elif "args" in output:
-                            result = output["args"][0]
-                            print("result: ", result)
-                        else:
-                            result_row['format_error'] = str(output)
-                            skip_compare = True
-
-                    except JSONDecodeError as e:
-                        result_row['format_error'] = str(e)
-                        result = output
-                        skip_compare = True
-                    except Exception as e:
-                        result_row['model_error'] = str(e)
-                        skip_compare = True
-
-                    logging.warning("LLM Result: " + str(result))
-                    logging.warning("==================================================================")
-
-                    if not skip_compare:
-                        result_row['time'] = time.time() - start_time
-
-                        new_result = copy.copy(result)
-                        if "waypoint" in result:
-                            new_result["waypoint"] = {}
-                            for k, v in result["waypoint"].items():
-                                new_result["waypoint"][k.replace(" ", "")] = v
-                        if "loadbalancing" in result:
-                            new_result["loadbalancing"] = {}
-                            for k, v in result["loadbalancing"].items():
-                                new_result["loadbalancing"][k.replace(" ", "")] = v
-
-                        compare_result(expected_spec, new_result, result_row)
-                        diff = DeepDiff(expected_spec, new_result, ignore_order=True)
-                        result_row['diff'] = str(diff)
-
-                    w.writerow(result_row)
-                    f.flush()
+    results_time = time.strftime("%Y%m%d-%H%M%S")
+    with experiment_logging(args.results_path, experiment_name(args, results_time), args.log_format):
+        fieldnames = None
+        if args.resume:
+            fieldnames, resumed_rows = load_resumed_results(args, phase_columns(PHASES))
+            completed = {result_key(row, RESUME_KEY) for row in resumed_rows}
+            work_items = [work_item for work_item in work_items if result_key(work_item, RESUME_KEY) not in completed]
+            logging.info(f"Resuming `{args.resume}`, {len(completed)} work items already completed, "
+                         f"{len(work_items)} remaining.")
+
+        trace_path = os.path.join(args.results_path, f"trace-{experiment_name(args, results_time)}.json")
+        with chrome_trace(trace_path if args.chrome_trace else None), \
+                experiment_worker(args, work_items) as worker, \
+                open_results(
+                    args, 'conflict-detection', experiment_name(args, results_time), fieldnames, COMPRESSED_COLUMNS
+                ) as write_row:
+            budget = budget_guard(args, work_items, RESUME_KEY, worker.prompt_text)
+            run_ordered(work_items, worker, args.concurrency, budget.track(write_row), budget.exhausted)
 
 
 if __name__ == "__main__":
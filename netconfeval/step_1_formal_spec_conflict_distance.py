@@ -1,52 +1,380 @@
 import argparse
+import functools
 import json
 import os
+import random
 import sys
 import time
+from collections.abc import Sequence
+from contextlib import contextmanager
 from json import JSONDecodeError
-
-from deepdiff import DeepDiff
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.callbacks import get_openai_callback
+from typing import Any, Callable, Generator
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
+from netconfeval.common.adaptive_sampling import DEFAULT_CONFIDENCE, DEFAULT_TARGET_HALF_WIDTH, AdaptiveSampler
+from netconfeval.common.batch_api import BATCH_API_DISCOUNT, DEFAULT_POLL_INTERVAL, chat_request_body, \
+    get_batch_results_client
+from netconfeval.common.budget import DEFAULT_BUDGET_WARNING, BudgetGuard, budget_guard, messages_text
+from netconfeval.common.executor import run_ordered
 from netconfeval.common.model_configs import model_configurations, get_model_instance
+from netconfeval.common.policy_cache import DEFAULT_CACHE_PATH, load_policies
+from netconfeval.common.results_store import load_resumed_results, open_results
+from netconfeval.common.scoring import SCORE_COLUMNS, score_output
+from netconfeval.common.spec_diff import DIFFERS
+from netconfeval.common.trace_logging import LOG_FORMATS, Lazy, experiment_logging, trace_work_items
 from netconfeval.common.utils import *
+from netconfeval.foundation.langchain.cache.cache_stats import CACHE_MODES, start_cache_stats
+from netconfeval.foundation.tracing.spans import chrome_trace, phase_columns, span, start_spans
 from netconfeval.formatters.formatters import step_1_input_formatter, step_1_conflict_formatter
-from netconfeval.foundation.step.chain_step import ChainStep
 from netconfeval.prompts.step_1_conflict_detection import SETUP_PROMPT, FUNCTION_PROMPT, ASK_FOR_RESULT_PROMPT
 
 
-def parse_args() -> argparse.Namespace:
+# Repository root: the default assets and results paths are resolved from it, not from the working directory
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Columns identifying a work item in the result file, used to skip the completed ones with `--resume`
+RESUME_KEY = ['iteration', 'batch_size', 'chunk', 'index_start', 'index_end']
+# Columns compressed in `--results_store`
+COMPRESSED_COLUMNS = ['diff', 'expected_spec', 'model_output']
+# Phases of the work items reported in the `time_<phase>` columns
+PHASES = ['attempt', 'render', 'model', 'parse', 'score']
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', choices=list(model_configurations.keys()),
                         required=True)
     parser.add_argument('--n_runs', type=int, required=False, default=5)
     parser.add_argument("--policy_file", type=str, required=False,
-                        default=os.path.join("..", "assets", "step_1_policies.csv"))
+                        default=os.path.join(ROOT_PATH, "assets", "step_1_policies.csv"))
+    parser.add_argument('--policy_cache', type=str, required=False, default=DEFAULT_CACHE_PATH)
     parser.add_argument('--batch_size', type=int, nargs="+", required=False,
                         default=[1, 2, 5, 10, 20, 25, 50, 100])
     parser.add_argument('--policy_types', choices=["reachability", "waypoint", "loadbalancing"],
                         required=False, nargs='+', default=["reachability", "waypoint", "loadbalancing"])
     parser.add_argument(
-        '--results_path', type=str, default=os.path.join("..", "results_conflict_distance")
+        '--results_path', type=str, default=os.path.join(ROOT_PATH, "results_conflict_distance")
     )
+    parser.add_argument('--concurrency', type=int, required=False, default=1)
+    parser.add_argument('--cache_path', type=str, required=False, default=None)
+    parser.add_argument('--cache_mode', choices=CACHE_MODES, required=False, default='read-write')
+    parser.add_argument('--cache_max_size', type=int, required=False, default=1024)
+    parser.add_argument('--batch_api', action='store_true', required=False)
+    parser.add_argument('--batch_poll_interval', type=int, required=False, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument('--resume', type=str, required=False, default=None)
+    parser.add_argument('--results_store', type=str, required=False, default=None)
+    parser.add_argument('--log_format', choices=LOG_FORMATS, required=False, default='text')
+    parser.add_argument('--chrome_trace', action='store_true', required=False)
+    parser.add_argument('--differ', choices=DIFFERS, required=False, default='spec')
+    parser.add_argument('--max_cost', type=float, required=False, default=None)
+    parser.add_argument('--max_wall_time', type=float, required=False, default=None)
+    parser.add_argument('--budget_warning', type=float, required=False, default=DEFAULT_BUDGET_WARNING)
+    parser.add_argument('--sampling', choices=['full', 'adaptive'], required=False, default='full')
+    parser.add_argument('--target_half_width', type=float, required=False, default=DEFAULT_TARGET_HALF_WIDTH)
+    parser.add_argument('--confidence', type=float, required=False, default=DEFAULT_CONFIDENCE)
+    parser.add_argument('--round_size', type=int, required=False, default=32)
+    parser.add_argument('--max_calls', type=int, required=False, default=None)
+    parser.add_argument('--sampling_seed', type=int, required=False, default=0)
+
+    return parser
 
-    return parser.parse_args()
 
-
-def main(args: argparse.Namespace) -> None:
-    logging.basicConfig(
-        format='[%(levelname)s] %(message)s',
-        level=logging.INFO,
-        handlers=[
-            logging.StreamHandler(sys.stdout)
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
+
+
+class WorkItemPlan(Sequence):
+    """Work items of the sweep, created when they are accessed.
+
+    The sweep has a work item for each pair of positions of each chunk, each one with the whole chunk in human
+    language, so only the samples and the keys of the work items are kept in memory.
+    Iterating over the plan (the full sweep) draws the statements from the random state of each iteration in the
+    planning order, so the prompts are the same of the runs where all the work items were planned in advance.
+    Accessing a work item by index (adaptive sampling and distributed runs) draws its statements from a generator
+    seeded with its key, so it is the same on every access, in any order.
+    """
+
+    def __init__(self, samples: list[list[dict]], states: list[tuple], n_policy_types: int, max_n_requirements: int,
+                 keys: list[tuple[int, int, int, int, int]], selected: list[int] | None = None) -> None:
+        self._samples: list[list[dict]] = samples
+        # Global random state after sampling each iteration
+        self._states: list[tuple] = states
+        self._n_policy_types: int = n_policy_types
+        self._max_n_requirements: int = max_n_requirements
+        self._keys: list[tuple[int, int, int, int, int]] = keys
+        # Positions in `keys` of the work items of the plan, all of them if None
+        self._selected: list[int] | None = selected
+        self._indexes: dict[tuple[int, int, int, int, int], int] | None = None
+
+    def __len__(self) -> int:
+        return len(self._selected) if self._selected is not None else len(self._keys)
+
+    def __getitem__(self, index: int) -> dict:
+        key = self._key(index)
+
+        return self._work_item(key, random.Random("-".join(str(value) for value in key)))
+
+    def __iter__(self) -> Generator[dict, None, None]:
+        selected = set(self._selected) if self._selected is not None else None
+        rng = random.Random()
+        iteration = None
+        for position, key in enumerate(self._keys):
+            if key[0] != iteration:
+                iteration = key[0]
+                rng.setstate(self._states[iteration])
+
+            # Skipped work items are created anyway, so the statements of the following ones do not change
+            work_item = self._work_item(key, rng)
+            if selected is None or position in selected:
+                yield work_item
+
+    def _key(self, index: int) -> tuple[int, int, int, int, int]:
+        return self._keys[self._selected[index]] if self._selected is not None else self._keys[index]
+
+    def _work_item(self, key: tuple[int, int, int, int, int], rng: random.Random) -> dict:
+        it, batch_size, i, index_start, index_end = key
+        chunk_size = batch_size * self._n_policy_types
+        # `insert_conflict` only adds a copy of a requirement, so the sample itself is not modified
+        sample_conflict = self._samples[it][i * chunk_size:(i + 1) * chunk_size]
+        insert_conflict(sample_conflict, index_start, index_end)
+
+        return {
+            **dict(zip(RESUME_KEY, key)),
+            'n_policy_types': self._n_policy_types,
+            'max_n_requirements': self._max_n_requirements,
+            'conflict_exist': True,
+            'expected_spec': transform_sample_to_expected(sample_conflict),
+            'human_language': convert_to_human_language(sample_conflict, rng),
+        }
+
+    def key(self, index: int) -> dict:
+        """Returns the `RESUME_KEY` columns of a work item, without creating it."""
+        return dict(zip(RESUME_KEY, self._key(index)))
+
+    def index(self, row: dict) -> int:
+        """Returns the index of the work item of a result row."""
+        if self._indexes is None:
+            self._indexes = {self._key(index): index for index in range(len(self))}
+
+        return self._indexes[tuple(int(row[column]) for column in RESUME_KEY)]
+
+    def without(self, completed: set[tuple]) -> 'WorkItemPlan':
+        """Returns the plan without the work items whose `result_key` is in `completed`."""
+        positions = self._selected if self._selected is not None else range(len(self._keys))
+        selected = [
+            position for position in positions
+            if tuple(str(value) for value in self._keys[position]) not in completed
         ]
+
+        return WorkItemPlan(
+            self._samples, self._states, self._n_policy_types, self._max_n_requirements, self._keys, selected
+        )
+
+
+def plan_work_items(args: argparse.Namespace, dataset: list, policy_types: SortedSet[str]) -> WorkItemPlan:
+    n_policy_types = len(policy_types)
+    max_n_requirements = max(args.batch_size) * n_policy_types
+
+    # Sampling consumes the global random state, and the statements of the full sweep are drawn from the state left
+    # by the sampling of their iteration
+    policy_index = PolicyIndex(dataset)
+    samples = []
+    states = []
+    keys = []
+    for it in range(0, args.n_runs):
+        logging.info(f"Planning iteration n. {it + 1}...")
+        samples.append(pick_sample(max_n_requirements, policy_index, it, policy_types))
+        states.append(random.getstate())
+
+        for batch_size in args.batch_size:
+            for i, sample in enumerate(chunk_list(samples[it], batch_size * n_policy_types)):
+                for index_start in range(0, len(sample)):
+                    for index_end in range(index_start, len(sample)):
+                        keys.append((it, batch_size, i, index_start, index_end + 1))
+
+    return WorkItemPlan(samples, states, n_policy_types, max_n_requirements, keys)
+
+
+def prompt_text(work_item: dict, prompt_plan: Any) -> str:
+    return messages_text(prompt_plan.format_messages(**step_1_input_formatter(' '.join(work_item['human_language']))))
+
+
+def run_work_item(work_item: dict, prompt_plan: Any, args: argparse.Namespace) -> dict:
+    from langchain_community.callbacks import get_openai_callback
+
+    from netconfeval.foundation.langchain.callbacks.usage_callback import get_usage_callback
+    from netconfeval.foundation.step.chain_step import ChainStep
+
+    it = work_item['iteration']
+    i = work_item['chunk']
+    batch_size = work_item['batch_size']
+    n_policy_types = work_item['n_policy_types']
+    expected_spec = work_item['expected_spec']
+    human_language = work_item['human_language']
+
+    result_row = {
+        'model_error': '',
+        'format_error': '',
+        'batch_size': batch_size,
+        'n_policy_types': n_policy_types,
+        'max_n_requirements': work_item['max_n_requirements'],
+        'iteration': it,
+        'chunk': i,
+        'time': 0,
+        'total': 0,
+        'success': 0,
+        'fail': 0,
+        'wrong': 0,
+        'accuracy': 0,
+        **{column: 0 for column in SCORE_COLUMNS},
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'total_cost': 0,
+        'tokens_per_second': 0,
+        'time_to_first_token': 0,
+        'prefill_time': 0,
+        'decode_time': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'diff': '',
+        'expected_spec': json.dumps(expected_spec),
+        'model_output': '',
+        'index_start': work_item['index_start'],
+        'index_end': work_item['index_end'],
+        'conflict_exist': work_item['conflict_exist'],
+        'conflict_detect': False,
+    }
+
+    logging.info(f"Performing experiment with {batch_size * n_policy_types} "
+                 f"batch size on chunk {i} (iteration n. {it + 1})...")
+
+    logging.warning(
+        f"==== RUN #{it + 1} (CHUNK #{i + 1}) - BATCH: {batch_size}*{n_policy_types} ====")
+    logging.warning("Expected Result: %s", Lazy(json.dumps, expected_spec, indent=4))
+    logging.warning("Human Translation: %s", Lazy(" ".join, human_language))
+
+    skip_compare = False
+    cache_stats = start_cache_stats()
+    spans = start_spans(PHASES, {column: work_item[column] for column in RESUME_KEY})
+    start_time = time.time()
+
+    step_1 = ChainStep(
+        llm_chain=prompt_plan,
+        input_formatter=step_1_input_formatter,
+        output_formatter=step_1_conflict_formatter,
+        # The batch only contains the first response of each prompt, a retry would be served the same response
+        feedback_retries=1 if args.batch_api else None
+    )
+
+    result = {}
+    try:
+        if model_configurations[args.model]['type'] == 'openai':
+            with get_openai_callback() as cb:
+                status, output = step_1.process(' '.join(human_language))
+                result_row['prompt_tokens'] = cb.prompt_tokens
+                result_row['completion_tokens'] = cb.completion_tokens
+                result_row['total_cost'] = cb.total_cost * (BATCH_API_DISCOUNT if args.batch_api else 1)
+        else:
+            with get_usage_callback() as cb:
+                status, output = step_1.process(' '.join(human_language))
+                cb.record(result_row)
+        logging.warning("Output: %s", output)
+        if not status:
+            result_row['conflict_detect'] = True
+            result_row['diff'] = output
+            skip_compare = True
+        elif "args" in output:
+            result = output["args"][0]
+            print("result: ", result)
+        else:
+            result_row['format_error'] = str(output)
+            skip_compare = True
+
+    except JSONDecodeError as e:
+        result_row['format_error'] = "JSONFormatError"
+        skip_compare = True
+    except Exception as e:
+        result_row['model_error'] = str(e)
+        skip_compare = True
+
+    logging.warning("LLM Result: %s", result)
+    logging.warning("==================================================================")
+
+    # Time until the response is parsed, also for the responses that cannot be scored
+    result_row['time'] = time.time() - start_time
+    if not skip_compare:
+        with span('score'):
+            result_row['model_output'] = json.dumps(result, default=str)
+            result_row.update(score_output(expected_spec, result, args.differ))
+
+    result_row['cache_hits'] = cache_stats.hits
+    result_row['cache_misses'] = cache_stats.misses
+    spans.record(result_row)
+
+    return result_row
+
+
+def _cell(work_item: dict) -> (int, int):
+    # Cell of the heatmap produced by the extractor: index of the selected requirement and distance of the conflict
+    return work_item['index_start'], work_item['index_end'] - work_item['index_start']
+
+
+def run_adaptive(work_items: WorkItemPlan, worker: Callable, args: argparse.Namespace, write_row: Callable,
+                 resumed_rows: list[dict], estimate_file: str, budget: BudgetGuard) -> None:
+    # Cells are computed on the keys, only the work items picked in each round are created
+    cells = {}
+    for index in range(len(work_items)):
+        cells.setdefault(_cell(work_items.key(index)), []).append(index)
+    sampler = AdaptiveSampler(
+        cells, {cell: cell[1] for cell in cells}, args.target_half_width, args.confidence, seed=args.sampling_seed
     )
 
+    for row in resumed_rows:
+        index = work_items.index(row)
+        sampler.record(_cell(work_items.key(index)), index, str(row['conflict_detect']) == "True")
+
+    n_calls = 0
+    while (args.max_calls is None or n_calls < args.max_calls) and not budget.exhausted():
+        selected = sampler.next_round(args.round_size)
+        if args.max_calls is not None:
+            selected = selected[:args.max_calls - n_calls]
+        if not selected:
+            break
+
+        # The budget is projected on the current round, as the following ones depend on its results
+        round_items = [work_items[index] for _, index in selected]
+        budget.plan(round_items)
+
+        def record_row(result_row: dict) -> None:
+            index = work_items.index(result_row)
+            write_row(result_row)
+            budget.record(result_row)
+            sampler.record(_cell(work_items.key(index)), index, result_row['conflict_detect'])
+
+        run_ordered(round_items, worker, args.concurrency, record_row, budget.exhausted)
+        n_calls += len(selected)
+
+        intervals = sampler.intervals()
+        with open(estimate_file, 'w') as f:
+            w = csv.DictWriter(
+                f, ['index_start', 'distance', 'n_calls', 'n_population', 'n_detected', 'estimate', 'ci_low',
+                    'ci_high']
+            )
+            w.writeheader()
+            for interval in intervals:
+                cell = interval.pop('cell')
+                w.writerow({'index_start': cell[0], 'distance': cell[1], **interval})
+
+        max_half_width = max((interval['ci_high'] - interval['ci_low']) / 2 for interval in intervals)
+        logging.info(f"Adaptive sampling: {sum(sampler.n_calls.values())}/{len(work_items)} work items run, "
+                     f"maximum interval half-width {max_half_width:.3f}.")
+
+
+def experiment_name(args: argparse.Namespace, results_time: str) -> str:
+    return f"{args.model}-{'_'.join(SortedSet(args.policy_types))}-conflict_distance-{results_time}"
+
+
+def plan_experiment(args: argparse.Namespace) -> WorkItemPlan:
     policy_types = SortedSet(args.policy_types)
     if "reachability" not in policy_types:
         logging.error("`reachability` is not in policy_types! Aborting...")
@@ -55,174 +383,116 @@ def main(args: argparse.Namespace) -> None:
         logging.error("You cannot require for `loadbalancing` without `waypoint`! Aborting...")
         exit(1)
 
-    os.makedirs(args.results_path, exist_ok=True)
+    dataset = load_policies(args.policy_file, policy_types, args.policy_cache)
 
-    results_time = time.strftime("%Y%m%d-%H%M%S")
-    file_handler = logging.FileHandler(
-        os.path.abspath(
-            os.path.join(
-                args.results_path,
-                f"log-{args.model}-{'_'.join(policy_types)}-conflict_distance-{results_time}.log"
-            )
+    return plan_work_items(args, dataset, policy_types)
+
+
+@contextmanager
+def experiment_worker(args: argparse.Namespace, work_items: WorkItemPlan) -> Generator[Callable, None, None]:
+    from langchain.prompts import MessagesPlaceholder
+
+    from netconfeval.foundation.langchain.cache.response_cache import ResponseCache
+    from netconfeval.foundation.step.prompt_plan import PromptPlan
+    cache = None
+    if args.cache_path:
+        cache = ResponseCache(
+            args.cache_path, model_configurations[args.model], args.cache_mode, args.cache_max_size * 1024 * 1024
+        )
+
+    llm_step_1 = get_model_instance(args.model, cache=cache)
+
+    if model_configurations[args.model]['type'] in ['HF', 'Ollama']:
+        # Combine all system prompts with a new line separator
+        combined_system_prompt = f"{SETUP_PROMPT}\n{FUNCTION_PROMPT}\n{ASK_FOR_RESULT_PROMPT}"
+        messages = [
+            ("system", combined_system_prompt),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("user", "{input}"),
+        ]
+    elif model_configurations[args.model]['type'] == 'openai':
+        messages = [
+            ("system", SETUP_PROMPT),
+            ("system", FUNCTION_PROMPT),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}"),
+            ("system", ASK_FOR_RESULT_PROMPT),
+        ]
+    else:
+        raise Exception(
+            f"Type `{model_configurations[args.model]['type']}` for Model `{args.model}` not supported!"
         )
+
+    # The messages only depend on the model type and the policy types, so they are compiled once for all the chunks
+    prompt_plan = PromptPlan(llm_step_1, messages, verbose=True)
+
+    if args.batch_api:
+        # All the prompts are submitted in a single batch, then the chain calls are served with its results
+        bodies = [
+            chat_request_body(llm_step_1, prompt_plan.format_messages(
+                **step_1_input_formatter(' '.join(work_item['human_language']))
+            ))
+            for work_item in work_items
+        ]
+        http_client = get_batch_results_client(model_configurations[args.model], bodies, args.batch_poll_interval)
+        llm_step_1 = get_model_instance(args.model, cache=cache, http_client=http_client)
+        prompt_plan = PromptPlan(llm_step_1, messages, verbose=True)
+
+    worker = trace_work_items(functools.partial(run_work_item, prompt_plan=prompt_plan, args=args), RESUME_KEY)
+    # The budget is estimated on the prompts sent to the model
+    worker.prompt_text = functools.partial(prompt_text, prompt_plan=prompt_plan)
+    yield worker
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
     )
-    file_handler.setFormatter(logging.Formatter('%(message)s'))
-    file_handler.setLevel(logging.WARNING)
-    logging.root.addHandler(file_handler)
 
-    dataset = load_csv(args.policy_file, policy_types)
+    # All the work items are planned also when resuming, so the samples of each iteration do not change
+    work_items = plan_experiment(args)
 
-    llm_step_1 = get_model_instance(args.model)
+    os.makedirs(args.results_path, exist_ok=True)
 
-    n_policy_types = len(policy_types)
-    max_n_requirements = max(args.batch_size) * n_policy_types
-    w = None
-
-    filename = f"result-{args.model}-{'_'.join(policy_types)}-conflict_distance-{results_time}.csv"
-
-    with open(os.path.join(args.results_path, filename), 'w') as f:
-        for it in range(0, args.n_runs):
-            logging.info(f"Performing iteration n. {it + 1}...")
-            samples = pick_sample(max_n_requirements, dataset, it, policy_types)
-
-            for batch_size in args.batch_size:
-                flag_conflict = True
-                logging.info(f"Performing experiment "
-                             f"with {batch_size * n_policy_types} batch size (iteration n. {it + 1})...")
-                chunk_samples = list(chunk_list(samples, batch_size * n_policy_types))
-
-                for i, sample in enumerate(chunk_samples):
-                    for index_start in range(0, len(sample)):
-                        for index_end in range(index_start, len(sample)):
-                            result_row = {
-                                'model_error': '',
-                                'format_error': '',
-                                'batch_size': batch_size,
-                                'n_policy_types': n_policy_types,
-                                'max_n_requirements': max_n_requirements,
-                                'iteration': it,
-                                'chunk': i,
-                                'time': 0,
-                                'total': 0,
-                                'success': 0,
-                                'fail': 0,
-                                'wrong': 0,
-                                'accuracy': 0,
-                                'prompt_tokens': 0,
-                                'completion_tokens': 0,
-                                'total_cost': 0,
-                                'diff': '',
-                                'index_start': index_start,
-                                'index_end': index_end + 1,
-                                'conflict_exist': flag_conflict,
-                                'conflict_detect': False,
-                            }
-
-                            logging.info(f"Performing experiment with {batch_size * n_policy_types} "
-                                         f"batch size on chunk {i} (iteration n. {it + 1})...")
-
-                            if w is None:
-                                w = csv.DictWriter(f, result_row.keys())
-                                w.writeheader()
-                            sample_conflict = copy.deepcopy(sample)
-                            insert_conflict(sample_conflict, index_start, index_end + 1)
-
-                            expected_spec = transform_sample_to_expected(sample_conflict)
-                            human_language = convert_to_human_language(sample_conflict)
-
-                            logging.warning(
-                                f"==== RUN #{it + 1} (CHUNK #{i + 1}) - BATCH: {batch_size}*{n_policy_types} ====")
-                            logging.warning("Expected Result: " + json.dumps(expected_spec, indent=4))
-                            logging.warning("Human Translation: " + " ".join(human_language))
-
-                            skip_compare = False
-                            start_time = time.time()
-                            if model_configurations[args.model]['type'] in ['HF', 'Ollama']:
-                                # Combine all system prompts with a new line separator
-                                combined_system_prompt = f"{SETUP_PROMPT}\n{FUNCTION_PROMPT}\n{ASK_FOR_RESULT_PROMPT}"
-                                messages = [
-                                    ("system", combined_system_prompt),
-                                    MessagesPlaceholder(variable_name="chat_history"),
-                                    ("user", "{input}"),
-                                ]
-                            elif model_configurations[args.model]['type'] == 'openai':
-                                messages = [
-                                    ("system", SETUP_PROMPT),
-                                    ("system", FUNCTION_PROMPT),
-                                    MessagesPlaceholder(variable_name="chat_history"),
-                                    ("human", "{input}"),
-                                    ("system", ASK_FOR_RESULT_PROMPT),
-                                ]
-                            else:
-                                raise Exception(
-                                    f"Type `{model_configurations[args.model]['type']}` for Model `{args.model}` not supported!"
-                                )
-
-                            prompt_step_1 = ChatPromptTemplate.from_messages(messages)
-                            memory_step_1 = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-                            chain_step_1 = LLMChain(
-                                llm=llm_step_1,
-                                prompt=prompt_step_1,
-                                verbose=True,
-                                memory=memory_step_1
-                            )
-                            step_1 = ChainStep(
-                                llm_chain=chain_step_1,
-                                input_formatter=step_1_input_formatter,
-                                output_formatter=step_1_conflict_formatter
-                            )
-
-                            result = {}
-                            try:
-                                if model_configurations[args.model]['type'] == 'openai':
-                                    with get_openai_callback() as cb:
-                                        status, output = step_1.process(' '.join(human_language))
-                                        result_row['prompt_tokens'] = cb.prompt_tokens
-                                        result_row['completion_tokens'] = cb.completion_tokens
-                                        result_row['total_cost'] = cb.total_cost
-                                else:
-                                    status, output = step_1.process(' '.join(human_language))
-                                logging.warning("Output: ", output)
-                                if not status:
-                                    result_row['conflict_detect'] = True
-                                    result_row['diff'] = output
-                                    skip_compare = True
-                                elif "args" in output:
-                                    result = output["args"][0]
-                                    print("result: ", result)
-                                else:
-                                    result_row['format_error'] = str(output)
-                                    skip_compare = True
-
-                            except JSONDecodeError as e:
-                                result_row['format_error'] = "JSONFormatError"
-                                skip_compare = True
-                            except Exception as e:
-                                result_row['model_error'] = str(e)
-                                skip_compare = True
-
-                            logging.warning("LLM Result: " + str(result))
-                            logging.warning("==================================================================")
-
-                            if not skip_compare:
-                                result_row['time'] = time.time() - start_time
-
-                                new_result = copy.copy(result)
-                                if "waypoint" in result:
-                                    new_result["waypoint"] = {}
-                                    for k, v in result["waypoint"].items():
-                                        new_result["waypoint"][k.replace(" ", "")] = v
-                                if "loadbalancing" in result:
-                                    new_result["loadbalancing"] = {}
-                                    for k, v in result["loadbalancing"].items():
-                                        new_result["loadbalancing"][k.replace(" ", "")] = v
-
-                                compare_result(expected_spec, new_result, result_row)
-                                diff = DeepDiff(expected_spec, new_result, ignore_order=True)
-                                result_row['diff'] = str(diff)
-
-                            w.writerow(result_row)
-                            f.flush()
+    results_time = time.strftime("%Y%m%d-%H%M%S")
+    with experiment_logging(args.results_path, experiment_name(args, results_time), args.log_format):
+        if args.sampling == 'adaptive' and args.batch_api:
+            logging.error("Adaptive sampling cannot be used with `--batch_api`! Aborting...")
+            exit(1)
+
+        fieldnames = None
+        resumed_rows = []
+        if args.resume:
+            fieldnames, resumed_rows = load_resumed_results(args, phase_columns(PHASES))
+            completed = {result_key(row, RESUME_KEY) for row in resumed_rows}
+            # Adaptive sampling selects the remaining work items from the whole plan, skipping the completed ones
+            if args.sampling == 'full':
+                work_items = work_items.without(completed)
+            logging.info(f"Resuming `{args.resume}`, {len(completed)} work items already completed.")
+
+        trace_path = os.path.join(args.results_path, f"trace-{experiment_name(args, results_time)}.json")
+        with chrome_trace(trace_path if args.chrome_trace else None), \
+                experiment_worker(args, work_items) as worker, \
+                open_results(
+                    args, 'conflict-distance', experiment_name(args, results_time), fieldnames, COMPRESSED_COLUMNS
+                ) as write_row:
+            if args.sampling == 'adaptive':
+                if args.resume and not args.results_store:
+                    estimate_file = os.path.join(
+                        os.path.dirname(args.resume), os.path.basename(args.resume).replace("result-", "estimate-", 1)
+                    )
+                else:
+                    name = args.resume if args.resume else experiment_name(args, results_time)
+                    estimate_file = os.path.join(args.results_path, f"estimate-{name}.csv")
+                budget = budget_guard(args, [], RESUME_KEY, worker.prompt_text)
+                run_adaptive(work_items, worker, args, write_row, resumed_rows, estimate_file, budget)
+            else:
+                budget = budget_guard(args, work_items, RESUME_KEY, worker.prompt_text)
+                run_ordered(work_items, worker, args.concurrency, budget.track(write_row), budget.exhausted)
 
 
 if __name__ == "__main__":
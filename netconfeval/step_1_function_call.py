@@ -1,20 +1,29 @@
 import argparse
+import functools
 import json
 import os
 import re
 import sys
 import time
+from contextlib import contextmanager
 from json import JSONDecodeError
-
-from deepdiff import DeepDiff
-from langchain_community.callbacks import get_openai_callback
-from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
-from openai import OpenAI
+from typing import Any, Callable, Generator
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
+from netconfeval.common.batch_api import BATCH_API_DISCOUNT, DEFAULT_POLL_INTERVAL, chat_request_body, \
+    get_batch_results_client
+from netconfeval.common.budget import DEFAULT_BUDGET_WARNING, budget_guard, messages_text
+from netconfeval.common.executor import run_ordered
 from netconfeval.common.model_configs import model_configurations, get_model_instance
+from netconfeval.common.policy_cache import DEFAULT_CACHE_PATH, load_policies
+from netconfeval.common.results_store import load_resumed_results, open_results
+from netconfeval.common.scoring import SCORE_COLUMNS, score_output
+from netconfeval.common.spec_diff import DIFFERS
+from netconfeval.common.trace_logging import LOG_FORMATS, Lazy, experiment_logging, trace_work_items
 from netconfeval.common.utils import *
+from netconfeval.foundation.langchain.cache.cache_stats import CACHE_MODES, start_cache_stats
+from netconfeval.foundation.tracing.spans import chrome_trace, phase_columns, span, start_spans
 
 
 def add_reachability(formal_specification: dict[str, dict], source: str, prefix: str) -> None:
@@ -92,33 +101,358 @@ def parse_functions(result, funs):
             continue
 
 
-def parse_args() -> argparse.Namespace:
+# Repository root: the default assets and results paths are resolved from it, not from the working directory
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Columns identifying a work item in the result file, used to skip the completed ones with `--resume`
+RESUME_KEY = ['iteration', 'batch_size', 'chunk']
+# Columns compressed in `--results_store`
+COMPRESSED_COLUMNS = ['diff', 'expected_spec', 'model_output']
+# Phases of the work items reported in the `time_<phase>` columns
+PHASES = ['model', 'parse', 'score']
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', choices=list(model_configurations.keys()), required=True)
     parser.add_argument('--n_runs', type=int, required=False, default=5)
     parser.add_argument("--policy_file", type=str, required=False,
-                        default=os.path.join("..", "assets", "step_1_policies.csv"))
+                        default=os.path.join(ROOT_PATH, "assets", "step_1_policies.csv"))
+    parser.add_argument('--policy_cache', type=str, required=False, default=DEFAULT_CACHE_PATH)
     parser.add_argument('--batch_size', type=int, nargs="+", required=False,
                         default=[1, 2, 5, 10, 20, 25, 50, 100])
     parser.add_argument('--policy_types', choices=["reachability", "waypoint", "loadbalancing"],
                         required=False, nargs='+', default=["reachability"])
     parser.add_argument(
-        '--results_path', type=str, default=os.path.join("..", "results_function_call")
+        '--results_path', type=str, default=os.path.join(ROOT_PATH, "results_function_call")
     )
     parser.add_argument('--adhoc', action='store_true', required=False)
+    parser.add_argument('--concurrency', type=int, required=False, default=1)
+    parser.add_argument('--cache_path', type=str, required=False, default=None)
+    parser.add_argument('--cache_mode', choices=CACHE_MODES, required=False, default='read-write')
+    parser.add_argument('--cache_max_size', type=int, required=False, default=1024)
+    parser.add_argument('--batch_api', action='store_true', required=False)
+    parser.add_argument('--batch_poll_interval', type=int, required=False, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument('--resume', type=str, required=False, default=None)
+    parser.add_argument('--results_store', type=str, required=False, default=None)
+    parser.add_argument('--log_format', choices=LOG_FORMATS, required=False, default='text')
+    parser.add_argument('--chrome_trace', action='store_true', required=False)
+    parser.add_argument('--differ', choices=DIFFERS, required=False, default='spec')
+    parser.add_argument('--max_cost', type=float, required=False, default=None)
+    parser.add_argument('--max_wall_time', type=float, required=False, default=None)
+    parser.add_argument('--budget_warning', type=float, required=False, default=DEFAULT_BUDGET_WARNING)
+
+    return parser
 
-    return parser.parse_args()
 
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
+
+
+def build_tools(policy_types: SortedSet[str]) -> (list, dict):
+    tools = []
+    available_functions = {}
+    if "reachability" in policy_types:
+        tools.append({
+            "type": "function",
+            "function": {
+                "name": "add_reachability",
+                "description": "Given location l1 and prefix p1, reachability means that l1 can send packets to p1 directly or through other locations."
+                               "The function adds a reachability requirement to the formal specification.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "source": {
+                            "type": "string",
+                            "description": "The source of location reachability.",
+                        },
+                        "prefix": {
+                            "type": "string",
+                            "description": "The destination prefix.",
+                        },
+                    },
+                    "required": ["source", "prefix"],
+                },
+            },
+        })
+        available_functions["add_reachability"] = add_reachability
+
+    if "waypoint" in policy_types:
+        tools.append({
+            "type": "function",
+            "function": {
+                "name": "add_waypoint",
+                "description": "Given location l1 and destination prefix p1, waypoint means that if l1 wants to reach p1, the traffic path should include a list of locations."
+                               "The function adds a waypoint requirement to the formal specification.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "source": {
+                            "type": "string",
+                            "description": "The source location of waypoint.",
+                        },
+                        "prefix": {
+                            "type": "string",
+                            "description": "The destination prefix.",
+                        },
+                        "waypoints": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "A list of waypoint locations to include.",
+                        },
+                    },
+                    "required": ["source", "prefix", "waypoints"],
+                },
+            },
+        })
+        available_functions["add_waypoint"] = add_waypoint
+
+    if "loadbalancing" in policy_types:
+        tools.append({
+            "type": "function",
+            "function": {
+                "name": "add_load_balance",
+                "description": "Given location l1 and destination prefix p1, load balancing means if l1 wants to reach p1, the traffic path should be load-balanced across a certain number of paths."
+                               "The function adds a load-balancing requirement to the formal specification.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "source": {
+                            "type": "string",
+                            "description": "The source location of load balancing.",
+                        },
+                        "prefix": {
+                            "type": "string",
+                            "description": "The destination prefix.",
+                        },
+                        "num": {
+                            "type": "integer",
+                            "items": {"type": "integer"},
+                            "description": "The number of paths for load balance.",
+                        },
+                    },
+                    "required": ["source", "prefix", "num"],
+                },
+            }
+        })
+        available_functions["add_load_balance"] = add_load_balance
+
+    return tools, available_functions
+
+
+def plan_work_items(args: argparse.Namespace, dataset: list, policy_types: SortedSet[str]) -> list[dict]:
+    n_policy_types = len(policy_types)
+    max_n_requirements = max(args.batch_size) * n_policy_types
 
-def main(args: argparse.Namespace) -> None:
-    logging.basicConfig(
-        format='[%(levelname)s] %(message)s',
-        level=logging.INFO,
-        handlers=[
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
+    # Sampling and translation to human language consume the global random state,
+    # so work items are always planned sequentially, in the same order of the experiments.
+    policy_index = PolicyIndex(dataset)
+    work_items = []
+    for it in range(0, args.n_runs):
+        logging.info(f"Planning iteration n. {it + 1}...")
+        samples = pick_sample(max_n_requirements, policy_index, it, policy_types)
+
+        for batch_size in args.batch_size:
+            chunk_samples = list(chunk_list(samples, batch_size * n_policy_types))
+
+            for i, sample in enumerate(chunk_samples):
+                work_items.append({
+                    'iteration': it,
+                    'batch_size': batch_size,
+                    'chunk': i,
+                    'n_policy_types': n_policy_types,
+                    'max_n_requirements': max_n_requirements,
+                    'expected_spec': transform_sample_to_expected(sample),
+                    'human_language': convert_to_human_language(sample),
+                })
+
+    return work_items
+
+
+def build_native_messages(human_language: list[str]) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": "Behave as a network operator."
+                       "User will input network requirements in natural language, "
+                       "Your task is to translate the network requirements into multiple function calls."
+
+        },
+        {
+            "role": "user",
+            "content": "The requirements are as below:\n" + ' '.join(human_language)
+        }
+    ]
+
+
+def build_adhoc_messages(system_prompt: str, human_language: list[str]) -> list[tuple]:
+    return [
+        ("system", system_prompt),
+        ("user", "The requirements are as below\n" + ' '.join(human_language))
+    ]
+
+
+def prompt_text(work_item: dict, system_prompt: str | None, tools: list) -> str:
+    if system_prompt is not None:
+        return messages_text(build_adhoc_messages(system_prompt, work_item['human_language']))
+
+    # The definitions of the tools are part of the prompt with native function calling
+    return f"{messages_text(build_native_messages(work_item['human_language']))}\n{json.dumps(tools)}"
+
+
+def run_work_item(work_item: dict, llm: Any, client: Any, system_prompt: str | None, tools: list,
+                  available_functions: dict, args: argparse.Namespace) -> dict:
+    from langchain_community.callbacks import get_openai_callback
+    from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+
+    from netconfeval.foundation.langchain.callbacks.usage_callback import get_usage_callback
+
+    it = work_item['iteration']
+    i = work_item['chunk']
+    batch_size = work_item['batch_size']
+    n_policy_types = work_item['n_policy_types']
+    expected_spec = work_item['expected_spec']
+    human_language = work_item['human_language']
+
+    model_type = model_configurations[args.model]['type']
+
+    logging.info(f"Performing experiment with {batch_size * n_policy_types} "
+                 f"batch size on chunk {i} (iteration n. {it + 1})...")
+
+    result_row = {
+        'model_error': '',
+        'format_error': '',
+        'batch_size': batch_size,
+        'n_policy_types': n_policy_types,
+        'max_n_requirements': work_item['max_n_requirements'],
+        'iteration': it,
+        'chunk': i,
+        'time': 0,
+        'total': 0,
+        'success': 0,
+        'fail': 0,
+        'wrong': 0,
+        'accuracy': 0,
+        **{column: 0 for column in SCORE_COLUMNS},
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'total_cost': 0,
+        'tokens_per_second': 0,
+        'time_to_first_token': 0,
+        'prefill_time': 0,
+        'decode_time': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'diff': '',
+        'expected_spec': json.dumps(expected_spec),
+        'model_output': '',
+    }
+
+    logging.warning(f"==== RUN #{it + 1} (CHUNK #{i + 1}) - BATCH: {batch_size}*{n_policy_types} ====")
+    logging.warning("Expected Result: %s", Lazy(json.dumps, expected_spec, indent=4))
+    logging.warning("Human Translation: %s", Lazy(" ".join, human_language))
+
+    skip_compare = False
+    cache_stats = start_cache_stats()
+    spans = start_spans(PHASES, {column: work_item[column] for column in RESUME_KEY})
+    start_time = time.time()
+
+    result = {}
+
+    if not args.adhoc:
+        messages = build_native_messages(human_language)
+
+        try:
+            with span('model'):
+                response = client.chat.completions.create(
+                    model=model_configurations[args.model]['model_name'],
+                    messages=messages,
+                    tools=tools,
+                    tool_choice="auto",
+                )
+            response_message = response.choices[0].message
+            result_row['prompt_tokens'] = response.usage.prompt_tokens
+            result_row['completion_tokens'] = response.usage.completion_tokens
+
+            completion_cost = get_openai_token_cost_for_model(
+                model_configurations[args.model]['model_name'],
+                result_row['completion_tokens'], is_completion=True
+            )
+            prompt_cost = get_openai_token_cost_for_model(
+                model_configurations[args.model]['model_name'],
+                result_row['prompt_tokens']
+            )
+            result_row['total_cost'] = (prompt_cost + completion_cost) * (BATCH_API_DISCOUNT if args.batch_api else 1)
+
+            tool_calls = response_message.tool_calls
+            if tool_calls:
+                with span('parse'):
+                    for tool_call in tool_calls:
+                        function_name = tool_call.function.name
+                        function_to_call = available_functions[function_name]
+                        function_args = json.loads(tool_call.function.arguments)
+                        function_to_call(
+                            result,
+                            **function_args
+                        )
+
+            logging.warning("LLM Result: %s", result)
+        except JSONDecodeError:
+            result_row['format_error'] = str(e)
+            skip_compare = True
+            result = response_message
+        except Exception as e:
+            result_row['model_error'] = str(e)
+            skip_compare = True
+            result = response_message
+    else:
+        messages = build_adhoc_messages(system_prompt, human_language)
+
+        try:
+            if model_type == 'openai':
+                with get_openai_callback() as cb, span('model'):
+                    llm_result = llm.invoke(messages)
+                    result_row['prompt_tokens'] = cb.prompt_tokens
+                    result_row['completion_tokens'] = cb.completion_tokens
+                    result_row['total_cost'] = cb.total_cost * (BATCH_API_DISCOUNT if args.batch_api else 1)
+            else:
+                with get_usage_callback() as cb:
+                    with span('model'):
+                        llm_result = llm.invoke(messages)
+                    cb.record(result_row)
+
+            with span('parse'):
+                fns = llm_result.content
+                fns = fns.replace("```json\n", "").replace("```", "").replace("plaintext\n", "")
+                parse_functions(result, fns)
+        except Exception as e:
+            result_row['model_error'] = str(e)
+            skip_compare = True
+            result = None
 
+        logging.warning("LLM Result: %s", result)
+
+    logging.warning("==================================================================")
+
+    # Time until the response is parsed, also for the responses that cannot be scored
+    result_row['time'] = time.time() - start_time
+    if not skip_compare:
+        with span('score'):
+            result_row['model_output'] = json.dumps(result, default=str)
+            result_row.update(score_output(expected_spec, result, args.differ))
+
+    result_row['cache_hits'] = cache_stats.hits
+    result_row['cache_misses'] = cache_stats.misses
+    spans.record(result_row)
+
+    return result_row
+
+
+def experiment_name(args: argparse.Namespace, results_time: str) -> str:
+    return (f"{args.model}-{'adhoc' if args.adhoc else 'native'}-{'_'.join(SortedSet(args.policy_types))}-function-"
+            f"{results_time}")
+
+
+def plan_experiment(args: argparse.Namespace) -> list[dict]:
     policy_types = SortedSet(args.policy_types)
     if "reachability" not in policy_types:
         logging.error("`reachability` is not in policy_types! Aborting...")
@@ -127,290 +461,123 @@ def main(args: argparse.Namespace) -> None:
         logging.error("You cannot require for `loadbalancing` without `waypoint`! Aborting...")
         exit(1)
 
-    if args.adhoc:
-        from netconfeval.prompts.step_1_adhoc_function import SETUP_PROMPT, REACHABILITY_FUNCTION, \
-            WAYPOINT_FUNCTION, LOADBALANCING_FUNCTION, ASK_FOR_RESULT_PROMPT
+    dataset = load_policies(args.policy_file, policy_types, args.policy_cache)
 
-    os.makedirs(args.results_path, exist_ok=True)
+    return plan_work_items(args, dataset, policy_types)
 
-    results_time = time.strftime("%Y%m%d-%H%M%S")
-    file_handler = logging.FileHandler(
-        os.path.abspath(
-            os.path.join(
-                args.results_path,
-                f"log-{args.model}-{'adhoc' if args.adhoc else 'native'}-{'_'.join(policy_types)}-function-{results_time}.log"
-            )
-        )
-    )
-    file_handler.setFormatter(logging.Formatter('%(message)s'))
-    file_handler.setLevel(logging.WARNING)
-    logging.root.addHandler(file_handler)
 
-    dataset = load_csv(args.policy_file, policy_types)
+@contextmanager
+def experiment_worker(args: argparse.Namespace, work_items: list[dict]) -> Generator[Callable, None, None]:
+    from langchain_core.messages import convert_to_messages
+    from openai import OpenAI
+
+    from netconfeval.common.rate_limiter import get_rate_limited_clients
+    from netconfeval.foundation.langchain.cache.response_cache import ResponseCache
+
+    policy_types = SortedSet(args.policy_types)
+    if args.adhoc:
+        from netconfeval.prompts.step_1_adhoc_function import SETUP_PROMPT, REACHABILITY_FUNCTION, \
+            WAYPOINT_FUNCTION, LOADBALANCING_FUNCTION, ASK_FOR_RESULT_PROMPT
 
     model_type = model_configurations[args.model]['type']
+    llm_step_1 = None
+    client = None
+    system_prompt = None
     if args.adhoc:
-        llm_step_1 = get_model_instance(args.model)
+        cache = None
+        if args.cache_path:
+            cache = ResponseCache(
+                args.cache_path, model_configurations[args.model], args.cache_mode,
+                args.cache_max_size * 1024 * 1024
+            )
+
+        llm_step_1 = get_model_instance(args.model, cache=cache)
         llm_step_1.model_kwargs = {}
+
+        combined_system_prompt = [SETUP_PROMPT]
+        if "reachability" in policy_types:
+            combined_system_prompt.append(REACHABILITY_FUNCTION)
+        if "waypoint" in policy_types:
+            combined_system_prompt.append(WAYPOINT_FUNCTION)
+        if "loadbalancing" in policy_types:
+            combined_system_prompt.append(LOADBALANCING_FUNCTION)
+        combined_system_prompt.append(ASK_FOR_RESULT_PROMPT)
+        system_prompt = "\n".join(combined_system_prompt)
     elif model_type == 'HF':
         raise Exception(f"Native function calling not supported on type `{model_type}`!")
+    else:
+        http_client, _ = get_rate_limited_clients(model_configurations[args.model])
+        client = OpenAI(http_client=http_client, max_retries=0)
+
+    tools, available_functions = build_tools(policy_types)
+
+    if args.batch_api:
+        # All the prompts are submitted in a single batch, then the model calls are served with its results
+        if args.adhoc:
+            bodies = [
+                chat_request_body(
+                    llm_step_1, convert_to_messages(build_adhoc_messages(system_prompt, work_item['human_language']))
+                )
+                for work_item in work_items
+            ]
+            http_client = get_batch_results_client(model_configurations[args.model], bodies, args.batch_poll_interval)
+            llm_step_1 = get_model_instance(args.model, cache=cache, http_client=http_client)
+            llm_step_1.model_kwargs = {}
+        else:
+            bodies = [
+                {
+                    'model': model_configurations[args.model]['model_name'],
+                    'messages': build_native_messages(work_item['human_language']),
+                    'tools': tools,
+                    'tool_choice': "auto",
+                }
+                for work_item in work_items
+            ]
+            http_client = get_batch_results_client(model_configurations[args.model], bodies, args.batch_poll_interval)
+            client = OpenAI(http_client=http_client)
+
+    worker = functools.partial(
+        run_work_item, llm=llm_step_1, client=client, system_prompt=system_prompt, tools=tools,
+        available_functions=available_functions, args=args
+    )
+    worker = trace_work_items(worker, RESUME_KEY)
+    # The budget is estimated on the prompts sent to the model
+    worker.prompt_text = functools.partial(prompt_text, system_prompt=system_prompt, tools=tools)
+    yield worker
 
-    n_policy_types = len(policy_types)
-    max_n_requirements = max(args.batch_size) * n_policy_types
-    w = None
-
-    filename = f"result-{args.model}-{'adhoc' if args.adhoc else 'native'}-{'_'.join(policy_types)}-function-{results_time}.csv"
-
-    with open(os.path.join(args.results_path, filename), 'w') as f:
-        for it in range(0, args.n_runs):
-            logging.info(f"Performing iteration n. {it + 1}...")
-            samples = pick_sample(max_n_requirements, dataset, it, policy_types)
-
-            for batch_size in args.batch_size:
-                logging.info(f"Performing experiment "
-                             f"with {batch_size * n_policy_types} batch size (iteration n. {it + 1})...")
-                chunk_samples = list(chunk_list(samples, batch_size * n_policy_types))
-
-                for i, sample in enumerate(chunk_samples):
-                    logging.info(f"Performing experiment with {batch_size * n_policy_types} "
-                                 f"batch size on chunk {i} (iteration n. {it + 1})...")
-
-                    result_row = {
-                        'model_error': '',
-                        'format_error': '',
-                        'batch_size': batch_size,
-                        'n_policy_types': n_policy_types,
-                        'max_n_requirements': max_n_requirements,
-                        'iteration': it,
-                        'chunk': i,
-                        'time': 0,
-                        'total': 0,
-                        'success': 0,
-                        'fail': 0,
-                        'wrong': 0,
-                        'accuracy': 0,
-                        'prompt_tokens': 0,
-                        'completion_tokens': 0,
-                        'total_cost': 0,
-                        'diff': '',
-                    }
-
-                    if w is None:
-                        w = csv.DictWriter(f, result_row.keys())
-                        w.writeheader()
-
-                    expected_spec = transform_sample_to_expected(sample)
-                    human_language = convert_to_human_language(sample)
-
-                    logging.warning(f"==== RUN #{it + 1} (CHUNK #{i + 1}) - BATCH: {batch_size}*{n_policy_types} ====")
-                    logging.warning("Expected Result: " + json.dumps(expected_spec, indent=4))
-                    logging.warning("Human Translation: " + " ".join(human_language))
-
-                    skip_compare = False
-                    start_time = time.time()
-
-                    result = {}
-
-                    if not args.adhoc:
-                        messages = [
-                            {
-                                "role": "system",
-                                "content": "Behave as a network operator."
-                                           "User will input network requirements in natural language, "
-                                           "Your task is to translate the network requirements into multiple function calls."
-
-                            },
-                            {
-                                "role": "user",
-                                "content": "The requirements are as below:\n" + ' '.join(human_language)
-                            }
-                        ]
-
-                        tools = []
-                        available_functions = {}
-                        if "reachability" in policy_types:
-                            tools.append({
-                                "type": "function",
-                                "function": {
-                                    "name": "add_reachability",
-                                    "description": "Given location l1 and prefix p1, reachability means that l1 can send packets to p1 directly or through other locations."
-                                                   "The function adds a reachability requirement to the formal specification.",
-                                    "parameters": {
-                                        "type": "object",
-                                        "properties": {
-                                            "source": {
-                                                "type": "string",
-                                                "description": "The source of location reachability.",
-                                            },
-                                            "prefix": {
-                                                "type": "string",
-                                                "description": "The destination prefix.",
-                                            },
-                                        },
-                                        "required": ["source", "prefix"],
-                                    },
-                                },
-                            })
-                            available_functions["add_reachability"] = add_reachability
-
-                        if "waypoint" in policy_types:
-                            tools.append({
-                                "type": "function",
-                                "function": {
-                                    "name": "add_waypoint",
-                                    "description": "Given location l1 and destination prefix p1, waypoint means that if l1 wants to reach p1, the traffic path should include a list of locations."
-                                                   "The function adds a waypoint requirement to the formal specification.",
-                                    "parameters": {
-                                        "type": "object",
-                                        "properties": {
-                                            "source": {
-                                                "type": "string",
-                                                "description": "The source location of waypoint.",
-                                            },
-                                            "prefix": {
-                                                "type": "string",
-                                                "description": "The destination prefix.",
-                                            },
-                                            "waypoints": {
-                                                "type": "array",
-                                                "items": {"type": "string"},
-                                                "description": "A list of waypoint locations to include.",
-                                            },
-                                        },
-                                        "required": ["source", "prefix", "waypoints"],
-                                    },
-                                },
-                            })
-                            available_functions["add_waypoint"] = add_waypoint
-
-                        if "loadbalancing" in policy_types:
-                            tools.append({
-                                "type": "function",
-                                "function": {
-                                    "name": "add_load_balance",
-                                    "description": "Given location l1 and destination prefix p1, load balancing means if l1 wants to reach p1, the traffic path should be load-balanced across a certain number of paths."
-                                                   "The function adds a load-balancing requirement to the formal specification.",
-                                    "parameters": {
-                                        "type": "object",
-                                        "properties": {
-                                            "source": {
-                                                "type": "string",
-                                                "description": "The source location of load balancing.",
-                                            },
-                                            "prefix": {
-                                                "type": "string",
-                                                "description": "The destination prefix.",
-                                            },
-                                            "num": {
-                                                "type": "integer",
-                                                "items": {"type": "integer"},
-                                                "description": "The number of paths for load balance.",
-                                            },
-                                        },
-                                        "required": ["source", "prefix", "num"],
-                                    },
-                                }
-                            })
-                            available_functions["add_load_balance"] = add_load_balance
-
-                        try:
-                            client = OpenAI()
-                            response = client.chat.completions.create(
-                                model=model_configurations[args.model]['model_name'],
-                                messages=messages,
-                                tools=tools,
-                                tool_choice="auto",
-                            )
-                            response_message = response.choices[0].message
-                            result_row['prompt_tokens'] = response.usage.prompt_tokens
-                            result_row['completion_tokens'] = response.usage.completion_tokens
-
-                            completion_cost = get_openai_token_cost_for_model(
-                                model_configurations[args.model]['model_name'],
-                                result_row['completion_tokens'], is_completion=True
-                            )
-                            prompt_cost = get_openai_token_cost_for_model(
-                                model_configurations[args.model]['model_name'],
-                                result_row['prompt_tokens']
-                            )
-                            result_row['total_cost'] = prompt_cost + completion_cost
-
-                            tool_calls = response_message.tool_calls
-                            if tool_calls:
-                                for tool_call in tool_calls:
-                                    function_name = tool_call.function.name
-                                    function_to_call = available_functions[function_name]
-                                    function_args = json.loads(tool_call.function.arguments)
-                                    function_to_call(
-                                        result,
-                                        **function_args
-                                    )
-
-                            logging.warning("LLM Result: " + str(result))
-                        except JSONDecodeError:
-                            result_row['format_error'] = str(e)
-                            skip_compare = True
-                            result = response_message
-                        except Exception as e:
-                            result_row['model_error'] = str(e)
-                            skip_compare = True
-                            result = response_message
-                    else:
-                        combined_system_prompt = [SETUP_PROMPT]
-                        if "reachability" in policy_types:
-                            combined_system_prompt.append(REACHABILITY_FUNCTION)
-                        if "waypoint" in policy_types:
-                            combined_system_prompt.append(WAYPOINT_FUNCTION)
-                        if "loadbalancing" in policy_types:
-                            combined_system_prompt.append(LOADBALANCING_FUNCTION)
-                        combined_system_prompt.append(ASK_FOR_RESULT_PROMPT)
-
-                        messages = [
-                            ("system", "\n".join(combined_system_prompt)),
-                            ("user", "The requirements are as below\n" + ' '.join(human_language))
-                        ]
-
-                        try:
-                            if model_type == 'openai':
-                                with get_openai_callback() as cb:
-                                    llm_result = llm_step_1.invoke(messages)
-                                    result_row['prompt_tokens'] = cb.prompt_tokens
-                                    result_row['completion_tokens'] = cb.completion_tokens
-                                    result_row['total_cost'] = cb.total_cost
-                            else:
-                                llm_result = llm_step_1.invoke(messages)
-
-                            fns = llm_result.content
-                            fns = fns.replace("```json\n", "").replace("```", "").replace("plaintext\n", "")
-                            parse_functions(result, fns)
-                        except Exception as e:
-                            result_row['model_error'] = str(e)
-                            skip_compare = True
-                            result = None
-
-                        logging.warning("LLM Result: " + str(result))
-
-                    logging.warning("==================================================================")
-
-                    if not skip_compare:
-                        result_row['time'] = time.time() - start_time
-
-                        new_result = copy.copy(result)
-                        if "waypoint" in result:
-                            new_result["waypoint"] = {}
-                            for k, v in result["waypoint"].items():
-                                new_result["waypoint"][k.replace(" ", "")] = v
-                        if "loadbalancing" in result:
-                            new_result["loadbalancing"] = {}
-                            for k, v in result["loadbalancing"].items():
-                                new_result["loadbalancing"][k.replace(" ", "")] = v
-
-                        compare_result(expected_spec, new_result, result_row)
-                        diff = DeepDiff(expected_spec, new_result, ignore_order=True)
-                        result_row['diff'] = str(diff)
-
-                    w.writerow(result_row)
-                    f.flush()
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    # All the work items are planned also when resuming, so the samples of each iteration do not change
+    work_items = plan_experiment(args)
+
+    os.makedirs(args.results_path, exist_ok=True)
+
+    results_time = time.strftime("%Y%m%d-%H%M%S")
+    with experiment_logging(args.results_path, experiment_name(args, results_time), args.log_format):
+        fieldnames = None
+        if args.resume:
+            fieldnames, resumed_rows = load_resumed_results(args, phase_columns(PHASES))
+            completed = {result_key(row, RESUME_KEY) for row in resumed_rows}
+            work_items = [work_item for work_item in work_items if result_key(work_item, RESUME_KEY) not in completed]
+            logging.info(f"Resuming `{args.resume}`, {len(completed)} work items already completed, "
+                         f"{len(work_items)} remaining.")
+
+        trace_path = os.path.join(args.results_path, f"trace-{experiment_name(args, results_time)}.json")
+        with chrome_trace(trace_path if args.chrome_trace else None), \
+                experiment_worker(args, work_items) as worker, \
+                open_results(
+                    args, 'function-call', experiment_name(args, results_time), fieldnames, COMPRESSED_COLUMNS
+                ) as write_row:
+            budget = budget_guard(args, work_items, RESUME_KEY, worker.prompt_text)
+            run_ordered(work_items, worker, args.concurrency, budget.track(write_row), budget.exhausted)
 
 
 if __name__ == "__main__":
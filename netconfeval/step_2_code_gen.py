@@ -1,23 +1,35 @@
 import argparse
+import functools
 import os
 import sys
 import time
-
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.callbacks import get_openai_callback
+from contextlib import contextmanager
+from typing import Any, Callable, Generator
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
+from netconfeval.common.budget import DEFAULT_BUDGET_WARNING, budget_guard, messages_text
 from netconfeval.common.model_configs import model_configurations, get_model_instance
+from netconfeval.common.results_store import load_resumed_results, open_results
+from netconfeval.common.trace_logging import LOG_FORMATS, experiment_logging, trace_work_items
 from netconfeval.common.utils import *
 from netconfeval.formatters.formatters import step_2_input_formatter, step_2_output_formatter
-from netconfeval.foundation.langchain.memory.conversation_latest_memory import ConversationLatestMemory
-from netconfeval.foundation.step.chain_step import ChainStep
+from netconfeval.foundation.langchain.cache.cache_stats import CACHE_MODES, start_cache_stats
+from netconfeval.foundation.tracing.spans import chrome_trace, phase_columns, start_spans
 from netconfeval.verifiers.step_2_verifier_detailed import Step2VerifierDetailed
 
 
-def parse_args() -> argparse.Namespace:
+# Repository root: the default assets and results paths are resolved from it, not from the working directory
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Columns identifying an experiment in the result file, used to skip the completed ones with `--resume`
+RESUME_KEY = ['iteration', 'policy']
+# Columns compressed in `--results_store`
+COMPRESSED_COLUMNS = []
+# Phases of the work items reported in the `time_<phase>` columns
+PHASES = ['attempt', 'render', 'model', 'parse', 'verify']
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', choices=list(model_configurations.keys()), required=True)
     parser.add_argument('--n_runs', type=int, required=False, default=5)
@@ -31,23 +43,183 @@ def parse_args() -> argparse.Namespace:
         required=False, default="basic"
     )
     parser.add_argument(
-        '--results_path', type=str, default=os.path.join("..", "results_code_gen")
+        '--results_path', type=str, default=os.path.join(ROOT_PATH, "results_code_gen")
     )
     parser.add_argument('--feedback', action="store_true")
     parser.add_argument('--n_retries', type=int, default=10)
+    parser.add_argument('--cache_path', type=str, required=False, default=None)
+    parser.add_argument('--cache_mode', choices=CACHE_MODES, required=False, default='read-write')
+    parser.add_argument('--cache_max_size', type=int, required=False, default=1024)
+    parser.add_argument('--resume', type=str, required=False, default=None)
+    parser.add_argument('--results_store', type=str, required=False, default=None)
+    parser.add_argument('--log_format', choices=LOG_FORMATS, required=False, default='text')
+    parser.add_argument('--chrome_trace', action='store_true', required=False)
+    parser.add_argument('--max_cost', type=float, required=False, default=None)
+    parser.add_argument('--max_wall_time', type=float, required=False, default=None)
+    parser.add_argument('--budget_warning', type=float, required=False, default=DEFAULT_BUDGET_WARNING)
 
-    return parser.parse_args()
+    return parser
 
 
-def main(args: argparse.Namespace) -> None:
-    logging.basicConfig(
-        format='[%(levelname)s] %(message)s',
-        level=logging.INFO,
-        handlers=[
-            logging.StreamHandler(sys.stdout)
-        ]
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
+
+
+def experiment_name(args: argparse.Namespace, results_time: str) -> str:
+    return (f"{args.model}-{'_'.join(args.policy_types)}-{args.prompts}-"
+            f"{'with_feedback' if args.feedback else 'without_feedback'}-{results_time}")
+
+
+def plan_experiment(args: argparse.Namespace) -> list[dict]:
+    return [{'iteration': it, 'policy': policy} for it in range(0, args.n_runs) for policy in args.policy_types]
+
+
+def build_prompt(policy: str, requirement_prompts: dict) -> (str, str):
+    """Returns the prompt with the code to extend for a policy, and the directory of its test cases."""
+    code_base_assets_path = os.path.join(ROOT_PATH, 'assets', 'step_2_code_base')
+
+    test_cases_path = "path_tests"
+
+    code_path = os.path.join(code_base_assets_path, "computing_path_empty.py")
+    add_requirement_prompts = ""
+
+    if policy == "reachability":
+        code_path = os.path.join(code_base_assets_path, "computing_path_shortest_path.py")
+        add_requirement_prompts = requirement_prompts[policy]
+        test_cases_path = "reachability_tests"
+    elif policy == "waypoint":
+        code_path = os.path.join(code_base_assets_path, "computing_path_reachability.py")
+        add_requirement_prompts = requirement_prompts[policy]
+        test_cases_path = "waypoint_tests"
+    elif policy == "loadbalancing":
+        code_path = os.path.join(code_base_assets_path, "computing_path_shortest_path.py")
+        add_requirement_prompts = requirement_prompts[policy]
+        test_cases_path = "loadbalancing_tests"
+
+    with open(code_path, "r") as f_code:
+        code = f_code.read()
+
+    return code + "\n" + add_requirement_prompts, test_cases_path
+
+
+def prompt_text(work_item: dict, prompt_plan: Any, requirement_prompts: dict) -> str:
+    # Text of the first request, the feedback loop may send more
+    prompt, _ = build_prompt(work_item['policy'], requirement_prompts)
+
+    return messages_text(prompt_plan.format_messages(**step_2_input_formatter({"extend": True, "input": prompt})))
+
+
+def run_work_item(work_item: dict, prompt_plan: Any, requirement_prompts: dict, feedback_prompt: str,
+                  args: argparse.Namespace) -> dict:
+    from langchain_community.callbacks import get_openai_callback
+
+    from netconfeval.foundation.langchain.callbacks.usage_callback import get_usage_callback
+    from netconfeval.foundation.langchain.memory.conversation_latest_memory import ConversationLatestMemory
+    from netconfeval.foundation.step.chain_step import ChainStep
+
+    it = work_item['iteration']
+    policy = work_item['policy']
+
+    tests_assets_path = os.path.join(ROOT_PATH, 'assets', 'step_2_tests')
+    prompt, test_cases_path = build_prompt(policy, requirement_prompts)
+
+    logging.warning(f"(Iteration n. {it}) performing code generation with {policy}...")
+
+    result_row = {
+        'iteration': it,
+        'policy': policy,
+        'time': 0,
+        'feedback_num': 0,
+        'format_error_num': 0,
+        'syntax_error_num': 0,
+        'test_error_num': 0,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'total_cost': 0,
+        'tokens_per_second': 0,
+        'time_to_first_token': 0,
+        'prefill_time': 0,
+        'decode_time': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+    }
+
+    # Only the feedback loop needs the previous messages
+    chain_step_2 = prompt_plan
+    if args.feedback:
+        chain_step_2 = prompt_plan.with_memory(
+            ConversationLatestMemory(memory_key="chat_history", return_messages=True)
+        )
+
+    step_2_verifier = Step2VerifierDetailed(
+        default_test_path=os.path.join(tests_assets_path, "path_tests")
     )
 
+    step_2 = ChainStep(
+        llm_chain=chain_step_2,
+        verifier=step_2_verifier,
+        feedback_prompt=feedback_prompt if args.feedback else None,
+        feedback_retries=args.n_retries,
+        input_formatter=step_2_input_formatter,
+        output_formatter=step_2_output_formatter
+    )
+
+    cache_stats = start_cache_stats()
+    spans = start_spans(PHASES, {column: work_item[column] for column in RESUME_KEY})
+    start = time.time()
+
+    if model_configurations[args.model]['type'] == 'openai':
+        with get_openai_callback() as cb:
+            try:
+                step_2.process(
+                    {
+                        "extend": True,
+                        "input": prompt,
+                        "metadata": {"test_path": os.path.join(tests_assets_path, test_cases_path)}
+                    }
+                )
+            except Exception as e:
+                logging.warning(e)
+
+            result_row['prompt_tokens'] = cb.prompt_tokens
+            result_row['completion_tokens'] = cb.completion_tokens
+            result_row['total_cost'] = cb.total_cost
+    else:
+        with get_usage_callback() as cb:
+            try:
+                step_2.process(
+                    {
+                        "extend": True,
+                        "input": prompt,
+                        "metadata": {"test_path": os.path.join(tests_assets_path, test_cases_path)}
+                    }
+                )
+            except Exception as e:
+                logging.warning(e)
+
+            cb.record(result_row)
+
+    result_row['test_error_num'] = step_2.test_error
+    result_row['syntax_error_num'] = step_2.syntax_error
+    result_row['format_error_num'] = step_2.format_error
+    result_row['feedback_num'] = step_2.failure_number
+    result_row['cache_hits'] = cache_stats.hits
+    result_row['cache_misses'] = cache_stats.misses
+
+    end = time.time()
+    result_row['time'] = end - start
+    spans.record(result_row)
+
+    return result_row
+
+
+@contextmanager
+def experiment_worker(args: argparse.Namespace, work_items: list[dict]) -> Generator[Callable, None, None]:
+    from langchain.prompts import MessagesPlaceholder
+
+    from netconfeval.foundation.langchain.cache.response_cache import ResponseCache
+    from netconfeval.foundation.step.prompt_plan import PromptPlan
+
     if args.prompts == "basic":
         from netconfeval.prompts.step_2_basic import SETUP_PROMPT, INPUT_OUTPUT_PROMPT, INSTRUCTION_PROMPT, \
             FEEDBACK_CODE_GENERATION, ADD_REQUIREMENT_REACHABILITY_PROMPT, ADD_REQUIREMENT_WAYPOINT_PROMPT, \
@@ -59,172 +231,103 @@ def main(args: argparse.Namespace) -> None:
 
     with_feedback = args.feedback if args.feedback else False
 
-    os.makedirs(args.results_path, exist_ok=True)
+    cache = None
+    if args.cache_path:
+        cache = ResponseCache(
+            args.cache_path, model_configurations[args.model], args.cache_mode, args.cache_max_size * 1024 * 1024
+        )
 
-    results_time = time.strftime("%Y%m%d-%H%M%S")
-    file_handler = logging.FileHandler(
-        os.path.abspath(
-            os.path.join(
-                args.results_path,
-                f"log-{args.model}-{'_'.join(args.policy_types)}-{args.prompts}-{'without_feedback' if not with_feedback else 'with_feedback'}-{results_time}.log"
-            )
+    llm_step_2 = get_model_instance(args.model, cache=cache)
+
+    if model_configurations[args.model]['type'] in ['HF', 'Ollama']:
+        combined_system_prompt = f"{SETUP_PROMPT}\n{ASK_FOR_CODE_PROMPT}"
+        combined_human_prompt = f"{INPUT_OUTPUT_PROMPT}\n{INSTRUCTION_PROMPT}\n{{input}}"
+        if with_feedback:
+            messages = [
+                ("system", combined_system_prompt),
+                ("user", combined_human_prompt),
+                MessagesPlaceholder(variable_name="chat_history"),
+            ]
+        else:
+            messages = [
+                ("system", combined_system_prompt),
+                ("user", combined_human_prompt),
+            ]
+    elif model_configurations[args.model]['type'] == 'openai':
+        if with_feedback:
+            messages = [
+                ("system", SETUP_PROMPT),
+                ("human", INPUT_OUTPUT_PROMPT),
+                ("human", INSTRUCTION_PROMPT),
+                MessagesPlaceholder(variable_name="chat_history"),
+                ("human", "{input}"),
+                ("system", ASK_FOR_CODE_PROMPT)
+            ]
+        else:
+            messages = [
+                ("system", SETUP_PROMPT),
+                ("human", INPUT_OUTPUT_PROMPT),
+                ("human", INSTRUCTION_PROMPT),
+                ("human", "{input}"),
+                ("system", ASK_FOR_CODE_PROMPT)
+            ]
+    else:
+        raise Exception(
+            f"Type `{model_configurations[args.model]['type']}` for Model `{args.model}` not supported!"
         )
+
+    requirement_prompts = {
+        'reachability': ADD_REQUIREMENT_REACHABILITY_PROMPT,
+        'waypoint': ADD_REQUIREMENT_WAYPOINT_PROMPT,
+        'loadbalancing': ADD_REQUIREMENT_LOADBALANCING_PROMPT,
+    }
+
+    prompt_plan = PromptPlan(llm_step_2, messages, verbose=True)
+    worker = functools.partial(
+        run_work_item, prompt_plan=prompt_plan, requirement_prompts=requirement_prompts,
+        feedback_prompt=FEEDBACK_CODE_GENERATION, args=args
     )
+    worker = trace_work_items(worker, RESUME_KEY)
+    # The budget is estimated on the prompts sent to the model
+    worker.prompt_text = functools.partial(prompt_text, prompt_plan=prompt_plan, requirement_prompts=requirement_prompts)
+    yield worker
 
-    file_handler.setFormatter(logging.Formatter('%(message)s'))
-    file_handler.setLevel(logging.WARNING)
-    logging.root.addHandler(file_handler)
-
-    llm_step_2 = get_model_instance(args.model)
-
-    w = None
-
-    code_base_assets_path = os.path.abspath(os.path.join('..', 'assets', 'step_2_code_base'))
-    tests_assets_path = os.path.abspath(os.path.join('..', 'assets', 'step_2_tests'))
-    filename = f"result-{args.model}-{'_'.join(args.policy_types)}-{args.prompts}-{'without_feedback' if not with_feedback else 'with_feedback'}-{results_time}.csv"
-    with open(os.path.join(args.results_path, filename), 'w') as f:
-        for it in range(0, args.n_runs):
-            for policy in args.policy_types:
-                test_cases_path = "path_tests"
-
-                code_path = os.path.join(code_base_assets_path, "computing_path_empty.py")
-                add_requirement_prompts = ""
-
-                if policy == "reachability":
-                    code_path = os.path.join(code_base_assets_path, "computing_path_shortest_path.py")
-                    add_requirement_prompts = ADD_REQUIREMENT_REACHABILITY_PROMPT
-                    test_cases_path = "reachability_tests"
-                elif policy == "waypoint":
-                    code_path = os.path.join(code_base_assets_path, "computing_path_reachability.py")
-                    add_requirement_prompts = ADD_REQUIREMENT_WAYPOINT_PROMPT
-                    test_cases_path = "waypoint_tests"
-                elif policy == "loadbalancing":
-                    code_path = os.path.join(code_base_assets_path, "computing_path_shortest_path.py")
-                    add_requirement_prompts = ADD_REQUIREMENT_LOADBALANCING_PROMPT
-                    test_cases_path = "loadbalancing_tests"
-
-                with open(code_path, "r") as f_code:
-                    code = f_code.read()
-                prompt = code + "\n" + add_requirement_prompts
-
-                logging.warning(f"(Iteration n. {it}) performing code generation with {policy}...")
-
-                result_row = {
-                    'iteration': it,
-                    'policy': policy,
-                    'time': 0,
-                    'feedback_num': 0,
-                    'format_error_num': 0,
-                    'syntax_error_num': 0,
-                    'test_error_num': 0,
-                    'prompt_tokens': 0,
-                    'completion_tokens': 0,
-                    'total_cost': 0,
-                }
-
-                if w is None:
-                    w = csv.DictWriter(f, result_row.keys())
-                    w.writeheader()
-
-                if model_configurations[args.model]['type'] in ['HF', 'Ollama']:
-                    combined_system_prompt = f"{SETUP_PROMPT}\n{ASK_FOR_CODE_PROMPT}"
-                    combined_human_prompt = f"{INPUT_OUTPUT_PROMPT}\n{INSTRUCTION_PROMPT}\n{{input}}"
-                    if with_feedback:
-                        messages = [
-                            ("system", combined_system_prompt),
-                            ("user", combined_human_prompt),
-                            MessagesPlaceholder(variable_name="chat_history"),
-                        ]
-                    else:
-                        messages = [
-                            ("system", combined_system_prompt),
-                            ("user", combined_human_prompt),
-                        ]
-                elif model_configurations[args.model]['type'] == 'openai':
-                    if with_feedback:
-                        messages = [
-                            ("system", SETUP_PROMPT),
-                            ("human", INPUT_OUTPUT_PROMPT),
-                            ("human", INSTRUCTION_PROMPT),
-                            MessagesPlaceholder(variable_name="chat_history"),
-                            ("human", "{input}"),
-                            ("system", ASK_FOR_CODE_PROMPT)
-                        ]
-                    else:
-                        messages = [
-                            ("system", SETUP_PROMPT),
-                            ("human", INPUT_OUTPUT_PROMPT),
-                            ("human", INSTRUCTION_PROMPT),
-                            ("human", "{input}"),
-                            ("system", ASK_FOR_CODE_PROMPT)
-                        ]
-                else:
-                    raise Exception(
-                        f"Type `{model_configurations[args.model]['type']}` for Model `{args.model}` not supported!"
-                    )
-
-                prompt_step_2 = ChatPromptTemplate.from_messages(messages)
-                memory_step_2 = ConversationLatestMemory(memory_key="chat_history", return_messages=True)
-                chain_step_2 = LLMChain(
-                    llm=llm_step_2,
-                    prompt=prompt_step_2,
-                    verbose=True,
-                    memory=memory_step_2,
-                )
 
-                step_2_verifier = Step2VerifierDetailed(
-                    default_test_path=os.path.join(tests_assets_path, "path_tests")
-                )
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
 
-                step_2 = ChainStep(
-                    llm_chain=chain_step_2,
-                    verifier=step_2_verifier,
-                    feedback_prompt=FEEDBACK_CODE_GENERATION if with_feedback else None,
-                    feedback_retries=args.n_retries,
-                    input_formatter=step_2_input_formatter,
-                    output_formatter=step_2_output_formatter
-                )
+    work_items = plan_experiment(args)
+
+    os.makedirs(args.results_path, exist_ok=True)
 
-                start = time.time()
-
-                if model_configurations[args.model]['type'] == 'openai':
-                    with get_openai_callback() as cb:
-                        try:
-                            step_2.process(
-                                {
-                                    "extend": True,
-                                    "input": prompt,
-                                    "metadata": {"test_path": os.path.join(tests_assets_path, test_cases_path)}
-                                }
-                            )
-                        except Exception as e:
-                            logging.warning(e)
-
-                        result_row['prompt_tokens'] = cb.prompt_tokens
-                        result_row['completion_tokens'] = cb.completion_tokens
-                        result_row['total_cost'] = cb.total_cost
-                else:
-                    try:
-                        step_2.process(
-                            {
-                                "extend": True,
-                                "input": prompt,
-                                "metadata": {"test_path": os.path.join(tests_assets_path, test_cases_path)}
-                            }
-                        )
-                    except Exception as e:
-                        logging.warning(e)
-
-                result_row['test_error_num'] = step_2.test_error
-                result_row['syntax_error_num'] = step_2.syntax_error
-                result_row['format_error_num'] = step_2.format_error
-                result_row['feedback_num'] = step_2.failure_number
-
-                end = time.time()
-                result_row['time'] = end - start
-
-                w.writerow(result_row)
-                f.flush()
+    results_time = time.strftime("%Y%m%d-%H%M%S")
+    with experiment_logging(args.results_path, experiment_name(args, results_time), args.log_format):
+        fieldnames = None
+        if args.resume:
+            fieldnames, resumed_rows = load_resumed_results(args, phase_columns(PHASES))
+            completed = {result_key(row, RESUME_KEY) for row in resumed_rows}
+            work_items = [work_item for work_item in work_items if result_key(work_item, RESUME_KEY) not in completed]
+            logging.info(f"Resuming `{args.resume}`, {len(completed)} experiments already completed.")
+
+        trace_path = os.path.join(args.results_path, f"trace-{experiment_name(args, results_time)}.json")
+        with chrome_trace(trace_path if args.chrome_trace else None), \
+                experiment_worker(args, work_items) as worker, \
+                open_results(
+                    args, 'code-gen', experiment_name(args, results_time), fieldnames, COMPRESSED_COLUMNS
+                ) as write_row:
+            budget = budget_guard(args, work_items, RESUME_KEY, worker.prompt_text)
+            write_row = budget.track(write_row)
+            for work_item in work_items:
+                if budget.exhausted():
+                    break
+
+                write_row(worker(work_item))
 
 
 if __name__ == '__main__':
@@ -1,6 +1,6 @@
 import argparse
-import csv
 import difflib
+import functools
 import io
 import ipaddress
 import json
@@ -9,27 +9,40 @@ import os
 import re
 import sys
 import time
+from contextlib import contextmanager
 from string import whitespace
+from typing import TYPE_CHECKING, Any, Callable, Generator
 
-from Kathara.manager.Kathara import Kathara
-from Kathara.model.Lab import Lab
-from Kathara.model.Machine import Machine
-from langchain.chains import LLMChain
-from langchain.prompts import ChatPromptTemplate
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.callbacks import get_openai_callback
-from langchain_community.document_loaders import PDFMinerLoader
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
+# Kathara, LangChain and the RAG dependencies are imported where they are used, so that parsing the arguments
+# does not require to load them
+if TYPE_CHECKING:
+    from Kathara.model.Machine import Machine
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
+from netconfeval.common.budget import DEFAULT_BUDGET_WARNING, budget_guard, messages_text
 from netconfeval.common.model_configs import model_configurations, get_model_instance
-from netconfeval.foundation.step.chain_step import ChainStep
+from netconfeval.common.results_store import load_resumed_results, open_results
+from netconfeval.common.trace_logging import LOG_FORMATS, Lazy, experiment_logging, trace_work_items
+from netconfeval.common.utils import result_key
+from netconfeval.foundation.langchain.cache.cache_stats import CACHE_MODES, start_cache_stats
+from netconfeval.foundation.tracing.spans import chrome_trace, phase_columns, span, start_spans
 from netconfeval.prompts.step_3_low_level import *
 
 
+# Repository root: the default assets and results paths are resolved from it, not from the working directory
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Columns identifying an experiment in the result file, used to skip the completed ones with `--resume`
+RESUME_KEY = ['scenario_name', 'iteration']
+# Columns compressed in `--results_store`
+COMPRESSED_COLUMNS = ['result']
+# Phases of the work items reported in the `time_<phase>` columns
+PHASES = ['attempt', 'model', 'parse', 'score', 'run_results']
+
+
 def text_from_pdf(pdf_path: str) -> str:
+    from langchain_community.document_loaders import PDFMinerLoader
+
     loader = PDFMinerLoader(pdf_path)
     pdf_data = loader.load()
     text = pdf_data[0].page_content
@@ -38,20 +51,37 @@ def text_from_pdf(pdf_path: str) -> str:
     return text
 
 
-def parse_args() -> argparse.Namespace:
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', choices=list(model_configurations.keys()), required=True)
     parser.add_argument('--n_runs', type=int, required=False, default=5)
     parser.add_argument(
-        '--results_path', type=str, default=os.path.join("..", "results_low_level")
+        '--results_path', type=str, default=os.path.join(ROOT_PATH, "results_low_level")
     )
     parser.add_argument('--mode', type=str, choices=['none', 'full', 'idx', 'rag'])
     parser.add_argument('--rag_chunk_size', type=int, required=False, default=9000)
+    parser.add_argument('--cache_path', type=str, required=False, default=None)
+    parser.add_argument('--cache_mode', choices=CACHE_MODES, required=False, default='read-write')
+    parser.add_argument('--cache_max_size', type=int, required=False, default=1024)
+    parser.add_argument('--resume', type=str, required=False, default=None)
+    parser.add_argument('--results_store', type=str, required=False, default=None)
+    parser.add_argument('--log_format', choices=LOG_FORMATS, required=False, default='text')
+    parser.add_argument('--chrome_trace', action='store_true', required=False)
+    parser.add_argument('--max_cost', type=float, required=False, default=None)
+    parser.add_argument('--max_wall_time', type=float, required=False, default=None)
+    parser.add_argument('--budget_warning', type=float, required=False, default=DEFAULT_BUDGET_WARNING)
 
-    return parser.parse_args()
+    return parser
 
 
-def start_container() -> Machine:
+def parse_args() -> argparse.Namespace:
+    return build_parser().parse_args()
+
+
+def start_container() -> 'Machine':
+    from Kathara.manager.Kathara import Kathara
+    from Kathara.model.Lab import Lab
+
     lab = Lab("netconfeval")
     machine = lab.new_machine("frr_test", image="kathara/frr")
 
@@ -61,7 +91,9 @@ def start_container() -> Machine:
     return machine
 
 
-def stop_container(machine: Machine) -> None:
+def stop_container(machine: 'Machine') -> None:
+    from Kathara.manager.Kathara import Kathara
+
     Kathara.get_instance().undeploy_machine(machine)
 
 
@@ -119,7 +151,9 @@ ignored_msgs: list = [
 ]
 
 
-def apply_and_dump(machine: Machine, config_path: str, daemon: str) -> str:
+def apply_and_dump(machine: 'Machine', config_path: str, daemon: str) -> str:
+    from Kathara.manager.Kathara import Kathara
+
     # Load the configuration in FRR
     for command in [
         f"cp {config_path} /etc/frr/{daemon}.conf",
@@ -412,7 +446,7 @@ def run_rift(results: dict):
         expected_for_rift = format_config(result["expected"], "riftd")
         rift_expected, expected_errors = apply_rift(expected_for_rift)
         generated_for_rift = format_config(result["generated"], "riftd")
-        logging.warning(f"{name} Formatted Generated:\n" + generated_for_rift)
+        logging.warning("%s Formatted Generated:\n%s", name, generated_for_rift)
         rift_generated, generated_errors = apply_rift(generated_for_rift)
 
         s = difflib.SequenceMatcher(
@@ -422,16 +456,16 @@ def run_rift(results: dict):
             autojunk=False
         )
         result["diff_similarity_daemon"] = s.ratio()
-        logging.warning(f"RIFT Diff Similarity for {name}: " + str(result["diff_similarity_daemon"]))
+        logging.warning("RIFT Diff Similarity for %s: %s", name, result["diff_similarity_daemon"])
 
         d = difflib.Differ()
-        logging.warning(f"DIFFS for {name}:\n" + "\n".join(list(d.compare(rift_expected, rift_generated))))
+        logging.warning("DIFFS for %s:\n%s", name, Lazy("\n".join, d.compare(rift_expected, rift_generated)))
 
         if generated_errors:
             logging.info("There are some errors in the configuration!")
             result["daemon_errors"] = generated_errors
             result["n_daemon_errors"] = len(generated_errors)
-            logging.warning(str(result["n_daemon_errors"]) + " RIFT Errors found:\n" + str(generated_errors))
+            logging.warning("%s RIFT Errors found:\n%s", result["n_daemon_errors"], generated_errors)
         else:
             result["daemon_errors"] = []
             result["n_daemon_errors"] = 0
@@ -446,7 +480,9 @@ scenario_to_daemon: dict = {
 }
 
 
-def run_results(scenario: str, results: dict, machine: Machine) -> None:
+def run_results(scenario: str, results: dict, machine: 'Machine') -> None:
+    from Kathara.manager.Kathara import Kathara
+
     daemon = scenario_to_daemon[scenario]
     if daemon is None:
         logging.info(f"Cannot evaluate scenario {scenario} since it is unsupported.")
@@ -462,7 +498,7 @@ def run_results(scenario: str, results: dict, machine: Machine) -> None:
         expected_for_frr = format_config(result["expected"], daemon)
         guest_to_host[f"/expected/{name}"] = io.StringIO(expected_for_frr)
         generated_for_frr = format_config(result["generated"], daemon)
-        logging.warning(f"{name} Formatted Generated:\n" + generated_for_frr)
+        logging.warning("%s Formatted Generated:\n%s", name, generated_for_frr)
         guest_to_host[f"/gpt/{name}"] = io.StringIO(generated_for_frr)
     guest_to_host["/etc/frr/daemons"] = io.StringIO(f"{daemon}=yes")
 
@@ -487,10 +523,12 @@ def run_results(scenario: str, results: dict, machine: Machine) -> None:
             autojunk=False
         )
         result["diff_similarity_daemon"] = s.ratio()
-        logging.warning(f"FRR Diff Similarity for {name}: " + str(result["diff_similarity_daemon"]))
+        logging.warning("FRR Diff Similarity for %s: %s", name, result["diff_similarity_daemon"])
 
         d = difflib.Differ()
-        logging.warning(f"DIFFS for {name}:\n" + "\n".join(list(d.compare(split_frr_expected, split_frr_generated))))
+        logging.warning(
+            "DIFFS for %s:\n%s", name, Lazy("\n".join, d.compare(split_frr_expected, split_frr_generated))
+        )
 
         command = f"/usr/lib/frr/{daemon} -f /gpt/{name} -C"
         exec_output = Kathara.get_instance().exec(machine.name, command, lab=machine.lab)
@@ -520,7 +558,7 @@ def run_results(scenario: str, results: dict, machine: Machine) -> None:
             logging.info("There are some errors in the configuration!")
             result["daemon_errors"] = stderr_split
             result["n_daemon_errors"] = len(stderr_split)
-            logging.warning(str(result["n_daemon_errors"]) + " FRR Errors found:\n" + str(stderr_split))
+            logging.warning("%s FRR Errors found:\n%s", result["n_daemon_errors"], stderr_split)
         else:
             result["daemon_errors"] = []
             result["n_daemon_errors"] = 0
@@ -659,29 +697,281 @@ dataset: dict = {
 }
 
 
-def main(args: argparse.Namespace) -> None:
-    logging.basicConfig(
-        format='[%(levelname)s] %(message)s',
-        level=logging.INFO,
-        handlers=[
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
+def experiment_name(args: argparse.Namespace, results_time: str) -> str:
+    rag_lbl = f'_{args.rag_chunk_size}'
+    return f"{args.model}-{args.mode}{rag_lbl}-{results_time}"
 
-    os.makedirs(args.results_path, exist_ok=True)
 
-    rag_lbl = f'_{args.rag_chunk_size}'
-    results_time = time.strftime("%Y%m%d-%H%M%S")
-    file_handler = logging.FileHandler(
-        os.path.abspath(
-            os.path.join(args.results_path, f"log-{args.model}-{args.mode}{rag_lbl}-{results_time}.log")
+def plan_experiment(args: argparse.Namespace) -> list[dict]:
+    return [{'iteration': it, 'scenario_name': name} for it in range(0, args.n_runs) for name in dataset.keys()]
+
+
+def prompt_text(work_item: dict, docs_text: str | None) -> str:
+    """Returns the text of the prompt of a scenario.
+
+    The documents are only included when they are known before running the scenario (the full documentation, or the
+    index of the `idx` mode), the ones retrieved with `rag` are not.
+    """
+    from langchain.prompts import ChatPromptTemplate
+
+    assets_path = os.path.join(ROOT_PATH, 'assets', 'step_3_low_level')
+    with open(os.path.join(assets_path, work_item['scenario_name'], 'lab.conf')) as lab_file:
+        topology = "".join(lab_file.readlines())
+
+    messages = [
+        ("system", SETUP_PROMPT),
+        ("system", NETWORK_DESCRIPTION),
+        ("human", NETWORK_DESCRIPTION_USER),
+        ("human", "{goal}")
+    ]
+    variables = {"topology": topology, "goal": dataset[work_item['scenario_name']]['goal']}
+    if docs_text is not None:
+        messages.append(("system", DOCS_STR))
+        variables["docs"] = docs_text
+    messages.extend([
+        ("system", OUTPUT_FORMAT),
+        ("system", ASK_FOR_OUTPUT),
+    ])
+
+    return messages_text(ChatPromptTemplate.from_messages(messages).format_messages(**variables))
+
+
+def run_work_item(work_item: dict, llm: Any, index_text: str | None, db: Any, frr_device: 'Machine',
+                  args: argparse.Namespace) -> dict:
+    from langchain.chains import LLMChain
+    from langchain.prompts import ChatPromptTemplate
+    from langchain_community.callbacks import get_openai_callback
+
+    from netconfeval.foundation.langchain.callbacks.usage_callback import UsageCallbackHandler, get_usage_callback
+    from netconfeval.foundation.step.chain_step import ChainStep
+
+    it = work_item['iteration']
+    name = work_item['scenario_name']
+    data = dataset[name]
+
+    assets_path = os.path.join(ROOT_PATH, 'assets', 'step_3_low_level')
+
+    logging.info(f"Performing experiment `{name}` (iteration n. {it + 1})...")
+
+    additional_rows = {}
+    if args.mode == 'rag':
+        additional_rows = {'chunk_size': args.rag_chunk_size}
+
+    result_row = {
+        'scenario_name': name,
+        'iteration': it,
+        'mode': args.mode,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'total_cost': 0,
+        'tokens_per_second': 0,
+        'time_to_first_token': 0,
+        'prefill_time': 0,
+        'decode_time': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'result': None,
+        'format_error': None,
+        'model_error': None,
+        'time': 0,
+        **additional_rows
+    }
+
+    lab_path = os.path.join(assets_path, name)
+    with open(os.path.join(lab_path, 'lab.conf')) as lab_file:
+        topology = "".join(lab_file.readlines())
+
+    logging.warning(f"==== RUN #{it + 1} (SCENARIO {name}) ====")
+
+    messages = [
+        ("system", SETUP_PROMPT),
+        ("system", NETWORK_DESCRIPTION),
+        ("human", NETWORK_DESCRIPTION_USER),
+        ("human", "{goal}")
+    ]
+
+    goal_text = data['goal']
+
+    cache_stats = start_cache_stats()
+    spans = start_spans(PHASES, {column: work_item[column] for column in RESUME_KEY})
+    # Accumulates the usage of local models over both calls of the `idx` mode
+    usage_cb = UsageCallbackHandler()
+    start_time = time.time()
+    if args.mode == 'idx':
+        messages.append(("system", DOCS_INDEX))
+
+        prompt_template = ChatPromptTemplate.from_messages(messages)
+        llm_chain = LLMChain(
+            llm=llm,
+            prompt=prompt_template,
+            verbose=True
+        )
+        chain_step = ChainStep(
+            llm_chain=llm_chain,
+            input_formatter=lambda x: x,
+            output_formatter=lambda x: x
+        )
+
+        try:
+            with get_openai_callback() as cb, get_usage_callback(usage_cb):
+                _, sec_num = chain_step.process(
+                    {"topology": topology, "index": index_text, "goal": goal_text}
+                )
+                result_row['prompt_tokens'] = cb.prompt_tokens
+                result_row['completion_tokens'] = cb.completion_tokens
+                result_row['total_cost'] = cb.total_cost
+        except Exception as e:
+            logging.error(str(e))
+            result_row['model_error'] = str(e)
+            sec_num = "0"
+
+        logging.warning("LLM Result: " + sec_num)
+        if " " in sec_num:
+            # Sometimes the response is "3.11 OSPF"
+            sec_num_parts = sec_num.split(" ")
+            sec_num_parts = [x for x in sec_num_parts if re.match(r'\d+\.\d+', x)]
+            if sec_num_parts:
+                sec_num = sec_num_parts.pop()
+
+        doc_path = os.path.join(assets_path, f"{sec_num}.pdf")
+        if not os.path.exists(doc_path):
+            result_row['format_error'] = f"Section `{sec_num}` not correct for {name}."
+
+            logging.error(result_row['format_error'])
+            spans.record(result_row)
+
+            return result_row
+
+    llm_call_args = {}
+    if args.mode == "idx":
+        docs_text = text_from_pdf(doc_path)
+
+        llm_call_args = {"topology": topology, "docs": docs_text, "goal": goal_text}
+        messages = [
+            ("system", SETUP_PROMPT),
+            ("system", NETWORK_DESCRIPTION),
+            ("human", NETWORK_DESCRIPTION_USER),
+            ("human", "{goal}"),
+            ("system", DOCS_STR),
+            ("system", OUTPUT_FORMAT),
+            ("system", ASK_FOR_OUTPUT),
+        ]
+    elif args.mode == "none":
+        messages.extend([
+            ("system", OUTPUT_FORMAT),
+            ("system", ASK_FOR_OUTPUT),
+        ])
+
+        llm_call_args = {"topology": topology, "goal": goal_text}
+    elif args.mode == "full":
+        messages.extend([
+            ("system", DOCS_STR),
+            ("system", OUTPUT_FORMAT),
+            ("system", ASK_FOR_OUTPUT),
+        ])
+
+        docs_text = text_from_pdf(os.path.join(assets_path, "full-docs-shrink.pdf"))
+
+        llm_call_args = {"topology": topology, "docs": docs_text, "goal": goal_text}
+    elif args.mode == "rag":
+        relevant_docs_and_score = db.max_marginal_relevance_search(goal_text, k=8)
+
+        logging.warning(
+            "========= RAG Relevant chunks (%s=========\n%s\n===================================\n",
+            args.rag_chunk_size,
+            Lazy(lambda: "\n\n".join(["!!! CHUNK " + str(i) + " !!!\n" + x.page_content
+                                       for i, x in enumerate(relevant_docs_and_score)]))
         )
-    )
-    file_handler.setFormatter(logging.Formatter('%(message)s'))
-    file_handler.setLevel(logging.WARNING)
-    logging.root.addHandler(file_handler)
 
-    assets_path = os.path.abspath(os.path.join('..', 'assets', 'step_3_low_level'))
+        relevant_docs_str = "\n".join([d.page_content for d in relevant_docs_and_score])
+
+        messages.extend([
+            ("system", DOCS_STR),
+            ("system", OUTPUT_FORMAT),
+            ("system", ASK_FOR_OUTPUT),
+        ])
+        llm_call_args = {"topology": topology, "docs": relevant_docs_str, "goal": goal_text}
+
+    prompt_template = ChatPromptTemplate.from_messages(messages)
+    llm_chain = LLMChain(
+        llm=llm,
+        prompt=prompt_template,
+        verbose=True
+    )
+    chain_step = ChainStep(
+        llm_chain=llm_chain,
+        input_formatter=lambda x: x,
+        output_formatter=lambda x: x
+    )
+    try:
+        with get_openai_callback() as cb, get_usage_callback(usage_cb):
+            status, output = chain_step.process(
+                llm_call_args
+            )
+            result_row['prompt_tokens'] += cb.prompt_tokens
+            result_row['completion_tokens'] += cb.completion_tokens
+            result_row['total_cost'] += cb.total_cost
+            if model_configurations[args.model]['type'] != 'openai':
+                usage_cb.record(result_row)
+    except Exception as e:
+        logging.error(str(e))
+        result_row['model_error'] = str(e)
+        output = {}
+    result_row['time'] = time.time() - start_time
+    result_row['cache_hits'] = cache_stats.hits
+    result_row['cache_misses'] = cache_stats.misses
+
+    logging.warning("LLM Result: %s", output)
+
+    with span('score'):
+        dev2configs = {}
+        conf_path = os.path.join(lab_path, "configs")
+        for dev_conf in filter(lambda x: not x.startswith('.'), os.listdir(conf_path)):
+            dev_name, _ = os.path.splitext(dev_conf)
+            with open(os.path.join(conf_path, dev_conf)) as dev_file:
+                expected = "".join(dev_file.readlines())
+
+            generated = output[dev_name] if dev_name in output else ""
+            generated = generated if type(generated) is str else "\n".join(generated) \
+                if generated is not None else ""
+
+            clean_expected = expected.replace('!', '')
+            clean_expected = [re.sub(r"^ +", "", x) for x in clean_expected.split('\n')]
+            clean_expected = [x for x in clean_expected if x]
+            clean_generated = generated.replace('!', '')
+            clean_generated = [re.sub(r"^ +", "", x) for x in clean_generated.split('\n')]
+            clean_generated = [x for x in clean_generated if x]
+
+            s = difflib.SequenceMatcher(lambda x: "[PLACEHOLDER]" in x, clean_generated, clean_expected)
+            diff_similarity = s.ratio()
+
+            dev2configs[dev_name] = {
+                'expected': expected,
+                'generated': generated,
+                'diff_similarity': diff_similarity,
+            }
+
+    with span('run_results'):
+        run_results(name, dev2configs, frr_device)
+
+    result_row['result'] = json.dumps(dev2configs)
+    spans.record(result_row)
+
+    logging.warning("==================================================================")
+
+    return result_row
+
+
+@contextmanager
+def experiment_worker(args: argparse.Namespace, work_items: list[dict]) -> Generator[Callable, None, None]:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import PDFMinerLoader
+    from langchain_community.vectorstores import Chroma
+    from langchain_openai import OpenAIEmbeddings
+
+    from netconfeval.foundation.langchain.cache.response_cache import ResponseCache
+
+    assets_path = os.path.join(ROOT_PATH, 'assets', 'step_3_low_level')
     index_text = None
     db = {}
     if args.mode == 'idx':
@@ -703,219 +993,67 @@ def main(args: argparse.Namespace) -> None:
         chunks = text_splitter.split_documents(documents)
         db = Chroma.from_documents(chunks, OpenAIEmbeddings())
 
-    llm = get_model_instance(args.model)
+    cache = None
+    if args.cache_path:
+        cache = ResponseCache(
+            args.cache_path, model_configurations[args.model], args.cache_mode, args.cache_max_size * 1024 * 1024
+        )
+
+    llm = get_model_instance(args.model, cache=cache)
+
+    budget_docs_text = index_text
+    if args.mode == "full":
+        budget_docs_text = text_from_pdf(os.path.join(assets_path, "full-docs-shrink.pdf"))
 
     # Start the Kathara machine with FRRouting
     frr_device = start_container()
+    try:
+        worker = functools.partial(
+            run_work_item, llm=llm, index_text=index_text, db=db, frr_device=frr_device, args=args
+        )
+        worker = trace_work_items(worker, RESUME_KEY)
+        # The budget is estimated on the prompts sent to the model
+        worker.prompt_text = functools.partial(prompt_text, docs_text=budget_docs_text)
+        yield worker
+    finally:
+        stop_container(frr_device)
 
-    w = None
-
-    filename = f"result-{args.model}-{args.mode}{rag_lbl}-{results_time}.csv"
-    with (open(os.path.join(args.results_path, filename), 'w') as f):
-        for it in range(0, args.n_runs):
-            logging.info(f"Performing iteration n. {it + 1}...")
-
-            for name, data in dataset.items():
-                logging.info(f"Performing experiment `{name}` (iteration n. {it + 1})...")
-
-                additional_rows = {}
-                if args.mode == 'rag':
-                    additional_rows = {'chunk_size': args.rag_chunk_size}
-
-                result_row = {
-                    'scenario_name': name,
-                    'iteration': it,
-                    'mode': args.mode,
-                    'prompt_tokens': 0,
-                    'completion_tokens': 0,
-                    'total_cost': 0,
-                    'result': None,
-                    'format_error': None,
-                    'model_error': None,
-                    'time': 0,
-                    **additional_rows
-                }
-
-                if w is None:
-                    w = csv.DictWriter(f, result_row.keys())
-                    w.writeheader()
-
-                lab_path = os.path.join(assets_path, name)
-                with open(os.path.join(lab_path, 'lab.conf')) as lab_file:
-                    topology = "".join(lab_file.readlines())
-
-                logging.warning(f"==== RUN #{it + 1} (SCENARIO {name}) ====")
-
-                messages = [
-                    ("system", SETUP_PROMPT),
-                    ("system", NETWORK_DESCRIPTION),
-                    ("human", NETWORK_DESCRIPTION_USER),
-                    ("human", "{goal}")
-                ]
-
-                goal_text = data['goal']
-
-                start_time = time.time()
-                if args.mode == 'idx':
-                    messages.append(("system", DOCS_INDEX))
-
-                    prompt_template = ChatPromptTemplate.from_messages(messages)
-                    llm_chain = LLMChain(
-                        llm=llm,
-                        prompt=prompt_template,
-                        verbose=True
-                    )
-                    chain_step = ChainStep(
-                        llm_chain=llm_chain,
-                        input_formatter=lambda x: x,
-                        output_formatter=lambda x: x
-                    )
-
-                    try:
-                        with get_openai_callback() as cb:
-                            _, sec_num = chain_step.process(
-                                {"topology": topology, "index": index_text, "goal": goal_text}
-                            )
-                            result_row['prompt_tokens'] = cb.prompt_tokens
-                            result_row['completion_tokens'] = cb.completion_tokens
-                            result_row['total_cost'] = cb.total_cost
-                    except Exception as e:
-                        logging.error(str(e))
-                        result_row['model_error'] = str(e)
-                        sec_num = "0"
-
-                    logging.warning("LLM Result: " + sec_num)
-                    if " " in sec_num:
-                        # Sometimes the response is "3.11 OSPF"
-                        sec_num_parts = sec_num.split(" ")
-                        sec_num_parts = [x for x in sec_num_parts if re.match(r'\d+\.\d+', x)]
-                        if sec_num_parts:
-                            sec_num = sec_num_parts.pop()
-
-                    doc_path = os.path.join(assets_path, f"{sec_num}.pdf")
-                    if not os.path.exists(doc_path):
-                        result_row['format_error'] = f"Section `{sec_num}` not correct for {name}."
-
-                        logging.error(result_row['format_error'])
-
-                        w.writerow(result_row)
-                        f.flush()
 
-                        continue
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.INFO,
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
 
-                llm_call_args = {}
-                if args.mode == "idx":
-                    docs_text = text_from_pdf(doc_path)
-
-                    llm_call_args = {"topology": topology, "docs": docs_text, "goal": goal_text}
-                    messages = [
-                        ("system", SETUP_PROMPT),
-                        ("system", NETWORK_DESCRIPTION),
-                        ("human", NETWORK_DESCRIPTION_USER),
-                        ("human", "{goal}"),
-                        ("system", DOCS_STR),
-                        ("system", OUTPUT_FORMAT),
-                        ("system", ASK_FOR_OUTPUT),
-                    ]
-                elif args.mode == "none":
-                    messages.extend([
-                        ("system", OUTPUT_FORMAT),
-                        ("system", ASK_FOR_OUTPUT),
-                    ])
-
-                    llm_call_args = {"topology": topology, "goal": goal_text}
-                elif args.mode == "full":
-                    messages.extend([
-                        ("system", DOCS_STR),
-                        ("system", OUTPUT_FORMAT),
-                        ("system", ASK_FOR_OUTPUT),
-                    ])
-
-                    docs_text = text_from_pdf(os.path.join(assets_path, "full-docs-shrink.pdf"))
-
-                    llm_call_args = {"topology": topology, "docs": docs_text, "goal": goal_text}
-                elif args.mode == "rag":
-                    relevant_docs_and_score = db.max_marginal_relevance_search(goal_text, k=8)
-
-                    logging.warning(f"========= RAG Relevant chunks ({args.rag_chunk_size}=========\n" +
-                                    "\n\n".join(["!!! CHUNK " + str(i) + " !!!\n" + x.page_content
-                                                 for i, x in enumerate(relevant_docs_and_score)]) +
-                                    f"\n===================================\n"
-                                    )
-
-                    relevant_docs_str = "\n".join([d.page_content for d in relevant_docs_and_score])
-
-                    messages.extend([
-                        ("system", DOCS_STR),
-                        ("system", OUTPUT_FORMAT),
-                        ("system", ASK_FOR_OUTPUT),
-                    ])
-                    llm_call_args = {"topology": topology, "docs": relevant_docs_str, "goal": goal_text}
-
-                prompt_template = ChatPromptTemplate.from_messages(messages)
-                llm_chain = LLMChain(
-                    llm=llm,
-                    prompt=prompt_template,
-                    verbose=True
-                )
-                chain_step = ChainStep(
-                    llm_chain=llm_chain,
-                    input_formatter=lambda x: x,
-                    output_formatter=lambda x: x
-                )
-                try:
-                    with get_openai_callback() as cb:
-                        status, output = chain_step.process(
-                            llm_call_args
-                        )
-                        result_row['prompt_tokens'] += cb.prompt_tokens
-                        result_row['completion_tokens'] += cb.completion_tokens
-                        result_row['total_cost'] += cb.total_cost
-                except Exception as e:
-                    logging.error(str(e))
-                    result_row['model_error'] = str(e)
-                    output = {}
-                result_row['time'] = time.time() - start_time
-
-                logging.warning("LLM Result: " + str(output))
-
-                dev2configs = {}
-                conf_path = os.path.join(lab_path, "configs")
-                for dev_conf in filter(lambda x: not x.startswith('.'), os.listdir(conf_path)):
-                    dev_name, _ = os.path.splitext(dev_conf)
-                    with open(os.path.join(conf_path, dev_conf)) as dev_file:
-                        expected = "".join(dev_file.readlines())
-
-                    generated = output[dev_name] if dev_name in output else ""
-                    generated = generated if type(generated) is str else "\n".join(generated) \
-                        if generated is not None else ""
-
-                    clean_expected = expected.replace('!', '')
-                    clean_expected = [re.sub(r"^ +", "", x) for x in clean_expected.split('\n')]
-                    clean_expected = [x for x in clean_expected if x]
-                    clean_generated = generated.replace('!', '')
-                    clean_generated = [re.sub(r"^ +", "", x) for x in clean_generated.split('\n')]
-                    clean_generated = [x for x in clean_generated if x]
-
-                    s = difflib.SequenceMatcher(lambda x: "[PLACEHOLDER]" in x, clean_generated, clean_expected)
-                    diff_similarity = s.ratio()
-
-                    dev2configs[dev_name] = {
-                        'expected': expected,
-                        'generated': generated,
-                        'diff_similarity': diff_similarity,
-                    }
-
-                run_results(name, dev2configs, frr_device)
-
-                result_row['result'] = json.dumps(dev2configs)
-
-                logging.warning("==================================================================")
-
-                w.writerow(result_row)
-                f.flush()
-
-    stop_container(frr_device)
+    os.makedirs(args.results_path, exist_ok=True)
+
+    results_time = time.strftime("%Y%m%d-%H%M%S")
+    with experiment_logging(args.results_path, experiment_name(args, results_time), args.log_format):
+        work_items = plan_experiment(args)
+
+        fieldnames = None
+        if args.resume:
+            fieldnames, resumed_rows = load_resumed_results(args, phase_columns(PHASES))
+            completed = {result_key(row, RESUME_KEY) for row in resumed_rows}
+            work_items = [work_item for work_item in work_items if result_key(work_item, RESUME_KEY) not in completed]
+            logging.info(f"Resuming `{args.resume}`, {len(completed)} experiments already completed.")
+
+        trace_path = os.path.join(args.results_path, f"trace-{experiment_name(args, results_time)}.json")
+        with chrome_trace(trace_path if args.chrome_trace else None), \
+                experiment_worker(args, work_items) as worker, \
+                open_results(
+                    args, 'low-level', experiment_name(args, results_time), fieldnames, COMPRESSED_COLUMNS
+                ) as write_row:
+            budget = budget_guard(args, work_items, RESUME_KEY, worker.prompt_text)
+            write_row = budget.track(write_row)
+            for work_item in work_items:
+                if budget.exhausted():
+                    break
+
+                write_row(worker(work_item))
 
 
 if __name__ == "__main__":
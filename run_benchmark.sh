@@ -30,34 +30,37 @@ then
     exit 1
 fi
 
+# The commands are run from the repository root, where the `netconfeval` package is
+cd "$(dirname "$0")"
+
 # Translation
-python3 netconfeval/step_1_formal_spec_translation.py --n_run $n_runs --model $model --policy_types reachability waypoint loadbalancing --batch_size 1 3 11 33
-python3 netconfeval/step_1_formal_spec_translation.py --n_run $n_runs --model $model --policy_types reachability waypoint --batch_size 1 2 5 10 25 50
-python3 netconfeval/step_1_formal_spec_translation.py --n_run $n_runs --model $model --policy_types reachability --batch_size 1 2 5 10 20 50 100
+python3 -m netconfeval translation --n_runs $n_runs --model $model --policy_types reachability waypoint loadbalancing --batch_size 1 3 11 33
+python3 -m netconfeval translation --n_runs $n_runs --model $model --policy_types reachability waypoint --batch_size 1 2 5 10 25 50
+python3 -m netconfeval translation --n_runs $n_runs --model $model --policy_types reachability --batch_size 1 2 5 10 20 50 100
 
 # Conflict Detection
-python3 netconfeval/step_1_formal_spec_conflict_detection.py --model $model --policy_types reachability waypoint loadbalancing --n_run $n_runs --batch_size 1 3 11 33
+python3 -m netconfeval conflict-detection --model $model --policy_types reachability waypoint loadbalancing --n_runs $n_runs --batch_size 1 3 11 33
 
 # Function Call
 if [ "$fn_call_support" == "1" ]
 then
-  python3 netconfeval/step_1_function_call.py --n_run $n_runs --model $model --policy_types reachability waypoint loadbalancing --batch_size 1 3 11 33
-  python3 netconfeval/step_1_function_call.py --n_run $n_runs --model $model --policy_types reachability waypoint --batch_size 1 2 5 10 25 50
-  python3 netconfeval/step_1_function_call.py --n_run $n_runs --model $model --policy_types reachability --batch_size 1 2 5 10 20 50 100
+  python3 -m netconfeval function-call --n_runs $n_runs --model $model --policy_types reachability waypoint loadbalancing --batch_size 1 3 11 33
+  python3 -m netconfeval function-call --n_runs $n_runs --model $model --policy_types reachability waypoint --batch_size 1 2 5 10 25 50
+  python3 -m netconfeval function-call --n_runs $n_runs --model $model --policy_types reachability --batch_size 1 2 5 10 20 50 100
 else
-  python3 netconfeval/step_1_function_call.py --n_run $n_runs --model $model --policy_types reachability waypoint loadbalancing --batch_size 1 3 11 33 --adhoc
-  python3 netconfeval/step_1_function_call.py --n_run $n_runs --model $model --policy_types reachability waypoint --batch_size 1 2 5 10 25 50 --adhoc
-  python3 netconfeval/step_1_function_call.py --n_run $n_runs --model $model --policy_types reachability --batch_size 1 2 5 10 20 50 100 --adhoc
+  python3 -m netconfeval function-call --n_runs $n_runs --model $model --policy_types reachability waypoint loadbalancing --batch_size 1 3 11 33 --adhoc
+  python3 -m netconfeval function-call --n_runs $n_runs --model $model --policy_types reachability waypoint --batch_size 1 2 5 10 25 50 --adhoc
+  python3 -m netconfeval function-call --n_runs $n_runs --model $model --policy_types reachability --batch_size 1 2 5 10 20 50 100 --adhoc
 fi
 
 # Code Generation
-python3 netconfeval/step_2_code_gen.py --model $model --n_run $n_runs --policy_types shortest_path reachability waypoint loadbalancing --n_retries 10
-python3 netconfeval/step_2_code_gen.py --model $model --n_run $n_runs --policy_types shortest_path reachability waypoint loadbalancing --n_retries 10 --feedback
-python3 netconfeval/step_2_code_gen.py --model $model --n_run $n_runs --policy_types shortest_path reachability waypoint loadbalancing --n_retries 10 --prompts no_detail
-python3 netconfeval/step_2_code_gen.py --model $model --n_run $n_runs --policy_types shortest_path reachability waypoint loadbalancing --n_retries 10 --prompts no_detail --feedback
+python3 -m netconfeval code-gen --model $model --n_runs $n_runs --policy_types shortest_path reachability waypoint loadbalancing --n_retries 10
+python3 -m netconfeval code-gen --model $model --n_runs $n_runs --policy_types shortest_path reachability waypoint loadbalancing --n_retries 10 --feedback
+python3 -m netconfeval code-gen --model $model --n_runs $n_runs --policy_types shortest_path reachability waypoint loadbalancing --n_retries 10 --prompts no_detail
+python3 -m netconfeval code-gen --model $model --n_runs $n_runs --policy_types shortest_path reachability waypoint loadbalancing --n_retries 10 --prompts no_detail --feedback
 
 # Low-Level Configurations
-python3 netconfeval/step_3_low_level.py --n_run $n_runs --model $model --mode none
-python3 netconfeval/step_3_low_level.py --n_run $n_runs --model $model --mode full
-python3 netconfeval/step_3_low_level.py --n_run $n_runs --model $model --mode idx
-python3 netconfeval/step_3_low_level.py --n_run $n_runs --model $model --mode rag --rag_chunk_size 9000
+python3 -m netconfeval low-level --n_runs $n_runs --model $model --mode none
+python3 -m netconfeval low-level --n_runs $n_runs --model $model --mode full
+python3 -m netconfeval low-level --n_runs $n_runs --model $model --mode idx
+python3 -m netconfeval low-level --n_runs $n_runs --model $model --mode rag --rag_chunk_size 9000
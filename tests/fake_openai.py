@@ -0,0 +1,118 @@
+import json
+import re
+
+import httpx
+
+
+def chat_completion(content: str, prompt_tokens: int = 10, completion_tokens: int = 5) -> dict:
+    return {
+        'id': "chatcmpl-fake",
+        'object': "chat.completion",
+        'created': 0,
+        'model': "gpt-4",
+        'choices': [{'index': 0, 'message': {'role': "assistant", 'content': content}, 'finish_reason': "stop"}],
+        'usage': {
+            'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        },
+    }
+
+
+class FakeBatchServer:
+    """In-memory fake of the OpenAI `/v1/files` and `/v1/batches` endpoints, served through an `httpx.MockTransport`.
+
+    Each request of a batch is answered with `respond(body)`. Requests whose custom_id is in `errored` are written to
+    the error file, and the ones in `missing` are left out of both result files. A batch completes after
+    `n_polls` retrievals.
+    """
+
+    def __init__(self, respond: callable, errored: set | None = None, missing: set | None = None,
+                 n_polls: int = 1) -> None:
+        self.respond: callable = respond
+        self.errored: set = errored if errored is not None else set()
+        self.missing: set = missing if missing is not None else set()
+        self.n_polls: int = n_polls
+
+        self.files: dict[str, str] = {}
+        self.batches: dict[str, dict] = {}
+        self.submitted: list[dict] = []
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "POST" and path == "/v1/files":
+            return self._create_file(request)
+        elif request.method == "GET" and re.fullmatch(r"/v1/files/[^/]+/content", path):
+            return httpx.Response(200, text=self.files[path.split("/")[3]])
+        elif request.method == "POST" and path == "/v1/batches":
+            return self._create_batch(json.loads(request.content))
+        elif request.method == "GET" and path.startswith("/v1/batches/"):
+            return self._retrieve_batch(path.split("/")[3])
+
+        return httpx.Response(404, json={'error': {'message': f"Unknown endpoint `{path}`."}})
+
+    def _add_file(self, content: str) -> str:
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = content
+
+        return file_id
+
+    def _create_file(self, request: httpx.Request) -> httpx.Response:
+        # The requests are the JSON lines of the multipart body
+        lines = [line for line in request.read().decode('utf-8').splitlines() if line.startswith('{"custom_id"')]
+        self.submitted.extend(json.loads(line) for line in lines)
+        file_id = self._add_file("\n".join(lines))
+
+        return httpx.Response(200, json={
+            'id': file_id, 'object': "file", 'bytes': 0, 'created_at': 0, 'filename': "requests.jsonl",
+            'purpose': "batch", 'status': "processed"
+        })
+
+    def _create_batch(self, params: dict) -> httpx.Response:
+        batch_id = f"batch-{len(self.batches)}"
+        self.batches[batch_id] = {
+            'id': batch_id, 'object': "batch", 'endpoint': params['endpoint'], 'input_file_id': params['input_file_id'],
+            'completion_window': params['completion_window'], 'status': "in_progress", 'created_at': 0, 'polls': 0
+        }
+
+        return httpx.Response(200, json=self._batch_json(batch_id))
+
+    def _retrieve_batch(self, batch_id: str) -> httpx.Response:
+        batch = self.batches[batch_id]
+        batch['polls'] += 1
+        if batch['status'] == "in_progress" and batch['polls'] >= self.n_polls:
+            self._complete(batch)
+
+        return httpx.Response(200, json=self._batch_json(batch_id))
+
+    def _complete(self, batch: dict) -> None:
+        outputs = []
+        errors = []
+        for line in self.files[batch['input_file_id']].splitlines():
+            request = json.loads(line)
+            custom_id = request['custom_id']
+            if custom_id in self.missing:
+                continue
+            elif custom_id in self.errored:
+                errors.append({
+                    'id': f"response-{custom_id}", 'custom_id': custom_id, 'response': None,
+                    'error': {'code': "batch_expired", 'message': "This request could not be executed."}
+                })
+            else:
+                outputs.append({
+                    'id': f"response-{custom_id}", 'custom_id': custom_id,
+                    'response': {'status_code': 200, 'request_id': custom_id, 'body': self.respond(request['body'])},
+                    'error': None
+                })
+
+        batch['status'] = "completed"
+        batch['output_file_id'] = self._add_file("\n".join(json.dumps(output) for output in outputs))
+        batch['error_file_id'] = self._add_file("\n".join(json.dumps(error) for error in errors)) if errors else None
+        batch['request_counts'] = {
+            'total': len(outputs) + len(errors), 'completed': len(outputs), 'failed': len(errors)
+        }
+
+    def _batch_json(self, batch_id: str) -> dict:
+        return {key: value for key, value in self.batches[batch_id].items() if key != 'polls'}
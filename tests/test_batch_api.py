@@ -0,0 +1,83 @@
+import httpx
+import openai
+import pytest
+
+from fake_openai import FakeBatchServer, chat_completion
+from netconfeval.common.batch_api import BatchResultsTransport, run_batch
+
+
+class _CountingTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport) -> None:
+        self.transport: httpx.BaseTransport = transport
+        self.n_requests: int = 0
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.n_requests += 1
+        return self.transport.handle_request(request)
+
+
+def _body(text: str) -> dict:
+    return {'model': "gpt-4", 'temperature': 0, 'messages': [{'role': "user", 'content': text}]}
+
+
+def _openai_client(transport: httpx.BaseTransport) -> openai.OpenAI:
+    return openai.OpenAI(
+        api_key="fake", base_url="http://fake/v1", max_retries=2, http_client=httpx.Client(transport=transport)
+    )
+
+
+@pytest.fixture
+def server() -> FakeBatchServer:
+    return FakeBatchServer(
+        lambda body: chat_completion(f"answer to {body['messages'][0]['content']}"),
+        errored={"request-1"}, missing={"request-2"}, n_polls=2
+    )
+
+
+def test_batch_results_are_replayed(server: FakeBatchServer) -> None:
+    bodies = [_body("first"), _body("errored"), _body("missing"), _body("first")]
+    results = run_batch(_openai_client(server.transport()), bodies, poll_interval=0)
+
+    # Identical requests are submitted once
+    assert [request['custom_id'] for request in server.submitted] == ["request-0", "request-1", "request-2"]
+
+    transport = _CountingTransport(BatchResultsTransport(results))
+    client = _openai_client(transport)
+
+    completion = client.chat.completions.create(**bodies[0])
+    assert completion.choices[0].message.content == "answer to first"
+    assert completion.usage.prompt_tokens == 10
+
+    # The usage of a response served again is not counted twice
+    completion = client.chat.completions.create(**bodies[3])
+    assert completion.choices[0].message.content == "answer to first"
+    assert completion.usage.prompt_tokens == 0
+    assert transport.n_requests == 2
+
+
+def test_failed_batch_requests_are_not_retried(server: FakeBatchServer) -> None:
+    bodies = [_body("first"), _body("errored"), _body("missing")]
+    results = run_batch(_openai_client(server.transport()), bodies, poll_interval=0)
+
+    transport = _CountingTransport(BatchResultsTransport(results))
+    client = _openai_client(transport)
+
+    with pytest.raises(openai.InternalServerError, match="could not be executed"):
+        client.chat.completions.create(**bodies[1])
+    assert transport.n_requests == 1
+
+    with pytest.raises(openai.NotFoundError, match="not found in the Batch API results"):
+        client.chat.completions.create(**bodies[2])
+    assert transport.n_requests == 2
+
+
+def test_failed_batch_raises(server: FakeBatchServer) -> None:
+    client = _openai_client(server.transport())
+    server.n_polls = 1
+    original = server._complete
+    server._complete = lambda batch: batch.update(status="failed", errors=None)
+
+    with pytest.raises(Exception, match="terminated with status `failed`"):
+        run_batch(client, [_body("first")], poll_interval=0)
+
+    server._complete = original
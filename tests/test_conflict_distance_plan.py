@@ -0,0 +1,51 @@
+from sortedcontainers import SortedSet
+
+from netconfeval.common.policy_cache import load_policies
+from netconfeval.common.utils import PolicyIndex, chunk_list, convert_to_human_language, insert_conflict, \
+    pick_sample, result_key
+from netconfeval.step_1_formal_spec_conflict_distance import RESUME_KEY, build_parser, plan_experiment
+
+ARGV = ['--model', "llama3-ollama", '--n_runs', "2", '--batch_size', "1", "2"]
+
+
+def _planned_statements(args) -> list[list[str]]:
+    # Statements of the work items planned in advance, drawing from the global random state in the planning order
+    policy_types = SortedSet(args.policy_types)
+    max_n_requirements = max(args.batch_size) * len(policy_types)
+    policy_index = PolicyIndex(load_policies(args.policy_file, policy_types, args.policy_cache))
+    statements = []
+    for it in range(args.n_runs):
+        samples = pick_sample(max_n_requirements, policy_index, it, policy_types)
+        for batch_size in args.batch_size:
+            for sample in chunk_list(samples, batch_size * len(policy_types)):
+                for index_start in range(len(sample)):
+                    for index_end in range(index_start, len(sample)):
+                        sample_conflict = list(sample)
+                        insert_conflict(sample_conflict, index_start, index_end + 1)
+                        statements.append(convert_to_human_language(sample_conflict))
+
+    return statements
+
+
+def test_full_sweep_statements_are_unchanged(tmp_path: str) -> None:
+    args = build_parser().parse_args(ARGV + ['--policy_cache', str(tmp_path)])
+    plan = plan_experiment(args)
+
+    statements = _planned_statements(args)
+    assert [work_item['human_language'] for work_item in plan] == statements
+
+    # Resumed runs skip the completed work items without changing the statements of the others
+    completed = {result_key(plan.key(index), RESUME_KEY) for index in range(0, len(plan), 2)}
+    resumed = plan.without(completed)
+    assert len(resumed) == len(plan) - len(completed)
+    assert [work_item['human_language'] for work_item in resumed] == statements[1::2]
+
+
+def test_work_items_by_index_are_stable(tmp_path: str) -> None:
+    args = build_parser().parse_args(ARGV + ['--policy_cache', str(tmp_path)])
+    plan = plan_experiment(args)
+
+    for index in [0, len(plan) // 2, len(plan) - 1]:
+        assert plan[index] == plan[index]
+        assert plan.index(plan.key(index)) == index
+        assert plan[index]['expected_spec'] == list(plan)[index]['expected_spec']
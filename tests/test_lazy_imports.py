@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from netconfeval.cli import COMMANDS
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Imported only when a model of their backend is instantiated
+HEAVY_MODULES = ['torch', 'transformers', 'langchain_openai']
+
+
+def _imported_heavy_modules(module: str) -> list[str]:
+    code = f"import json, sys, {module}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, check=True, capture_output=True, text=True)
+
+    return json.loads(output.stdout)
+
+
+def test_cli_does_not_import_the_model_backends() -> None:
+    assert _imported_heavy_modules("netconfeval.cli") == []
+
+
+@pytest.mark.parametrize('module', sorted(set(COMMANDS.values())))
+def test_commands_do_not_import_the_model_backends(module: str) -> None:
+    assert _imported_heavy_modules(module) == []
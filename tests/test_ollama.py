@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from netconfeval.foundation.langchain.llms.ollama import PooledOllama
+
+
+class _GenerateHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.payloads.append(payload)
+        self.server.connections.add(self.client_address)
+
+        if self.path != "/api/generate":
+            status, body = 404, {'error': "not found"}
+        elif payload['prompt'] == "fail":
+            status, body = 500, {'error': "model crashed"}
+        else:
+            status, body = 200, {
+                'response': payload['prompt'].upper(), 'done_reason': "stop", 'prompt_eval_count': 3, 'eval_count': 2
+            }
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: any) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _GenerateHandler)
+    server.payloads = []
+    server.connections = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def model(server: ThreadingHTTPServer) -> PooledOllama:
+    model = PooledOllama(
+        model="llama3", base_url=f"http://127.0.0.1:{server.server_port}", temperature=0, num_parallel=2
+    )
+
+    yield model
+
+    model.close()
+
+
+def test_generate(server: ThreadingHTTPServer, model: PooledOllama) -> None:
+    result = model.generate(["first", "second", "third"], stop=["\n"])
+
+    assert [generations[0].text for generations in result.generations] == ["FIRST", "SECOND", "THIRD"]
+    assert result.llm_output['token_usage'] == {'prompt_tokens': 9, 'completion_tokens': 6}
+    assert all(payload['options'] == {'temperature': 0, 'stop': ["\n"]} for payload in server.payloads)
+    assert all(payload['keep_alive'] == "30m" and not payload['stream'] for payload in server.payloads)
+    # Connections are reused across requests
+    assert len(server.connections) <= model.num_parallel
+
+
+def test_agenerate_from_several_event_loops(server: ThreadingHTTPServer, model: PooledOllama) -> None:
+    async def agenerate() -> list[str]:
+        result = await model.agenerate(["first", "second", "third"])
+        # The async client of the loop is reused by the following calls
+        result_again = await model.agenerate(["fourth"])
+        await model.aclose()
+
+        return [generations[0].text for generations in result.generations + result_again.generations]
+
+    for _ in range(3):
+        server.connections.clear()
+        assert asyncio.run(agenerate()) == ["FIRST", "SECOND", "THIRD", "FOURTH"]
+        assert len(server.connections) <= model.num_parallel
+
+
+def test_aclose_releases_the_async_client(model: PooledOllama) -> None:
+    async def agenerate_and_close() -> None:
+        await model.ainvoke("first")
+        assert len(model.async_clients) == 1
+
+        await model.aclose()
+        assert len(model.async_clients) == 0
+
+    asyncio.run(agenerate_and_close())
+
+
+def test_failed_generation_raises(model: PooledOllama) -> None:
+    with pytest.raises(Exception, match="status code 500"):
+        model.invoke("fail")
+
+
+def test_close_releases_the_connections(server: ThreadingHTTPServer, model: PooledOllama) -> None:
+    model.invoke("first")
+    assert model.session.adapters["http://"].poolmanager.pools
+
+    model.close()
+    assert not model.session.adapters["http://"].poolmanager.pools
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+from sortedcontainers import SortedSet
+
+from netconfeval.common import policy_cache
+from netconfeval.common.policy_cache import cache_file, load_policies
+from netconfeval.common.utils import load_csv
+
+POLICY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "step_1_policies.csv")
+POLICY_TYPES = SortedSet(["reachability", "waypoint", "loadbalancing"])
+
+
+@pytest.fixture
+def csv_file(tmp_path: str) -> str:
+    path = os.path.join(tmp_path, "policies.csv")
+    with open(POLICY_FILE, 'r') as src, open(path, 'w') as dst:
+        dst.writelines(src.readlines()[:2000])
+
+    return path
+
+
+@pytest.fixture
+def calls(monkeypatch: pytest.MonkeyPatch) -> dict:
+    calls = {'hash': 0, 'compile': 0}
+    csv_hash, compile_policies = policy_cache._csv_hash, policy_cache.compile_policies
+
+    def counted(name: str, function: callable) -> callable:
+        def wrapper(*args: any) -> any:
+            calls[name] += 1
+            return function(*args)
+
+        return wrapper
+
+    monkeypatch.setattr(policy_cache, "_csv_hash", counted('hash', csv_hash))
+    monkeypatch.setattr(policy_cache, "compile_policies", counted('compile', compile_policies))
+
+    return calls
+
+
+def test_compiled_policies_match_the_csv(csv_file: str, tmp_path: str, calls: dict) -> None:
+    cache_path = os.path.join(tmp_path, "cache")
+    assert load_policies(csv_file, POLICY_TYPES, cache_path) == load_csv(csv_file, POLICY_TYPES)
+    assert calls == {'hash': 1, 'compile': 1}
+
+    # An unchanged CSV is neither hashed nor compiled again
+    assert load_policies(csv_file, POLICY_TYPES, cache_path) == load_csv(csv_file, POLICY_TYPES)
+    assert calls == {'hash': 1, 'compile': 1}
+
+
+def test_touched_csv_is_hashed_once(csv_file: str, tmp_path: str, calls: dict) -> None:
+    cache_path = os.path.join(tmp_path, "cache")
+    load_policies(csv_file, POLICY_TYPES, cache_path)
+    os.utime(csv_file, ns=(0, 0))
+
+    # Same content with a new modification time: hashed, not compiled, and the new time is stored
+    for _ in range(2):
+        assert load_policies(csv_file, POLICY_TYPES, cache_path) == load_csv(csv_file, POLICY_TYPES)
+    assert calls == {'hash': 2, 'compile': 1}
+
+
+def test_changed_csv_is_compiled_again(csv_file: str, tmp_path: str, calls: dict) -> None:
+    cache_path = os.path.join(tmp_path, "cache")
+    load_policies(csv_file, POLICY_TYPES, cache_path)
+    path = cache_file(csv_file, cache_path)
+
+    with open(csv_file, 'r') as f:
+        lines = f.readlines()
+    with open(csv_file, 'w') as f:
+        f.writelines(lines[:1000])
+
+    assert load_policies(csv_file, POLICY_TYPES, cache_path) == load_csv(csv_file, POLICY_TYPES)
+    assert calls['compile'] == 2
+    assert cache_file(csv_file, cache_path) == path
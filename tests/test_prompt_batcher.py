@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from netconfeval.foundation.langchain.chat_models.hf import _PromptBatcher
+
+BATCH_TIMEOUT = 0.5
+
+
+@pytest.fixture
+def batches() -> list[list]:
+    return []
+
+
+@pytest.fixture
+def batcher(batches: list[list]) -> _PromptBatcher:
+    def generate_batch(requests: list) -> list[tuple[str, dict]]:
+        batches.append(requests)
+        time.sleep(0.05)
+        return [(str(request), {}) for request in requests]
+
+    batcher = _PromptBatcher(generate_batch, 4, BATCH_TIMEOUT)
+
+    yield batcher
+
+    batcher.close()
+
+
+def test_single_caller_does_not_wait(batcher: _PromptBatcher, batches: list[list]) -> None:
+    start_time = time.monotonic()
+    assert [batcher.submit(i).result() for i in range(3)] == [("0", {}), ("1", {}), ("2", {})]
+
+    assert time.monotonic() - start_time < BATCH_TIMEOUT
+    assert [len(batch) for batch in batches] == [1, 1, 1]
+
+
+def test_concurrent_callers_are_batched(batcher: _PromptBatcher, batches: list[list]) -> None:
+    def caller(k: int) -> None:
+        for i in range(3):
+            assert batcher.submit((k, i)).result() == (str((k, i)), {})
+
+    threads = [threading.Thread(target=caller, args=(k,)) for k in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(len(batch) for batch in batches) == 12
+    assert max(len(batch) for batch in batches) == 4
+
+
+def test_waiting_prompts_are_bucketed_by_length() -> None:
+    batches = []
+    started, release = threading.Event(), threading.Event()
+
+    def generate_batch(requests: list) -> list[tuple[str, dict]]:
+        batches.append(requests)
+        started.set()
+        release.wait()
+        return [(str(request), {}) for request in requests]
+
+    batcher = _PromptBatcher(generate_batch, 4, BATCH_TIMEOUT, length=lambda request: request)
+    try:
+        # The first prompt keeps the batching thread busy while the others are waiting
+        futures = [batcher.submit(0)]
+        started.wait()
+        futures += [batcher.submit(request) for request in [7, 2, 8, 1, 5, 3, 6, 4]]
+        release.set()
+        assert [future.result() for future in futures] == [(str(request), {}) for request in [0, 7, 2, 8, 1, 5, 3, 6, 4]]
+    finally:
+        batcher.close()
+
+    assert batches == [[0], [1, 2, 3, 4], [5, 6, 7, 8]]
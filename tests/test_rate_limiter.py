@@ -0,0 +1,89 @@
+import email.utils
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import openai
+import pytest
+
+from fake_openai import chat_completion
+from netconfeval.common.rate_limiter import RateLimitedTransport, RateLimiter
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.n_requests += 1
+
+        if self.server.failures:
+            status, headers = self.server.failures.pop(0)
+            body = {'error': {'message': "Rate limit reached.", 'type': "requests"}}
+        else:
+            status, headers, body = 200, {}, chat_completion("answer")
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: any) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ChatHandler)
+    server.n_requests = 0
+    server.failures = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def _client(server: ThreadingHTTPServer, tmp_path: str, max_retries: int) -> openai.OpenAI:
+    transport = RateLimitedTransport(RateLimiter("gpt-4", state_path=str(tmp_path)), max_retries=max_retries)
+
+    return openai.OpenAI(
+        api_key="fake", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0,
+        http_client=httpx.Client(transport=transport)
+    )
+
+
+def _create(client: openai.OpenAI) -> str:
+    completion = client.chat.completions.create(model="gpt-4", messages=[{'role': "user", 'content': "question"}])
+
+    return completion.choices[0].message.content
+
+
+def test_retry_after_http_date(server: ThreadingHTTPServer, tmp_path: str) -> None:
+    retry_date = email.utils.formatdate(time.time() + 1, usegmt=True)
+    server.failures = [(429, {'Retry-After': retry_date}), (503, {'Retry-After': "0"})]
+
+    start_time = time.time()
+    assert _create(_client(server, tmp_path, max_retries=2)) == "answer"
+
+    assert server.n_requests == 3
+    # The HTTP date is at most 1s in the future, truncated to the second
+    assert 0 < time.time() - start_time < 2
+
+
+def test_failed_requests_are_retried_once(server: ThreadingHTTPServer, tmp_path: str) -> None:
+    server.failures = [(429, {'Retry-After': "0"})] * 3
+
+    with pytest.raises(openai.RateLimitError):
+        _create(_client(server, tmp_path, max_retries=2))
+
+    # The retries of the transport only, not multiplied by the ones of the OpenAI client
+    assert server.n_requests == 3
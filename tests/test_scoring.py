@@ -0,0 +1,102 @@
+import pytest
+
+from netconfeval.common.scoring import normalize_spec, score_output, score_spec
+
+EXPECTED = {
+    "reachability": {"r1": ["s1", "s2"], "r2": ["s3"]},
+    "waypoint": {"(r1,s1)": ["sw1", "sw2"]},
+    "loadbalancing": {"(r2,s3)": 2},
+}
+
+COUNTS = ['total', 'success', 'fail', 'wrong', 'accuracy']
+
+
+def _counts(scores: dict) -> dict:
+    return {column: scores[column] for column in COUNTS}
+
+
+def _metrics(scores: dict, policy_type: str) -> tuple[float, float, float]:
+    return tuple(pytest.approx(scores[f"{metric}_{policy_type}"]) for metric in ['precision', 'recall', 'f1'])
+
+
+# Counts returned by `compare_result` before the set-based scoring
+@pytest.mark.parametrize("result,counts", [
+    (EXPECTED, {'total': 5, 'success': 5, 'fail': 0, 'wrong': 0, 'accuracy': 1.0}),
+    (
+        {
+            "reachability": {"r1": ["s1"], "r2": ["s3"], "r3": ["s4"]},
+            "waypoint": {"(r1,s1)": ["sw2", "sw1"]},
+            "loadbalancing": {"(r2,s3)": 2, "(r3,s4)": 3},
+        },
+        {'total': 6, 'success': 4, 'fail': 1, 'wrong': 2, 'accuracy': 0.8}
+    ),
+    (
+        {"reachability": {"r1": ["s1", "s2"], "r2": ["s3"]}, "loadbalancing": {"(r2,s3)": 3}},
+        {'total': 4, 'success': 3, 'fail': 2, 'wrong': 1, 'accuracy': 0.6}
+    ),
+])
+def test_counts_match_compare_result(result: dict, counts: dict) -> None:
+    assert _counts(score_spec(EXPECTED, result)) == counts
+
+
+def test_metrics_of_each_policy_type() -> None:
+    result = {
+        "reachability": {"r1": ["s1"], "r2": ["s3"], "r3": ["s4"]},
+        "waypoint": {"(r1,s1)": ["sw2", "sw1"]},
+        "loadbalancing": {"(r2,s3)": 2, "(r3,s4)": 3},
+    }
+    scores = score_spec(EXPECTED, result)
+
+    assert _metrics(scores, "reachability") == (2 / 3, 2 / 3, 2 / 3)
+    assert _metrics(scores, "waypoint") == (1, 1, 1)
+    assert _metrics(scores, "loadbalancing") == (1 / 2, 1, 2 / 3)
+
+    # No returned policy of a type has a precision of 0
+    scores = score_spec(EXPECTED, {"reachability": EXPECTED["reachability"]})
+    assert _metrics(scores, "waypoint") == (0, 0, 0)
+
+
+def test_reachability_implied_by_a_waypoint_is_not_wrong() -> None:
+    expected = {"reachability": {"r1": ["s1"]}, "waypoint": {"(r2,s2)": ["sw1"]}}
+    result = {"reachability": {"r1": ["s1"], "r2": ["s2"]}, "waypoint": {"(r2,s2)": ["sw1"]}}
+
+    assert _counts(score_spec(expected, result)) == {'total': 3, 'success': 2, 'fail': 0, 'wrong': 0, 'accuracy': 1.0}
+
+
+def test_waypoint_requires_all_the_switches() -> None:
+    # `compare_result` counted this waypoint as a success, since it only checked the key
+    result = {**EXPECTED, "waypoint": {"(r1,s1)": ["sw1"]}}
+    scores = score_spec(EXPECTED, result)
+
+    assert _counts(scores) == {'total': 5, 'success': 4, 'fail': 1, 'wrong': 0, 'accuracy': 0.8}
+    assert _metrics(scores, "waypoint") == (1, 0, 0)
+
+
+def test_number_of_paths_as_string() -> None:
+    # `compare_result` counted it as wrong, comparing the expected number with the string
+    result = {**EXPECTED, "loadbalancing": {"(r2,s3)": "2"}}
+
+    assert _counts(score_spec(EXPECTED, result)) == {'total': 5, 'success': 5, 'fail': 0, 'wrong': 0, 'accuracy': 1.0}
+
+
+def test_malformed_values() -> None:
+    result = {
+        "reachability": {"r1": ["s1", {"subnet": "s2"}], "r2": "s3"},
+        "waypoint": {"(r1,s1)": ["sw1", ["sw2"]]},
+        "loadbalancing": {"(r2,s3)": [2]},
+    }
+
+    assert _counts(score_spec(EXPECTED, result)) == {'total': 5, 'success': 2, 'fail': 3, 'wrong': 3, 'accuracy': 0.4}
+
+
+def test_normalize_spec() -> None:
+    output = {
+        "reachability": {"r1": ["s1", "s2"], "r2": ["s3"]},
+        "waypoint": {"(r1, s1)": ["sw1", "sw2"]},
+        "loadbalancing": {"(r2, s3)": 2},
+    }
+
+    assert normalize_spec(output) == EXPECTED
+    # The output itself is not changed
+    assert "(r1, s1)" in output["waypoint"]
+    assert _counts(score_output(EXPECTED, output)) == _counts(score_spec(EXPECTED, EXPECTED))
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+from deepdiff import DeepDiff
+
+from netconfeval.common.spec_diff import deepdiff_keys, diff_keys, format_diff, spec_diff
+
+EXPECTED = {
+    'reachability': {'r1': ["100.0.0.0/24", "100.0.1.0/24"], 'r2': ["100.0.2.0/24"]},
+    'waypoint': {'(r1,100.0.0.0/24)': ["s1"]},
+    'loadbalancing': {'(r1,100.0.0.0/24)': 2},
+}
+
+RESULTS = [
+    # Same policies, lists in another order
+    {
+        'reachability': {'r2': ["100.0.2.0/24"], 'r1': ["100.0.1.0/24", "100.0.0.0/24"]},
+        'waypoint': {'(r1,100.0.0.0/24)': ["s1"]},
+        'loadbalancing': {'(r1,100.0.0.0/24)': 2},
+    },
+    # Missing and additional subnets and routers
+    {
+        'reachability': {'r1': ["100.0.0.0/24", "100.0.3.0/24"], 'r3': ["100.0.2.0/24"]},
+        'waypoint': {'(r1,100.0.0.0/24)': ["s1"]},
+        'loadbalancing': {'(r1,100.0.0.0/24)': 2},
+    },
+    # Changed values and value types
+    {
+        'reachability': {'r1': ["100.0.0.0/24", "100.0.1.0/24"], 'r2': ["100.0.2.0/24"]},
+        'waypoint': {'(r1,100.0.0.0/24)': "s1"},
+        'loadbalancing': {'(r1,100.0.0.0/24)': "2"},
+    },
+    # Missing policy type, and a policy type that is not a map
+    {
+        'reachability': ["r1", "r2"],
+        'waypoint': {'(r1,100.0.0.0/24)': ["s1", "s2"]},
+    },
+    # Additional policy type
+    {**EXPECTED, 'status': "OK"},
+    # No common key in a policy type
+    {**EXPECTED, 'loadbalancing': {'(r2,100.0.0.0/24)': 2}},
+    {},
+]
+
+
+@pytest.mark.parametrize('result', RESULTS)
+def test_spec_diff_matches_deepdiff(result: dict) -> None:
+    diff = spec_diff(EXPECTED, result)
+
+    assert diff_keys(diff) == deepdiff_keys(EXPECTED, result, DeepDiff(EXPECTED, result, ignore_order=True))
+    assert json.loads(format_diff(EXPECTED, result)) == diff
+
+
+def test_spec_diff_sections() -> None:
+    diff = spec_diff(EXPECTED, RESULTS[1])
+
+    assert diff == {
+        'reachability': {
+            'added': {'r1': ["100.0.3.0/24"], 'r3': ["100.0.2.0/24"]},
+            'removed': {'r1': ["100.0.1.0/24"], 'r2': ["100.0.2.0/24"]},
+        }
+    }
+    assert spec_diff(EXPECTED, RESULTS[0]) == {}